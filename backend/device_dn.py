@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+设备号（DN）统一处理：48 位整数键 + 驻留（intern）的 12 位大写 HEX 缓存。
+- 帧内 DN 为 6 字节小端；显示/主题/目录名使用 f"{key:012X}"
+- int 输入视为 DN 数值本身（即 HEX 字符串的数值），bytes 输入按显示顺序（大端）
+- 热路径上同一 DN 只格式化一次，之后直接取缓存中的同一个 str 对象
+
+One place for DN conversions. A DN is a 48-bit integer key; its canonical text
+is the 12-digit uppercase hex of that key (topics, folders, JSON "dn"). Wire
+frames carry the 6 bytes little-endian; an int is the key itself and bytes are
+in display (big-endian) order. Hex strings are formatted once per key and
+interned, so hot paths reuse the same str object for dict lookups.
+"""
+
+import sys
+from typing import Dict, Optional
+
+DN_BITS = 48
+DN_MASK = (1 << DN_BITS) - 1
+_CACHE_MAX = 65536
+
+_hex_by_key: Dict[int, str] = {}
+_key_by_text: Dict[str, int] = {}
+
+
+def dn_hex(key: int) -> str:
+    """Canonical 12-digit uppercase hex for a 48-bit key (cached, interned)."""
+    text = _hex_by_key.get(key)
+    if text is None:
+        if len(_hex_by_key) >= _CACHE_MAX:
+            _hex_by_key.clear()
+        text = _hex_by_key[key] = sys.intern(f"{key:012X}")
+    return text
+
+
+def _parse_text(text: str) -> Optional[int]:
+    clean = text.strip().replace(":", "").replace("-", "").replace(" ", "")
+    if clean[:2] in ("0x", "0X"):
+        clean = clean[2:]
+    if not clean:
+        return None
+    try:
+        return int(clean[-12:], 16)
+    except ValueError:
+        return None
+
+
+def dn_key(value) -> Optional[int]:
+    """48-bit key from a hex string (":"/"-"/space separated ok), int, bytes or byte list; None if invalid."""
+    if type(value) is int:
+        return value & DN_MASK if value >= 0 else None
+    if isinstance(value, str):
+        key = _key_by_text.get(value)
+        if key is None:
+            key = _parse_text(value)
+            if key is not None:
+                if len(_key_by_text) >= _CACHE_MAX:
+                    _key_by_text.clear()
+                _key_by_text[value] = key
+        return key
+    if isinstance(value, (bytes, bytearray, memoryview, list, tuple)):
+        try:
+            raw = bytes(value)[-6:]
+        except (TypeError, ValueError):
+            return None
+        return int.from_bytes(raw, "big") if raw else None
+    return None
+
+
+def to_hex(value, default: Optional[str] = None) -> Optional[str]:
+    """Canonical hex for any DN representation, or ``default`` when it cannot be parsed."""
+    key = dn_key(value)
+    return dn_hex(key) if key is not None else default
+
+
+def frame_dn_key(payload, offset: int = 0) -> Optional[int]:
+    """Key of the frame starting at ``offset`` (5A5A + 6-byte little-endian DN), without parsing it."""
+    if payload is None or len(payload) < offset + 8:
+        return None
+    if payload[offset] != 0x5A or payload[offset + 1] != 0x5A:
+        return None
+    return int.from_bytes(payload[offset + 2:offset + 8], "little")
+
+
+def cache_stats() -> dict:
+    return {"keys": len(_hex_by_key), "texts": len(_key_by_text)}
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+帧扫描 / 解码的实现选择：已构建 _frame_codec（见 frame_codec_build.py）时使用 C 实现，
+否则使用等价的纯 Python 实现。设置 FRAME_CODEC=python 可强制使用 Python 实现。
+
+Frame scanning and decoding backends. The compiled _frame_codec module (built
+by frame_codec_build.py) is picked at import when present; the pure-Python
+code below is the reference and the fallback. FRAME_CODEC=python forces the
+fallback. debug_frame_codec.py in the repo root checks both agree on fuzzed
+input.
+
+Only scan() uses C. Decoding stays in Python: building the per-frame tuples
+(dn_hex, values) that callers need costs as much as unpacking, so a C decoder
+measured no faster than struct.unpack_from.
+
+The C scanner is checked against py_scan on a fixed set of payloads at import;
+on a mismatch a warning goes to stderr and the Python scanner is used.
+FRAME_CODEC=c makes a missing or mismatching extension an ImportError instead.
+"""
+
+import os
+import random
+import struct
+import sys
+import threading
+from typing import Callable, List, Optional, Tuple
+
+try:  # imported as backend.frame_codec (data_receive) or top-level (sink/server)
+    from .device_dn import dn_hex
+    from .frame_layout import HEADER_SIZE, get_plan
+except ImportError:
+    from device_dn import dn_hex
+    from frame_layout import HEADER_SIZE, get_plan
+
+_MODE = os.getenv("FRAME_CODEC", "auto").lower()
+_ffi = _lib = None
+if _MODE != "python":
+    try:
+        try:
+            from ._frame_codec import ffi as _ffi, lib as _lib
+        except ImportError:
+            from _frame_codec import ffi as _ffi, lib as _lib
+    except ImportError:
+        if _MODE == "c":
+            raise
+        _ffi = _lib = None
+
+START = b"\x5a\x5a"
+MIN_FRAME = HEADER_SIZE + 38  # SN = 0
+
+# scan() result: (frames, rest_offset, garbage_bytes, resyncs, crc_errors)
+ScanResult = Tuple[List[bytes], int, int, int, int]
+
+
+def valid_sn_table(valid_sn) -> Optional[bytes]:
+    """256-byte lookup table of accepted SN values (None = accept all)."""
+    if not valid_sn:
+        return None
+    table = bytearray(256)
+    for sn in valid_sn:
+        table[int(sn)] = 1
+    return bytes(table)
+
+
+# ---------------------------------------------------------------- pure Python
+def py_scan(buf: bytes, valid: Optional[bytes] = None,
+            crc_check: Optional[Callable[[bytes], bool]] = None) -> ScanResult:
+    """Cut whole frames out of ``buf``; everything from rest_offset on should be carried over."""
+    frames: List[bytes] = []
+    n = len(buf)
+    idx = 0
+    rest = n
+    garbage = resyncs = crc_errors = 0
+    while idx < n:
+        s = buf.find(START, idx)
+        if s < 0:
+            # A lone trailing 0x5A may be the first half of the next start marker.
+            keep = 1 if buf[n - 1] == 0x5A else 0
+            if n - keep - idx > 0:
+                garbage += n - keep - idx
+                resyncs += 1
+            rest = n - keep
+            break
+        if s > idx:
+            garbage += s - idx
+            resyncs += 1
+        if s + HEADER_SIZE > n:
+            rest = s
+            break
+        sn = buf[s + 8]
+        if valid is not None and not valid[sn]:
+            garbage += 1
+            resyncs += 1
+            idx = s + 1
+            continue
+        end = s + get_plan(sn).frame_len
+        if end > n:
+            rest = s
+            break
+        if buf[end - 2] != 0xA5 or buf[end - 1] != 0xA5:
+            # Not a frame start after all (marker bytes inside data): move on by one byte.
+            garbage += 1
+            resyncs += 1
+            idx = s + 1
+            continue
+        frame = bytes(buf[s:end])
+        if crc_check is not None and not crc_check(frame):
+            crc_errors += 1
+            garbage += 1
+            resyncs += 1
+            idx = s + 1
+            continue
+        frames.append(frame)
+        idx = end
+    return frames, rest, garbage, resyncs, crc_errors
+
+
+def py_decode(data) -> Optional[Tuple[str, int, float, tuple]]:
+    """(dn_hex, sn, ts, values) for one frame, or None; values = SN pressures + mag/gyro/acc."""
+    if len(data) < MIN_FRAME or data[:2] != b"\x5a\x5a" or data[-2:] != b"\xa5\xa5":
+        return None
+    plan = get_plan(data[8])
+    if len(data) != plan.frame_len:
+        return None  # 帧长度与 SN 不符（含尾随字节或多帧拼接）
+    fields = plan.unpack(data)
+    dn_bytes, sn, timestamp, timems = fields[:4]
+    dn = dn_hex(int.from_bytes(dn_bytes, byteorder='little'))
+    return dn, sn, timestamp + timems / 1000, fields[plan.values_start:plan.values_end]
+
+
+def py_decode_many(frames) -> List[Optional[Tuple[str, int, float, tuple]]]:
+    return [py_decode(f) for f in frames]
+
+
+# ---------------------------------------------------------------- C extension
+_tls = threading.local()
+
+
+def _scan_buffers(cap: int):
+    # Per-thread scratch arrays, grown on demand and reused across calls.
+    bufs = getattr(_tls, "scan", None)
+    if bufs is None or bufs[0] < cap:
+        size = max(cap, 256)
+        bufs = _tls.scan = (size, _ffi.new("int64_t[]", size), _ffi.new("int32_t[]", size),
+                            _ffi.new("int64_t[4]"))
+    return bufs
+
+
+def c_scan(buf: bytes, valid: Optional[bytes] = None,
+           crc_check: Optional[Callable[[bytes], bool]] = None) -> ScanResult:
+    if crc_check is not None:
+        return py_scan(buf, valid, crc_check)  # the hook is Python code anyway
+    n = len(buf)
+    if n == 0:
+        return [], 0, 0, 0, 0
+    cap = n // MIN_FRAME + 1
+    _, offs, lens, stats = _scan_buffers(cap)
+    count = _lib.fc_scan(_ffi.from_buffer(buf), n, 0,
+                         _ffi.from_buffer(valid) if valid is not None else _ffi.NULL,
+                         offs, lens, cap, stats)
+    frames = [bytes(buf[offs[i]:offs[i] + lens[i]]) for i in range(count)]
+    return frames, stats[0], stats[1], stats[2], 0
+
+
+def _parity_payloads():
+    # Deterministic mix of whole, truncated and corrupted frames, garbage and
+    # marker bytes inside float data (a short version of debug_frame_codec.py).
+    rng = random.Random(0x5A5A)
+    payloads = []
+    for _ in range(64):
+        parts = []
+        for _ in range(rng.randrange(0, 8)):
+            sn = rng.choice((10, 16, 35, 64, 0, 200))
+            body = bytearray(rng.getrandbits(8) for _ in range((sn + 9) * 4))
+            if rng.random() < 0.3:
+                pos = rng.randrange(len(body) - 1)
+                body[pos:pos + 2] = rng.choice((b"\xa5\xa5", b"\x5a\x5a"))
+            frame = bytearray(b"\x5a\x5a" + rng.getrandbits(48).to_bytes(6, "little") + bytes([sn])
+                              + struct.pack("<IH", rng.getrandbits(32), rng.randrange(1000))
+                              + bytes(body) + b"\xa5\xa5")
+            roll = rng.random()
+            if roll < 0.15:
+                frame = frame[:rng.randrange(1, len(frame))]
+            elif roll < 0.3:
+                frame[rng.randrange(len(frame))] ^= 0xFF
+            elif roll < 0.4:
+                frame = bytearray(rng.getrandbits(8) for _ in range(rng.randrange(1, 40)))
+            parts.append(bytes(frame))
+        if rng.random() < 0.2:
+            parts.append(b"\x5a")
+        payloads.append(b"".join(parts))
+    return payloads
+
+
+def c_parity_error() -> Optional[str]:
+    """None when c_scan matches py_scan on the fixed payloads, else a description."""
+    valid = valid_sn_table((10, 35))
+    for i, payload in enumerate(_parity_payloads()):
+        for table in (None, valid):
+            if c_scan(payload, table) != py_scan(payload, table):
+                return f"payload #{i} ({len(payload)} bytes, valid_sn={'subset' if table else 'all'})"
+    return None
+
+
+if _lib is not None:
+    _mismatch = c_parity_error()
+    if _mismatch:
+        message = f"[frame_codec] C scanner disagrees with py_scan on {_mismatch}; rebuild _frame_codec"
+        if _MODE == "c":
+            raise ImportError(message)
+        print(message + " (using the Python scanner)", file=sys.stderr)
+        _ffi = _lib = None
+
+BACKEND = "c" if _lib is not None else "python"
+decode, decode_many = py_decode, py_decode_many
+scan = c_scan if _lib is not None else py_scan
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+构建可选的 C 加速帧扫描模块 _frame_codec（CFFI API 模式，需要本地 C 编译器）。
+未构建或构建失败时，frame_codec.py 自动退回纯 Python 实现，功能不受影响。
+
+Build the optional C frame codec used by frame_codec.py:
+
+    cd backend && python frame_codec_build.py
+
+This produces _frame_codec.*.so next to this file (ignored by git). Without it
+frame_codec falls back to the pure-Python code. Only scanning is in C: the
+per-frame Python objects decode must return cost more than the C call saves.
+frame_codec checks the C scanner against the Python one on import, and this
+script fails if that check does not pass; debug_frame_codec.py in the repo
+root runs the longer fuzz test and benchmark. With the compose bind mount
+(./backend:/backend) build inside the container so the module matches the
+container's Python:
+
+    docker compose exec backend python frame_codec_build.py
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+from cffi import FFI
+
+CDEF = """
+int fc_scan(const uint8_t *buf, int64_t n, int64_t start, const uint8_t *valid_sn,
+            int64_t *offs, int32_t *lens, int cap, int64_t *stats);
+"""
+
+SOURCE = r"""
+#include <stdint.h>
+
+#define FC_HEADER 15            /* 5A5A + DN(6) + SN + ts(4) + ms(2) */
+#define FC_TAIL   38            /* 9 floats + A5A5 */
+
+/* Same rules as FrameScanner.feed (without the CRC hook):
+   stats[0] = offset where the carry-over starts (n when nothing is carried),
+   stats[1] = garbage bytes skipped, stats[2] = resync count.
+   Returns the number of frames written to offs/lens. */
+int fc_scan(const uint8_t *buf, int64_t n, int64_t start, const uint8_t *valid_sn,
+            int64_t *offs, int32_t *lens, int cap, int64_t *stats)
+{
+    int64_t idx = start, rest = n, garbage = 0, resyncs = 0;
+    int count = 0;
+    while (idx < n) {
+        int64_t s = -1, i;
+        for (i = idx; i + 1 < n; i++) {
+            if (buf[i] == 0x5A && buf[i + 1] == 0x5A) { s = i; break; }
+        }
+        if (s < 0) {
+            int64_t keep = (buf[n - 1] == 0x5A) ? 1 : 0;
+            if (n - keep - idx > 0) { garbage += n - keep - idx; resyncs++; }
+            rest = n - keep;
+            break;
+        }
+        if (s > idx) { garbage += s - idx; resyncs++; }
+        if (s + FC_HEADER > n) { rest = s; break; }
+        int sn = buf[s + 8];
+        if (valid_sn != NULL && !valid_sn[sn]) { garbage++; resyncs++; idx = s + 1; continue; }
+        int64_t end = s + FC_HEADER + (int64_t)sn * 4 + FC_TAIL;
+        if (end > n) { rest = s; break; }
+        if (buf[end - 2] != 0xA5 || buf[end - 1] != 0xA5) { garbage++; resyncs++; idx = s + 1; continue; }
+        if (count >= cap) { rest = s; break; }   /* caller sizes cap so this does not happen */
+        offs[count] = s;
+        lens[count] = (int32_t)(end - s);
+        count++;
+        idx = end;
+    }
+    stats[0] = rest;
+    stats[1] = garbage;
+    stats[2] = resyncs;
+    return count;
+}
+"""
+
+ffibuilder = FFI()
+ffibuilder.cdef(CDEF)
+ffibuilder.set_source("_frame_codec", SOURCE, extra_compile_args=["-O2"])
+
+
+def main() -> int:
+    here = os.path.dirname(os.path.abspath(__file__))
+    tmp = tempfile.mkdtemp(prefix="frame_codec_")
+    try:
+        built = ffibuilder.compile(tmpdir=tmp, verbose=False)
+        target = os.path.join(here, os.path.basename(built))
+        shutil.copy2(built, target)
+        print(f"[frame_codec] built {target}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    sys.path.insert(0, here)
+    import frame_codec  # runs the import-time parity check against the new module
+    if frame_codec.BACKEND != "c":
+        print("[frame_codec] the built module is not used (see the message above)", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+按 SN（压力通道数）缓存的帧解码方案：10/16/35/64 通道鞋垫共用一处布局定义。
+- 预编译整帧 struct.Struct、各字段偏移、CSV 表头、JSON 字段到列的切片
+- sensor2 解码、sink.CsvHandle 表头、bridge 历史缓冲共用同一份方案
+- 新帧版本只需在 DecodePlan 中补充
+
+Decode plans cached per SN so mixed 10/16/35/64-channel fleets do not rebuild
+offsets, struct formats and headers on every frame. Shared by sensor2
+(decode), sink.CsvHandle (CSV header) and the bridge (history columns);
+plan_stats() lists the layouts seen by this process.
+"""
+
+import struct
+import threading
+import time
+from typing import Dict, List, Tuple
+
+HEADER_SIZE = 2 + 6 + 1 + 4 + 2  # markers + DN + SN + timestamp + ms
+IMU_FIELDS = ("Mag_x", "Mag_y", "Mag_z", "Gyro_x", "Gyro_y", "Gyro_z", "Acc_x", "Acc_y", "Acc_z")
+
+
+class DecodePlan:
+    """Precomputed layout of one SN: frame struct, offsets, CSV header and column slices.
+    单个 SN 的预计算布局。
+
+    Unpacked tuple order: (dn_bytes, sn, ts_sec, ts_ms, p1..pSN, mag3, gyro3, acc3, end_marker).
+    Value rows (CSV / history) are [p1..pSN, mag3, gyro3, acc3]; ``slices`` maps the
+    JSON keys p/mag/gyro/acc onto that row.
+    """
+
+    __slots__ = ("sn", "frame_len", "struct", "values_start", "values_end", "pressure_offset",
+                 "mag_offset", "gyro_offset", "acc_offset", "end_offset", "csv_header",
+                 "slices", "width", "created", "uses")
+
+    def __init__(self, sn: int):
+        self.sn = sn
+        self.struct = struct.Struct(f"<2x6sBIH{sn}f9f2s")
+        self.frame_len = self.struct.size
+        # Offsets inside the frame (bytes).
+        self.pressure_offset = HEADER_SIZE
+        self.mag_offset = HEADER_SIZE + sn * 4
+        self.gyro_offset = self.mag_offset + 12
+        self.acc_offset = self.gyro_offset + 12
+        self.end_offset = self.acc_offset + 12
+        # Positions inside the unpacked tuple.
+        self.values_start = 4
+        self.values_end = 4 + sn + 9
+        self.width = sn + 9
+        self.csv_header = ["Timestamp"] + [f"P{i + 1}" for i in range(sn)] + list(IMU_FIELDS)
+        self.slices = {
+            "p": slice(0, sn),
+            "mag": slice(sn, sn + 3),
+            "gyro": slice(sn + 3, sn + 6),
+            "acc": slice(sn + 6, sn + 9),
+        }
+        self.created = time.time()
+        self.uses = 0
+
+    def unpack(self, data) -> Tuple:
+        """Unpack a full frame; raises struct.error when ``data`` is shorter than frame_len."""
+        self.uses += 1
+        return self.struct.unpack_from(data)
+
+
+_plans: Dict[int, DecodePlan] = {}
+_plans_lock = threading.Lock()
+
+
+def get_plan(sn: int) -> DecodePlan:
+    """Return the cached plan for ``sn`` (0-255), building it on first use."""
+    plan = _plans.get(sn)
+    if plan is None:
+        with _plans_lock:
+            plan = _plans.get(sn)
+            if plan is None:
+                plan = _plans[sn] = DecodePlan(int(sn))
+    return plan
+
+
+def csv_header(sn: int) -> List[str]:
+    return get_plan(sn).csv_header
+
+
+def plan_stats() -> List[dict]:
+    """Active SN layouts in this process, for metrics endpoints and [STATS] lines."""
+    with _plans_lock:
+        plans = sorted(_plans.values(), key=lambda p: p.sn)
+    return [{
+        "sn": p.sn,
+        "frame_len": p.frame_len,
+        "columns": len(p.csv_header),
+        "uses": p.uses,
+        "since": p.created,
+    } for p in plans]
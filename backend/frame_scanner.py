@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+增量帧扫描器：从任意切分的字节流中提取 5A5A … A5A5 传感器帧。
+- 按 SN 计算帧长，并校验该位置的结束标志（不用 find(END)，浮点数据中出现 A5A5 也不会误切）
+- 按来源（UDP 发送端地址）保存未完整的尾部，下一包到达时拼接继续解析
+- MQTT 消费端（sink / raw_parser_service）不做跨消息拼接：同一 raw topic 混有多个设备、
+  多个 bridge 与多条发布连接的数据，按 topic 拼接会把不同设备的片段接在一起
+- 可选 CRC 校验钩子；统计重同步次数与丢弃的垃圾字节
+
+Incremental scanner for 5A5A … A5A5 sensor frames, shared by data_receive,
+raw_parser_service and sink. Frame length comes from the SN byte and the end
+marker is checked at exactly that offset, so 0xA5A5 inside float data cannot
+split a frame. A truncated tail is carried over per source until the next
+chunk from that source arrives.
+
+Carry-over is only sound when a source is a single sender, i.e. the UDP
+address in data_receive. The raw MQTT topic interleaves every device, bridge
+and publisher connection, so the MQTT consumers build the scanner with
+``max_carry=0`` and treat each payload as self-contained; a tail left at the
+end of a payload is counted in carry_dropped_bytes.
+
+Frame layout (see sensor2.parse_sensor_data):
+    5A 5A | DN (6) | SN (1) | timestamp u32 | ms u16 | SN x f32 | 9 x f32 | A5 A5
+"""
+
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+try:  # imported as backend.frame_scanner (data_receive) or top-level (sink/server)
+    from . import frame_codec
+except ImportError:
+    import frame_codec
+
+
+class FrameScanner:
+    """Extract complete frames from chunks, carrying partial frames per source.
+    按来源拼接分片并提取完整帧。
+
+    crc_check: optional ``callable(frame: bytes) -> bool``; frames it rejects are
+    skipped and the scan resynchronises on the next start marker.
+    valid_sn: optional collection of accepted SN values (e.g. {10, 16, 35, 64}).
+    """
+
+    def __init__(self, crc_check: Optional[Callable[[bytes], bool]] = None, valid_sn=None,
+                 max_carry: int = 64 * 1024, carry_ttl: float = 5.0, max_sources: int = 4096):
+        self.crc_check = crc_check
+        self.valid_sn = frozenset(valid_sn) if valid_sn else None
+        self._valid_table = frame_codec.valid_sn_table(self.valid_sn)
+        self.max_carry = max_carry
+        self.carry_ttl = carry_ttl
+        self.max_sources = max_sources
+        self._carry: Dict[Hashable, Tuple[float, bytes]] = {}
+        self._lock = threading.Lock()
+        self.frames = 0
+        self.resyncs = 0
+        self.garbage_bytes = 0
+        self.carried = 0
+        self.carry_dropped_bytes = 0
+        self.crc_errors = 0
+
+    def feed(self, data: bytes, source: Hashable = None) -> List[bytes]:
+        """Scan ``data`` (prefixed by the carry-over of ``source``) and return whole frames."""
+        now = time.monotonic()
+        with self._lock:
+            held = self._carry.pop(source, None)
+        if held is not None:
+            ts, tail = held
+            if now - ts <= self.carry_ttl:
+                data = tail + bytes(data)
+            else:
+                self.carry_dropped_bytes += len(tail)
+
+        # The C scanner is used when built (see frame_codec); same rules either way.
+        frames, rest_at, garbage, resyncs, crc_errors = frame_codec.scan(data, self._valid_table, self.crc_check)
+        self.garbage_bytes += garbage
+        self.resyncs += resyncs
+        self.crc_errors += crc_errors
+        rest = data[rest_at:]
+
+        self.frames += len(frames)
+        if rest:
+            if len(rest) > self.max_carry:
+                self.carry_dropped_bytes += len(rest)
+            else:
+                self.carried += 1
+                with self._lock:
+                    if len(self._carry) >= self.max_sources:
+                        # Forget the oldest partial frame rather than growing without bound.
+                        oldest = min(self._carry, key=lambda k: self._carry[k][0])
+                        self.carry_dropped_bytes += len(self._carry.pop(oldest)[1])
+                    self._carry[source] = (now, bytes(rest))
+        return frames
+
+    def reset(self, source: Hashable = None, all_sources: bool = False) -> None:
+        with self._lock:
+            if all_sources:
+                self._carry.clear()
+            else:
+                self._carry.pop(source, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._carry)
+        return {
+            "frames": self.frames,
+            "resyncs": self.resyncs,
+            "garbage_bytes": self.garbage_bytes,
+            "carried": self.carried,
+            "carry_dropped_bytes": self.carry_dropped_bytes,
+            "crc_errors": self.crc_errors,
+            "pending_sources": pending,
+            "backend": frame_codec.BACKEND,
+        }
+
+
+def iter_frames(blob: bytes):
+    """Stateless helper: frames of one self-contained payload (no carry-over)."""
+    return iter(FrameScanner().feed(blob))
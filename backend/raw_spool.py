@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+"""
+MQTT 断线期间的本地磁盘缓存（spool）：仅追加写入的分段文件 + 读位置索引。
+- 断线（或仍有积压未回放）时，原始批次按到达顺序追加到 seg-XXXXXXXX.log
+- 重连后由回放线程限速读取并重新发布；只有一个 FIFO 日志，因此每个 DN 的顺序不变
+- spool.idx 记录已确认（PUBACK）的位置；进程重启后从该位置继续回放（至少一次）
+- 总大小超过 MAX_BYTES 或分段超过 MAX_AGE 时删除最旧的分段
+
+On-disk spool for the UDP bridge. Batches that cannot be published (broker
+down, or an older backlog still replaying) are appended to segment files in
+arrival order; a replayer reads them back at a throttled rate once the
+connection is up. There is a single FIFO log, so per-DN order is kept, and
+live data keeps going to the spool until the backlog is drained.
+
+spool.idx holds the position up to which replayed records were acknowledged;
+after a restart replay resumes there (at-least-once). Segments are dropped
+oldest first when the spool exceeds max_bytes or a segment exceeds max_age.
+
+Record layout: crc32 u32 | payload_len u32 | captured_at f64 | topic_len u16 | topic | payload
+(little-endian; crc32 covers topic + payload).
+"""
+
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import BinaryIO, List, Optional, Tuple
+
+RECORD_HEAD = struct.Struct("<IIdH")
+SEGMENT_PREFIX = "seg-"
+SEGMENT_SUFFIX = ".log"
+INDEX_NAME = "spool.idx"
+
+# (segment seq, byte offset)
+Position = Tuple[int, int]
+
+
+class RawSpool:
+    """Segmented append-only spool with a persisted read position.
+    分段追加写入的磁盘缓存，带持久化读位置。
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 16 * 1024 * 1024,
+                 max_bytes: int = 1024 * 1024 * 1024, max_age_sec: float = 7 * 86400,
+                 fsync_sec: float = 1.0):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max(max_bytes, 2 * 1024 * 1024)
+        self.segment_bytes = max(64 * 1024, min(segment_bytes, self.max_bytes // 2))
+        self.max_age_sec = max_age_sec
+        self.fsync_sec = fsync_sec
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._sizes = {seq: os.path.getsize(self._seg_path(seq)) for seq in self._list_segments()}
+        committed = self._load_index() or (1, 0)
+        # Always start a fresh segment: a torn tail in the last one is skipped on read.
+        # 启动时总是新建分段；上次进程残留的半条记录在读取时跳过。
+        self._write_seq = max(max(self._sizes) + 1 if self._sizes else 1, committed[0])
+        self._sizes[self._write_seq] = 0
+        committed = self._skip_finished(committed)
+        self._committed: Position = committed
+        self._read: Position = committed
+        self._reader: Optional[BinaryIO] = None
+        self._reader_seq = 0
+        self._outstanding = 0  # read but not yet handed to the MQTT client
+        self._index_saved = 0.0
+
+        self._writer: BinaryIO = open(self._seg_path(self._write_seq), "ab")
+        self._last_fsync = time.monotonic()
+        self._last_age_check = 0.0
+
+        self.appended = 0
+        self.replayed = 0
+        self.dropped_segments = 0
+        self.dropped_bytes = 0
+        self.corrupt_records = 0
+        self._drop_consumed()
+
+    # ------------------------------------------------------------ files
+    def _seg_path(self, seq: int) -> str:
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{seq:08d}{SEGMENT_SUFFIX}")
+
+    def _list_segments(self) -> List[int]:
+        seqs = []
+        for entry in os.scandir(self.directory):
+            name = entry.name
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                try:
+                    seqs.append(int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+                except ValueError:
+                    continue
+        return sorted(seqs)
+
+    def _load_index(self) -> Optional[Position]:
+        try:
+            with open(os.path.join(self.directory, INDEX_NAME), "r", encoding="utf-8") as fh:
+                obj = json.load(fh)
+            return int(obj["seq"]), int(obj["offset"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _save_index(self) -> None:
+        path = os.path.join(self.directory, INDEX_NAME)
+        tmp = path + ".tmp"
+        seq, offset = self._committed
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump({"seq": seq, "offset": offset, "updated": time.time()}, fh)
+        os.replace(tmp, path)
+
+    def _skip_finished(self, position: Position) -> Position:
+        # A position at the end of (or inside a missing) older segment means "start of the next one".
+        seq, offset = position
+        if seq == self._write_seq or (seq in self._sizes and offset < self._sizes[seq]):
+            return position
+        later = [s for s in self._sizes if s > seq]
+        return (min(later), 0) if later else (self._write_seq, 0)
+
+    def _delete_segment(self, seq: int) -> int:
+        size = self._sizes.pop(seq, 0)
+        if self._reader is not None and self._reader_seq == seq:
+            self._reader.close()
+            self._reader = None
+        try:
+            os.remove(self._seg_path(seq))
+        except OSError:
+            pass
+        return size
+
+    def _drop_consumed(self) -> None:
+        # Segments entirely before the committed position are no longer needed.
+        for seq in sorted(self._sizes):
+            if seq >= self._committed[0] or seq == self._write_seq:
+                break
+            self._delete_segment(seq)
+
+    def _drop_oldest(self) -> None:
+        # Bound hit: lose the oldest undelivered segment and move the cursors past it.
+        seq = min(self._sizes)
+        size = self._delete_segment(seq)
+        self.dropped_segments += 1
+        self.dropped_bytes += size
+        nxt = min(self._sizes) if self._sizes else self._write_seq
+        if self._committed[0] <= seq:
+            self._committed = (nxt, 0)
+        if self._read[0] <= seq:
+            self._read = (nxt, 0)
+
+    def _enforce_bounds(self, incoming: int) -> None:
+        while len(self._sizes) > 1 and sum(self._sizes.values()) + incoming > self.max_bytes:
+            self._drop_oldest()
+        now = time.monotonic()
+        if self.max_age_sec > 0 and now - self._last_age_check >= 10.0:
+            self._last_age_check = now
+            cutoff = time.time() - self.max_age_sec
+            for seq in sorted(self._sizes):
+                if seq == self._write_seq:
+                    break
+                try:
+                    if os.path.getmtime(self._seg_path(seq)) >= cutoff:
+                        break
+                except OSError:
+                    pass
+                self._drop_oldest()
+
+    # ------------------------------------------------------------ writer
+    def append(self, topic: str, payload: bytes) -> None:
+        """Append one batch (flushed to the OS at once, fsync at most every fsync_sec)."""
+        body_topic = topic.encode("utf-8")
+        record = RECORD_HEAD.pack(zlib.crc32(payload, zlib.crc32(body_topic)), len(payload),
+                                  time.time(), len(body_topic)) + body_topic + payload
+        with self._lock:
+            self._enforce_bounds(len(record))
+            if self._sizes[self._write_seq] and self._sizes[self._write_seq] + len(record) > self.segment_bytes:
+                self._roll()
+            self._writer.write(record)
+            self._writer.flush()
+            self._sizes[self._write_seq] += len(record)
+            self.appended += 1
+            now = time.monotonic()
+            if now - self._last_fsync >= self.fsync_sec:
+                os.fsync(self._writer.fileno())
+                self._last_fsync = now
+
+    def _roll(self) -> None:
+        self._writer.flush()
+        os.fsync(self._writer.fileno())
+        self._writer.close()
+        self._write_seq += 1
+        self._writer = open(self._seg_path(self._write_seq), "ab")
+        self._sizes[self._write_seq] = 0
+
+    # ------------------------------------------------------------ reader
+    def has_backlog(self) -> bool:
+        with self._lock:
+            return self._outstanding > 0 or self._read < (self._write_seq, self._sizes[self._write_seq])
+
+    def capturing(self, connected: bool) -> bool:
+        """True when new batches must go to the spool (offline, or older records not yet replayed)."""
+        return not connected or self.has_backlog()
+
+    def read(self, max_records: int = 16) -> List[Tuple[str, bytes, Position, Position]]:
+        """Next records from the read cursor as (topic, payload, start, end); advances the cursor.
+
+        Each record must be followed by sent() once published, or unread() if it was not, so
+        live batches cannot overtake records that were read but not yet handed to the client.
+        """
+        out: List[Tuple[str, bytes, Position, Position]] = []
+        with self._lock:
+            while len(out) < max_records:
+                seq, offset = self._read
+                limit = self._sizes.get(seq)
+                if limit is None or offset >= limit:
+                    if seq >= self._write_seq:
+                        break
+                    nxt = [s for s in self._sizes if s > seq]
+                    self._read = (min(nxt), 0) if nxt else (self._write_seq, 0)
+                    continue
+                if self._reader is None or self._reader_seq != seq:
+                    if self._reader is not None:
+                        self._reader.close()
+                    self._reader = open(self._seg_path(seq), "rb")
+                    self._reader_seq = seq
+                self._reader.seek(offset)
+                head = self._reader.read(RECORD_HEAD.size)
+                record = None
+                if len(head) == RECORD_HEAD.size:
+                    crc, plen, _, tlen = RECORD_HEAD.unpack(head)
+                    body = self._reader.read(tlen + plen)
+                    if len(body) == tlen + plen and zlib.crc32(body[tlen:], zlib.crc32(body[:tlen])) == crc:
+                        record = (body[:tlen].decode("utf-8", "replace"), body[tlen:])
+                if record is None:
+                    # Torn or corrupt tail (crash mid-write): skip the rest of this segment.
+                    # 记录不完整或校验失败：跳过该分段剩余部分。
+                    self.corrupt_records += 1
+                    self._read = (seq, limit)
+                    continue
+                end = (seq, offset + RECORD_HEAD.size + tlen + plen)
+                out.append((record[0], record[1], (seq, offset), end))
+                self._read = end
+            self._outstanding += len(out)
+        return out
+
+    def sent(self) -> None:
+        """One record returned by read() was handed to the MQTT client."""
+        with self._lock:
+            self._outstanding = max(self._outstanding - 1, 0)
+
+    def unread(self, position: Position) -> None:
+        """Move the read cursor back to a record that (with all after it) was not handed to the client."""
+        with self._lock:
+            self._outstanding = 0
+            if position < self._read:
+                self._read = max(position, self._committed)
+
+    def commit(self, position: Position) -> None:
+        """One more record before ``position`` was delivered; the index is written at most every 0.5 s."""
+        with self._lock:
+            self.replayed += 1
+            if position <= self._committed:
+                return
+            position = self._skip_finished(position)
+            moved_segment = position[0] != self._committed[0]
+            self._committed = position
+            now = time.monotonic()
+            if moved_segment:
+                self._drop_consumed()
+            if moved_segment or now - self._index_saved >= 0.5:
+                self._save_index()
+                self._index_saved = now
+
+    def stats(self) -> dict:
+        with self._lock:
+            seq, offset = self._read
+            backlog = sum(size for s, size in self._sizes.items() if s >= seq) - offset
+            return {
+                "segments": len(self._sizes),
+                "bytes": sum(self._sizes.values()),
+                "backlog_bytes": max(backlog, 0),
+                "appended": self.appended,
+                "replayed": self.replayed,
+                "dropped_segments": self.dropped_segments,
+                "dropped_bytes": self.dropped_bytes,
+                "corrupt_records": self.corrupt_records,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            try:
+                self._writer.flush()
+                os.fsync(self._writer.fileno())
+            except (OSError, ValueError):
+                pass
+            self._writer.close()
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+            if self._sizes.get(self._write_seq) == 0:
+                self._delete_segment(self._write_seq)  # nothing written this run
+            self._save_index()
+
+    def discard(self) -> None:
+        """Close and remove all segments and the index (a drained spool that is no longer used)."""
+        self.close()
+        with self._lock:
+            for seq in list(self._sizes):
+                self._delete_segment(seq)
+            try:
+                os.remove(os.path.join(self.directory, INDEX_NAME))
+                os.rmdir(self.directory)  # only succeeds when nothing else lives there
+            except OSError:
+                pass
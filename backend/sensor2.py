@@ -5,12 +5,20 @@ Helper routines for parsing Sensor v2 binary frames into structured readings.
 Sensor v2 二进制帧解析工具，将底层数据转换为结构化读数。
 """
 
-import struct
 import csv
 import numpy as np
 import pandas as pd
 import os
 
+try:  # imported as backend.sensor2 (data_receive) or as top-level sensor2 (sink/server)
+    from . import frame_codec
+    from .device_dn import to_hex as to_dn_hex
+    from .frame_layout import get_plan
+except ImportError:
+    import frame_codec
+    from device_dn import to_hex as to_dn_hex
+    from frame_layout import get_plan
+
 coordinate_x_35_insole = [
     -40.6, -21.2, -6.5, 7.2, 17.3,
     -39.6, -24.3, -8.2, 4.3, 15.2,
@@ -146,34 +154,26 @@ def parse_sensor_data(data):
     """Parse one binary packet into SensorData or return None when invalid.
     将单个二进制数据包解析为 SensorData；数据非法时返回 None。
     """
-    # Verify frame markers before unpacking any payload fields.
-    # 首先检查起始和结束标志是否正确。
-    if data[:2] == b'\x5a\x5a' and data[-2:] == b'\xa5\xa5':
-        # 解析DN和SN字段
-        value = int.from_bytes(data[2:8], byteorder='little')
-        dn = f"{value:012X}"
-        sn = struct.unpack('B', data[8:9])[0]
-        # 解析时间戳（4字节整数）
-        timestamp = struct.unpack('<I', data[9:13])[0]
-        # 解析时间戳毫秒（2字节整数）
-        timems = struct.unpack('<H', data[13:15])[0]
-        # 设置压力传感器数据的起始位置
-        pressure_start_position = 15
-        # 解析每个压力传感器的整数值
-        pressure_sensors = [struct.unpack('<f', data[pressure_start_position + i * 4:pressure_start_position + (i + 1) * 4])[0]
-                            for i in range(sn)]
-        # 设置和解析磁力计、陀螺仪、加速度计数据的起始和结束位置
-        magnetometer_start = pressure_start_position + sn * 4
-        magnetometer = struct.unpack('<3f', data[magnetometer_start:magnetometer_start + 12])
-        gyroscope_start = magnetometer_start + 12
-        gyroscope = struct.unpack('<3f', data[gyroscope_start:gyroscope_start + 12])
-        accelerometer_start = gyroscope_start + 12
-        accelerometer = struct.unpack('<3f', data[accelerometer_start:accelerometer_start + 12])
-        
-        return SensorData(dn,sn,timestamp + timems/1000, pressure_sensors, magnetometer, gyroscope, accelerometer)
+    # 检查起止标志与帧长后，按 SN 的解码方案一次取出 DN、时间戳与全部数值
+    decoded = frame_codec.decode(data)
     # 忽略标志错误的数据包
-    else:
+    if decoded is None:
         return None
+    return _to_sensor_data(decoded)
+
+
+def parse_sensor_frames(frames):
+    """Parse a list of frames (e.g. one FrameScanner.feed result) in one go.
+    批量解析多帧；已构建 C 扩展时一次调用完成全部解码。返回与 frames 等长的列表，非法帧为 None。
+    """
+    return [_to_sensor_data(d) if d is not None else None for d in frame_codec.decode_many(frames)]
+
+
+def _to_sensor_data(decoded):
+    dn, sn, timestamp, values = decoded
+    return SensorData(dn, sn, timestamp, list(values[:sn]),
+                      values[sn:sn + 3], values[sn + 3:sn + 6], values[sn + 6:sn + 9])
+
 
 # 收集数据函数
 # SensorData对象列表 -> CSV
@@ -200,24 +200,10 @@ def save_sensor_data_to_csv(sensor_data_list, filename):
     # 分组：dn -> list[SensorData]
     groups = {}
     for sd in sensor_data_list:
-        # 将 dn（可能是 bytes/tuple/list）统一转成 hashable 的 bytes，再到大写 HEX 字符串用于文件名和头
-        if isinstance(sd.dn, (bytes, bytearray)):
-            dn_bytes = bytes(sd.dn)
-        elif isinstance(sd.dn, (tuple, list)):
-            dn_bytes = bytes(sd.dn)
-        else:
-            # 若用户在别处把 dn 设成了 int/str，这里也做个兜底
-            if isinstance(sd.dn, int):
-                # 将 int 当作 6 字节（大端）截断/填充
-                dn_bytes = sd.dn.to_bytes(6, byteorder="little", signed=False)
-            elif isinstance(sd.dn, str):
-                # 允许形如 "E0 0A D6 77 38 66" 或 "E00AD6773866"
-                hex_str = sd.dn.replace(" ", "").replace("-", "")
-                dn_bytes = bytes.fromhex(hex_str[-12:].rjust(12, "0"))
-            else:
-                raise TypeError(f"Unsupported dn type: {type(sd.dn)}")
-
-        dn_hex = dn_bytes.hex().upper()
+        # dn 可能是 HEX 字符串 / int / bytes，统一为 12 位大写 HEX 用于文件名和头
+        dn_hex = to_dn_hex(sd.dn)
+        if dn_hex is None:
+            raise TypeError(f"Unsupported dn: {sd.dn!r}")
         groups.setdefault(dn_hex, []).append(sd)
 
     # 逐组写文件
@@ -234,13 +220,7 @@ def save_sensor_data_to_csv(sensor_data_list, filename):
             header_writer.writerow([f"// DN: {dn_hex}, SN: {sn}"])
 
             # 列标题依据 sn 构建
-            fieldnames = (
-                ["Timestamp"]
-                + [f"P{i + 1}" for i in range(sn)]
-                + ["Mag_x", "Mag_y", "Mag_z",
-                   "Gyro_x", "Gyro_y", "Gyro_z",
-                   "Acc_x", "Acc_y", "Acc_z"]
-            )
+            fieldnames = get_plan(sn).csv_header
             writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
             writer.writeheader()
 
@@ -14,38 +14,37 @@ MQTT sink that focuses on JSON payloads but still accepts legacy binary frames:
 - Legacy binary frames (A5A...A5A5) are parsed via sensor2.parse_sensor_data
 """
 
-import os, sys, csv, json, time, signal, pathlib, configparser, threading
+import os, sys, csv, gzip, json, shutil, time, signal, pathlib, configparser, threading
 import queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone, timedelta
 from typing import Dict, Tuple, Optional
 
 import paho.mqtt.client as mqtt
 import psycopg2
-from psycopg2 import sql
+from psycopg2 import sql, extras
+
+try:  # imported as backend.sink (data_receive embedded store) or run as sink.py
+    from .device_dn import to_hex as dn_to_canonical
+    from .frame_layout import get_plan
+    from .frame_scanner import FrameScanner
+    from .store_watch import StoreWatcher
+except ImportError:
+    from device_dn import to_hex as dn_to_canonical
+    from frame_layout import get_plan
+    from frame_scanner import FrameScanner
+    from store_watch import StoreWatcher
 
 JST = timezone(timedelta(hours=9))
 
 # 可选：如存在则用于解析旧二进制帧
 try:
-    from sensor2 import parse_sensor_data as parse_binary_frame
+    try:
+        from .sensor2 import parse_sensor_frames as parse_binary_frames
+    except ImportError:
+        from sensor2 import parse_sensor_frames as parse_binary_frames
 except Exception:
-    parse_binary_frame = None
-
-# ========== 常量 ==========
-START = b"\x5a\x5a"
-END   = b"\xa5\xa5"
-
-def extract_frames(payload: bytes):
-    # Iterate through legacy payloads and yield each framed segment.
-    # 遍历旧版负载并逐帧返回被包裹的数据片段。
-    i, n = 0, len(payload)
-    while True:
-        s = payload.find(START, i)
-        if s < 0: return
-        e = payload.find(END, s + 2)
-        if e < 0: return
-        yield payload[s:e+2]
-        i = e + 2
+    parse_binary_frames = None
 
 # ========== 配置读取 ==========
 def load_config() -> dict:
@@ -62,6 +61,15 @@ def load_config() -> dict:
         "ROOT_DIR":         "./mqtt_store",
         "FLUSH_EVERY_ROWS": 200,
         "INACT_TIMEOUT_SEC": 20,  # 会话空闲超时（秒），超过则新文件
+        "COMPRESS_SIDECAR": 1,    # 关闭文件后生成 .csv.gz 旁路文件，供下载直接复用
+        "SIDECAR_LEVEL":    6,    # gzip 压缩级别
+        "DB_COALESCE_SEC":  0.5,  # DBWriter 合并写入的时间窗（秒）
+        "FS_WATCH":         1,    # 监视 ROOT_DIR，库外增删文件几秒内同步到 data_files
+        "FS_WATCH_DEBOUNCE_SEC": 2.0,  # 同一文件事件的去抖时间（秒）
+        "FS_POLL_SEC":      30.0, # 无 watchdog/inotify 时的轮询间隔（秒）
+        "INDEX_RESCAN_HOURS": 24, # 全量索引对账间隔（小时），兜底修复监视遗漏；0 = 监视开启时仅启动时对账一次
+        "SCAN_WORKERS":     8,    # 对账时并行扫描设备目录的线程数
+        "SUMMARY_REFRESH_SEC": 300,  # data_files_daily 物化视图最短刷新间隔（秒），0 = 不刷新
         # JSON 字段映射（可在 config.ini 覆盖）
         "F_DN":      "dn",         # 设备号（int/hex str/bytes/数组均可）
         "F_SN":      "sn",         # 压力点数量（可缺省）
@@ -88,6 +96,15 @@ def load_config() -> dict:
             cfg["ROOT_DIR"]         = cp.get("store","root_dir",    fallback=cfg["ROOT_DIR"])
             cfg["FLUSH_EVERY_ROWS"] = cp.getint("store","flush_every_rows", fallback=cfg["FLUSH_EVERY_ROWS"])
             cfg["INACT_TIMEOUT_SEC"] = cp.getint("store", "inact_timeout_sec", fallback=cfg["INACT_TIMEOUT_SEC"])
+            cfg["COMPRESS_SIDECAR"] = cp.getint("store", "compress_sidecar", fallback=cfg["COMPRESS_SIDECAR"])
+            cfg["SIDECAR_LEVEL"]    = cp.getint("store", "sidecar_level", fallback=cfg["SIDECAR_LEVEL"])
+            cfg["DB_COALESCE_SEC"]  = cp.getfloat("store", "db_coalesce_sec", fallback=cfg["DB_COALESCE_SEC"])
+            cfg["FS_WATCH"]         = cp.getint("store", "fs_watch", fallback=cfg["FS_WATCH"])
+            cfg["FS_WATCH_DEBOUNCE_SEC"] = cp.getfloat("store", "fs_watch_debounce_sec", fallback=cfg["FS_WATCH_DEBOUNCE_SEC"])
+            cfg["FS_POLL_SEC"]      = cp.getfloat("store", "fs_poll_sec", fallback=cfg["FS_POLL_SEC"])
+            cfg["INDEX_RESCAN_HOURS"] = cp.getfloat("store", "index_rescan_hours", fallback=cfg["INDEX_RESCAN_HOURS"])
+            cfg["SCAN_WORKERS"]     = cp.getint("store", "scan_workers", fallback=cfg["SCAN_WORKERS"])
+            cfg["SUMMARY_REFRESH_SEC"] = cp.getfloat("store", "summary_refresh_sec", fallback=cfg["SUMMARY_REFRESH_SEC"])
         if cp.has_section("json"):
             for k in ["F_DN","F_SN","F_TS","F_TSMS","F_PRESS","F_MAG","F_GYRO","F_ACC","TS_UNIT"]:
                 if cp.has_option("json", k.lower()):
@@ -109,6 +126,15 @@ def load_config() -> dict:
     cfg["ROOT_DIR"]         = env("SINK_ROOT_DIR", cfg["ROOT_DIR"])
     cfg["FLUSH_EVERY_ROWS"] = int(env("SINK_FLUSH_EVERY_ROWS", str(cfg["FLUSH_EVERY_ROWS"])))
     cfg["INACT_TIMEOUT_SEC"] = int(env("SINK_INACT_TIMEOUT_SEC", str(cfg["INACT_TIMEOUT_SEC"])))
+    cfg["COMPRESS_SIDECAR"] = int(env("SINK_COMPRESS_SIDECAR", str(cfg["COMPRESS_SIDECAR"])))
+    cfg["SIDECAR_LEVEL"]    = int(env("SINK_SIDECAR_LEVEL", str(cfg["SIDECAR_LEVEL"])))
+    cfg["DB_COALESCE_SEC"]  = float(env("SINK_DB_COALESCE_SEC", str(cfg["DB_COALESCE_SEC"])))
+    cfg["FS_WATCH"]         = int(env("SINK_FS_WATCH", str(cfg["FS_WATCH"])))
+    cfg["FS_WATCH_DEBOUNCE_SEC"] = float(env("SINK_FS_WATCH_DEBOUNCE_SEC", str(cfg["FS_WATCH_DEBOUNCE_SEC"])))
+    cfg["FS_POLL_SEC"]      = float(env("SINK_FS_POLL_SEC", str(cfg["FS_POLL_SEC"])))
+    cfg["INDEX_RESCAN_HOURS"] = float(env("SINK_INDEX_RESCAN_HOURS", str(cfg["INDEX_RESCAN_HOURS"])))
+    cfg["SCAN_WORKERS"]     = int(env("SINK_SCAN_WORKERS", str(cfg["SCAN_WORKERS"])))
+    cfg["SUMMARY_REFRESH_SEC"] = float(env("SINK_SUMMARY_REFRESH_SEC", str(cfg["SUMMARY_REFRESH_SEC"])))
     return cfg
 
 # ========== 数据库工具 ==========
@@ -124,25 +150,32 @@ def get_db_connection():
         connect_timeout=10
     )
 
-def get_csv_timestamp(filepath):
+def get_csv_timestamp(filepath, head_bytes: int = 512):
     """Attempt to read the first data row timestamp from CSV.
-    尝试从 CSV 中读取第一行数据的 Timestamp。
+    Only the first ``head_bytes`` are read unless the header row is wider than that.
+    尝试从 CSV 中读取第一行数据的 Timestamp（只读文件开头几百字节）。
     """
     try:
-        with open(filepath, 'r', encoding='utf-8', errors='replace') as f:
+        with open(filepath, 'rb') as f:
             # Expected: // DN..., Header, Data
-            lines = [f.readline() for _ in range(3)]
-            if len(lines) < 3: return None
-            
-            headers = [h.strip() for h in lines[1].split(',')]
-            row = [d.strip() for d in lines[2].split(',')]
-            
-            if "Timestamp" in headers:
-                idx = headers.index("Timestamp")
-                if idx < len(row):
-                    ts_val = float(row[idx])
-                    if ts_val > 0:
-                        return datetime.fromtimestamp(ts_val, JST)
+            head = f.read(head_bytes)
+            while head.count(b"\n") < 3:
+                # Wide headers (large SN) do not fit in the first block.
+                more = f.read(4096)
+                if not more: break
+                head += more
+        lines = head.decode('utf-8', errors='replace').split('\n')
+        if len(lines) < 3: return None
+
+        headers = [h.strip() for h in lines[1].split(',')]
+        row = [d.strip() for d in lines[2].split(',')]
+
+        if "Timestamp" in headers:
+            idx = headers.index("Timestamp")
+            if idx < len(row):
+                ts_val = float(row[idx])
+                if ts_val > 0:
+                    return datetime.fromtimestamp(ts_val, JST)
     except Exception:
         pass
     return None
@@ -162,222 +195,685 @@ def normalize_path_for_db(root: pathlib.Path, file_path: pathlib.Path) -> str:
         # Fallback if path manipulation fails
         return f"{file_path.parent.name}\\"
 
+# ========== 压缩旁路文件 ==========
+def sidecar_path(csv_path: pathlib.Path) -> pathlib.Path:
+    return csv_path.with_name(csv_path.name + ".gz")
+
+def fresh_sidecar_size(csv_path: pathlib.Path) -> Optional[int]:
+    """Return the .csv.gz size if it is newer than the CSV, else None.
+    旁路文件比 CSV 新时返回其大小，否则视为失效。
+    """
+    try:
+        gz_st = sidecar_path(csv_path).stat()
+        if gz_st.st_mtime >= csv_path.stat().st_mtime:
+            return gz_st.st_size
+    except OSError:
+        pass
+    return None
+
+def write_sidecar(csv_path: pathlib.Path, level: int = 6) -> int:
+    """Compress a closed CSV into <name>.csv.gz atomically; returns the gzip size.
+    将已关闭的 CSV 原子地压缩为 <name>.csv.gz，返回压缩后大小。
+    """
+    gz_path = sidecar_path(csv_path)
+    tmp_path = gz_path.with_name(gz_path.name + ".tmp")
+    with open(csv_path, "rb") as src, open(tmp_path, "wb") as raw:
+        # Single-member gzip without a file name so the deflate body can be
+        # copied into ZIP archives unchanged (see web/zip_stream.py).
+        with gzip.GzipFile(filename="", mode="wb", fileobj=raw, compresslevel=level) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+    os.replace(tmp_path, gz_path)
+    return gz_path.stat().st_size
+
+class SidecarCompressor(threading.Thread):
+    """Background thread that gzips closed recordings, then forwards the UPDATE hook.
+    后台压缩已关闭的录制文件，完成后再把 UPDATE（含压缩大小）交给 DBWriter。
+    """
+    def __init__(self, queue_obj, db_queue, level=6):
+        super().__init__(daemon=True)
+        self.queue = queue_obj
+        self.db_queue = db_queue
+        self.level = level
+
+    def run(self):
+        print("[Sidecar] Started.")
+        while True:
+            item = self.queue.get()
+            if item is None: break
+            abs_path_str, size = item
+            gz_size = None
+            try:
+                gz_size = write_sidecar(pathlib.Path(abs_path_str), self.level)
+            except Exception as e:
+                print(f"[Sidecar] Compress failed for {abs_path_str}: {e}")
+            if self.db_queue is not None:
+                self.db_queue.put(("UPDATE", (abs_path_str, size, gz_size)))
+            self.queue.task_done()
+
 class DBWriter(threading.Thread):
-    """Background thread to handle DB inserts/updates without blocking MQTT loop."""
-    def __init__(self, queue_obj, root_dir):
+    """Background thread to handle DB inserts/updates without blocking MQTT loop.
+    Actions arriving within ``window_sec`` are coalesced per file and written in one
+    transaction: an INSERT followed by its UPDATE becomes a single row insert.
+    在 window_sec 时间窗内合并同一文件的 INSERT/UPDATE，一个事务批量写入。
+    """
+    def __init__(self, queue_obj, root_dir, window_sec: float = 0.5, max_batch: int = 500,
+                 summary_refresh_sec: float = 300):
         super().__init__(daemon=True)
         self.queue = queue_obj
-        self.root = pathlib.Path(root_dir)
+        # Resolved so relative_to() matches the absolute paths from CsvHandle/StoreWatcher
+        # even when ROOT_DIR is relative (./mqtt_store) or behind a symlink.
+        self.root = pathlib.Path(root_dir).resolve()
+        self.window_sec = window_sec
+        self.max_batch = max_batch
+        self.summary_refresh_sec = summary_refresh_sec
+        self._summary_dirty = False
+        self._summary_due = 0.0
         self._conn = None
     
     def _get_conn(self):
         if self._conn and self._conn.closed == 0:
             return self._conn
+        conn = None
         try:
-            self._conn = get_db_connection()
-            return self._conn
+            conn = get_db_connection()
+            if conn:
+                ensure_schema(conn)
+            # Cache only a connection whose schema check succeeded.
+            self._conn = conn
+            return conn
         except Exception as e:
             print(f"[DBWriter] Connect failed: {e}")
+            if conn is not None:
+                try: conn.close()
+                except Exception: pass
+            self._conn = None
             return None
 
     def run(self):
         print("[DBWriter] Started.")
-        while True:
-            item = self.queue.get()
+        stopping = False
+        while not stopping:
+            try:
+                item = self.queue.get(timeout=self._summary_wait())
+            except queue.Empty:
+                self._maybe_refresh_summary()
+                continue
             if item is None: break # Stop signal
-            
-            action, payload = item
-            conn = self._get_conn()
-            if not conn:
+            batch = [item]
+            # Collect whatever else arrives within the window (bounded by max_batch).
+            deadline = time.monotonic() + self.window_sec
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0: break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            if self._write(batch) is False and len(batch) > 1:
+                # One bad action must not discard the rest of the window: retry one by one.
+                # 批量事务失败时逐条重试，避免一条错误丢弃整个时间窗的写入。
+                failed = sum(1 for item in batch if self._write([item]) is not True)
+                print(f"[DBWriter] Retried batch of {len(batch)} per action, {failed} failed")
+            self._maybe_refresh_summary()
+
+            for _ in batch:
                 self.queue.task_done()
-                continue
-            
-            try:
-                with conn:
-                    with conn.cursor() as cur:
-                        if action == "INSERT":
-                            self._handle_insert(cur, payload)
-                        elif action == "UPDATE":
-                            self._handle_update(cur, payload)
-            except Exception as e:
-                print(f"[DBWriter] Error processing {action}: {e}")
-                # Optional: retry logic could go here, but keep simple for now
-                if self._conn:
-                    try: self._conn.close()
-                    except: pass
-                    self._conn = None
-            
-            self.queue.task_done()
-    
-    def _handle_insert(self, cur, payload):
-        # payload: (dn_hex, abs_path, timestamp, filename)
-        dn_hex, abs_path_str, ts, filename = payload
-        abs_path = pathlib.Path(abs_path_str)
-        
-        rel_path_str = normalize_path_for_db(self.root, abs_path)
-        
+
+    def _write(self, batch) -> Optional[bool]:
+        """Apply a batch in one transaction; None if there is no DB connection."""
+        conn = self._get_conn()
+        if not conn:
+            return None
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    self._apply_batch(cur, batch)
+            self._summary_dirty = True
+            return True
+        except Exception as e:
+            print(f"[DBWriter] Error processing batch of {len(batch)}: {e}")
+            if self._conn:
+                try: self._conn.close()
+                except: pass
+                self._conn = None
+            return False
+
+    def _summary_wait(self):
+        # Block indefinitely unless a summary refresh is pending.
+        if not self._summary_dirty or self.summary_refresh_sec <= 0:
+            return None
+        return max(0.1, self._summary_due - time.monotonic())
+
+    def _maybe_refresh_summary(self):
+        # At most one refresh per summary_refresh_sec, and only after changes.
+        if not self._summary_dirty or self.summary_refresh_sec <= 0: return
+        if time.monotonic() < self._summary_due: return
+        conn = self._get_conn()
+        if not conn: return
+        try:
+            refresh_daily_summary(conn)
+            self._summary_dirty = False
+        except Exception as e:
+            print(f"[DBWriter] Summary refresh failed: {e}")
+            try: conn.rollback()
+            except Exception: pass
+        self._summary_due = time.monotonic() + self.summary_refresh_sec
+
+    @staticmethod
+    def _in_root(path) -> pathlib.Path:
+        # Resolve the parent like self.root; the file itself may already be gone (DELETE).
+        p = pathlib.Path(path)
+        return p.parent.resolve() / p.name
+
+    @staticmethod
+    def _to_datetime(ts) -> datetime:
         # Ensure timestamp is valid datetime
         if isinstance(ts, (int, float)):
-            dt = datetime.fromtimestamp(ts, JST)
-        elif isinstance(ts, datetime):
-            dt = ts
-        else:
-            dt = datetime.now(JST)
-
-        sql_cmd = """
-            INSERT INTO data_files 
-            (mac_address, file_date, file_time, file_datetime, file_name, file_path, file_size, side_position, file_memo)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT DO NOTHING
-        """
-        cur.execute(sql_cmd, (
-            dn_hex, dt.date(), dt.time(), dt,
-            filename, rel_path_str, 0, None, 'Live Recording'
-        ))
-        # print(f"[DB] Inserted {filename}")
-
-    def _handle_update(self, cur, payload):
-        # payload: (abs_path, size)
-        abs_path_str, size = payload
-        abs_path = pathlib.Path(abs_path_str)
-        filename = abs_path.name
-        rel_path_str = normalize_path_for_db(self.root, abs_path)
-        
-        # Identify record by mac (implied by path structure?), filename and path
-        # Actually mac is needed for index usage usually, but we have filename+path unique?
-        # Let's try matching by filename + path
-        sql_cmd = """
-            UPDATE data_files SET file_size = %s 
-            WHERE file_name = %s AND file_path = %s
+            return datetime.fromtimestamp(ts, JST)
+        if isinstance(ts, datetime):
+            return ts
+        return datetime.now(JST)
+
+    def _apply_batch(self, cur, batch):
+        # (file_path, file_name) -> {"insert": (dn_hex, ts), "update": (size, gz_size, mtime),
+        #                             "sync"/"delete": abs_path}
+        files: Dict[Tuple[str, str], dict] = {}
+        dir_deletes = []
+        for action, payload in batch:
+            if action == "INSERT":
+                # payload: (dn_hex, abs_path, timestamp, filename)
+                dn_hex, abs_path_str, ts, filename = payload
+                key = (normalize_path_for_db(self.root, self._in_root(abs_path_str)), filename)
+                files.setdefault(key, {})["insert"] = (dn_hex, ts)
+            elif action == "UPDATE":
+                # payload: (abs_path, size) or (abs_path, size, compressed_size) from SidecarCompressor
+                abs_path = self._in_root(payload[0])
+                gz_size = payload[2] if len(payload) > 2 else None
+                try:
+                    mtime = abs_path.stat().st_mtime
+                except OSError:
+                    mtime = None
+                key = (normalize_path_for_db(self.root, abs_path), abs_path.name)
+                # Later UPDATEs for the same file win.
+                files.setdefault(key, {})["update"] = (payload[1], gz_size, mtime)
+            elif action in ("SYNC", "DELETE"):
+                # payload: abs_path from StoreWatcher; the last event for a file wins.
+                abs_path = self._in_root(payload)
+                key = (normalize_path_for_db(self.root, abs_path), abs_path.name)
+                f = files.setdefault(key, {})
+                f.pop("sync", None); f.pop("delete", None)
+                f[action.lower()] = abs_path
+            elif action == "DELETE_DIR":
+                # payload: abs_dir (a DN or day directory removed/moved away)
+                try:
+                    rel = self._in_root(payload).relative_to(self.root)
+                except ValueError:
+                    continue
+                prefix = str(rel).replace("/", "\\").rstrip("\\") + "\\"
+                if prefix != ".\\":
+                    dir_deletes.append(prefix)
+
+        inserts = []
+        for (rel_path, filename), f in files.items():
+            if "insert" not in f: continue
+            dn_hex, ts = f["insert"]
+            dt = self._to_datetime(ts)
+            size, gz_size, mtime = f.get("update") or (0, None, None)
+            inserts.append((dn_hex, dt.date(), dt.time(), dt, filename, rel_path,
+                            size, gz_size, mtime))
+        inserted = set()
+        if inserts:
+            # Join device_info like the watch path: one unregistered DN is skipped instead of
+            # its mac_address foreign key rolling back every other file in the window.
+            # 关联 device_info：未登记设备的文件被跳过，不会让整批事务回滚。
+            rows = extras.execute_values(cur, """
+                INSERT INTO data_files
+                (mac_address, file_date, file_time, file_datetime, file_name, file_path, file_size,
+                 compressed_size, file_mtime, side_position, file_memo)
+                SELECT v.mac, v.file_date, v.file_time, v.file_datetime, v.file_name, v.file_path,
+                       v.file_size, v.gz_size, v.mtime, NULL, 'Live Recording'
+                FROM (VALUES %s) AS v(mac, file_date, file_time, file_datetime, file_name, file_path,
+                                      file_size, gz_size, mtime)
+                JOIN device_info di ON di.mac_address = v.mac
+                ON CONFLICT DO NOTHING
+                RETURNING file_path, file_name
+            """, inserts, fetch=True,
+                template="(%s, %s::date, %s::time, %s::timestamptz, %s, %s, %s::bigint, %s::bigint, %s::double precision)")
+            if len(rows) < len(inserts):
+                skipped = len(inserts) - len(rows)
+                print(f"[DBWriter] {skipped} new file(s) not indexed (unregistered DN or already present)")
+            inserted = {(r[0], r[1]) for r in rows}
+
+        # Identify record by filename + path. A merged INSERT already carries the final
+        # size; only rows that existed before (conflict) still need the UPDATE.
+        # compressed_size is always rewritten so a stale sidecar never stays advertised;
+        # file_mtime lets the next index sync treat this file as unchanged.
+        updates = [(key[0], key[1]) + f["update"] for key, f in files.items()
+                   if "update" in f and key not in inserted]
+        if updates:
+            extras.execute_values(cur, """
+                UPDATE data_files AS d
+                SET file_size = v.size, compressed_size = v.gz_size, file_mtime = v.mtime
+                FROM (VALUES %s) AS v(file_path, file_name, size, gz_size, mtime)
+                WHERE d.file_name = v.file_name AND d.file_path = v.file_path
+            """, updates, template="(%s, %s, %s::bigint, %s::bigint, %s::double precision)")
+
+        self._apply_watch_events(cur, files, dir_deletes)
+
+    def _apply_watch_events(self, cur, files, dir_deletes):
+        """Apply StoreWatcher SYNC/DELETE/DELETE_DIR events (files changed outside the sink).
+        处理目录监视事件：库外复制/修改的文件做 upsert，删除的文件/目录删除对应记录。
         """
-        cur.execute(sql_cmd, (size, filename, rel_path_str))
-        # print(f"[DB] Updated size for {filename}: {size}")
+        syncs = []
+        for key, f in files.items():
+            p = f.get("sync")
+            if p is None or "insert" in f: continue
+            try:
+                st = p.stat()
+            except OSError:
+                continue  # vanished again before we got here; a DELETE follows
+            dt = _file_datetime(p, st.st_mtime)
+            dn_hex = key[0].split("\\", 1)[0]
+            syncs.append((dn_hex, dt.date(), dt.time(), dt, key[1], key[0],
+                          st.st_size, fresh_sidecar_size(p), st.st_mtime))
+        if syncs:
+            rows = extras.execute_values(cur, """
+                UPDATE data_files AS d
+                SET file_date = v.file_date, file_time = v.file_time, file_datetime = v.file_datetime,
+                    file_size = v.file_size, compressed_size = v.gz_size, file_mtime = v.mtime
+                FROM (VALUES %s) AS v(mac, file_date, file_time, file_datetime, file_name, file_path,
+                                      file_size, gz_size, mtime)
+                WHERE d.file_name = v.file_name AND d.file_path = v.file_path
+                RETURNING d.file_path, d.file_name
+            """, syncs, fetch=True,
+                template="(%s, %s::date, %s::time, %s::timestamptz, %s, %s, %s::bigint, %s::bigint, %s::double precision)")
+            existing = {(r[0], r[1]) for r in rows}
+            new_rows = [r for r in syncs if (r[5], r[4]) not in existing]
+            if new_rows:
+                # Join device_info so a folder of an unknown DN is skipped instead of
+                # failing the whole batch on the mac_address foreign key.
+                extras.execute_values(cur, """
+                    INSERT INTO data_files
+                    (mac_address, file_date, file_time, file_datetime, file_name, file_path, file_size,
+                     compressed_size, file_mtime, side_position, file_memo)
+                    SELECT v.mac, v.file_date, v.file_time, v.file_datetime, v.file_name, v.file_path,
+                           v.file_size, v.gz_size, v.mtime, NULL, 'Watched File'
+                    FROM (VALUES %s) AS v(mac, file_date, file_time, file_datetime, file_name, file_path,
+                                          file_size, gz_size, mtime)
+                    JOIN device_info di ON di.mac_address = v.mac
+                    ON CONFLICT DO NOTHING
+                """, new_rows,
+                    template="(%s, %s::date, %s::time, %s::timestamptz, %s, %s, %s::bigint, %s::bigint, %s::double precision)")
+
+        deletes = [key for key, f in files.items() if "delete" in f]
+        if deletes:
+            extras.execute_values(cur, """
+                DELETE FROM data_files AS d USING (VALUES %s) AS v(file_path, file_name)
+                WHERE d.file_path = v.file_path AND d.file_name = v.file_name
+            """, deletes)
+        for prefix in dir_deletes:
+            # file_path uses backslashes, so compare the prefix literally instead of LIKE.
+            cur.execute("DELETE FROM data_files WHERE left(file_path, length(%s)) = %s", (prefix, prefix))
+        if syncs or deletes or dir_deletes:
+            print(f"[DBWriter] Watch events: synced {len(syncs)}, deleted {len(deletes)} files, "
+                  f"{len(dir_deletes)} dirs")
+
+def ensure_schema(conn):
+    """Add sink-owned columns to data_files if missing (idempotent).
+    为 data_files 补充 sink 使用的列（可重复执行）。
+    """
+    columns = {
+        "compressed_size": "BIGINT",
+        # Disk mtime (epoch seconds) lets the index sync skip unchanged files.
+        "file_mtime": "DOUBLE PRECISION",
+    }
+    with conn:
+        with conn.cursor() as cur:
+            # ALTER TABLE takes an exclusive lock even when nothing changes; only
+            # issue it for columns that are really missing.
+            cur.execute("""
+                SELECT column_name FROM information_schema.columns
+                WHERE table_name = 'data_files' AND column_name = ANY(%s)
+            """, (list(columns),))
+            existing = {row[0] for row in cur.fetchall()}
+            for name, col_type in columns.items():
+                if name not in existing:
+                    cur.execute(f"ALTER TABLE data_files ADD COLUMN IF NOT EXISTS {name} {col_type}")
+    ensure_listing_schema(conn)
+
+# Indexes and the per-device daily summary behind the web file listing
+# (web/db_manager.py list_files / get_device_date_summary).
+# 网页文件列表使用的索引与按设备/日期汇总的物化视图。
+LISTING_INDEXES = {
+    # Date drill-down: WHERE mac_address = ? AND file_date = ? ORDER BY file_time
+    "idx_data_files_mac_date_time": "(mac_address, file_date, file_time)",
+    # Keyset pages ordered by (file_datetime, id), per device and across devices (admin).
+    "idx_data_files_mac_dt_id": "(mac_address, file_datetime DESC NULLS LAST, id DESC)",
+    "idx_data_files_dt_id": "(file_datetime DESC NULLS LAST, id DESC)",
+}
+SUMMARY_VIEW = "data_files_daily"
+# pg_advisory_lock key serialising the listing DDL across threads and processes.
+LISTING_SCHEMA_LOCK = 0x5E7D0039
+
+def _listing_schema_state(cur):
+    cur.execute("""
+        SELECT c.relname, i.indisvalid FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE i.indrelid = 'data_files'::regclass
+    """)
+    indexes = dict(cur.fetchall())
+    cur.execute("SELECT 1 FROM pg_matviews WHERE matviewname = %s", (SUMMARY_VIEW,))
+    return indexes, cur.fetchone() is not None
+
+def ensure_listing_schema(conn):
+    """Create the listing indexes (CONCURRENTLY, no write lock) and the summary view if missing.
+    缺失时创建列表索引（CONCURRENTLY，不阻塞写入）与日汇总物化视图。
+    DBWriter, SchedulerThread and an embedded recorder may all call this at startup; a session
+    advisory lock lets only one of them run the DDL, the others re-check once it has finished.
+    """
+    with conn.cursor() as cur:
+        indexes, has_view = _listing_schema_state(cur)
+    conn.commit()
+    if all(indexes.get(name) for name in LISTING_INDEXES) and has_view:
+        return
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block.
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            # Poll with try-lock: a session blocked in pg_advisory_lock keeps a snapshot open,
+            # and CREATE INDEX CONCURRENTLY in the holder would wait for it (deadlock).
+            while True:
+                cur.execute("SELECT pg_try_advisory_lock(%s)", (LISTING_SCHEMA_LOCK,))
+                if cur.fetchone()[0]: break
+                time.sleep(1.0)
+            try:
+                indexes, has_view = _listing_schema_state(cur)
+                _create_listing_schema(cur, indexes, has_view)
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (LISTING_SCHEMA_LOCK,))
+    finally:
+        conn.autocommit = False
+
+def _create_listing_schema(cur, indexes, has_view):
+    for name, cols in LISTING_INDEXES.items():
+        if indexes.get(name): continue
+        if name in indexes:
+            # An interrupted concurrent build leaves an INVALID index behind.
+            cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        print(f"[DB] Creating index {name} on data_files {cols}...")
+        cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON data_files {cols}")
+    if not has_view:
+        print(f"[DB] Creating materialized view {SUMMARY_VIEW}...")
+        cur.execute(f"""
+            CREATE MATERIALIZED VIEW IF NOT EXISTS {SUMMARY_VIEW} AS
+            SELECT mac_address, file_date, count(*) AS file_count,
+                   COALESCE(sum(file_size), 0) AS total_size, now() AS refreshed_at
+            FROM data_files
+            WHERE mac_address IS NOT NULL AND file_date IS NOT NULL
+            GROUP BY mac_address, file_date
+        """)
+        # Required by REFRESH ... CONCURRENTLY (readers are never blocked).
+        cur.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {SUMMARY_VIEW}_key "
+                    f"ON {SUMMARY_VIEW} (mac_address, file_date)")
+
+def refresh_daily_summary(conn):
+    """REFRESH the per-device daily summary without blocking readers.
+    并发刷新日汇总物化视图，不阻塞网页查询。
+    """
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {SUMMARY_VIEW}")
+
+def _scan_dn_dir(root: str, dn_dir: str, dn_hex: str):
+    """scandir walk of one <DN> directory -> ([((file_path, file_name), info)], failed).
+    ``failed`` lists file_path prefixes of directories that could not be read completely.
+    用 os.scandir 遍历单个设备目录，复用目录项的 stat 结果，每个文件只 stat 一次；
+    读取失败的目录记入 failed，其记录不会被当作已删除。
+    """
+    found, failed = [], []
+    stack = [dn_dir]
+    while stack:
+        d = stack.pop()
+        rel = os.path.relpath(d, root).replace(os.sep, "\\") + "\\"
+        csvs, sidecars = {}, {}
+        try:
+            with os.scandir(d) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.endswith(".csv"):
+                        csvs[entry.name] = entry.stat()
+                    elif entry.name.endswith(".csv.gz"):
+                        sidecars[entry.name[:-3]] = entry.stat()
+        except OSError as e:
+            # EACCES/EIO/ENOENT mid-walk: keep this subtree's rows rather than delete them.
+            print(f"[DB-Sync] Cannot read {d}: {e}; its rows are kept as they are")
+            failed.append(rel)
+            continue
+        if not csvs: continue
+        for name, st in csvs.items():
+            gz = sidecars.get(name)
+            found.append(((rel, name), {
+                'mac': dn_hex,
+                'abs': os.path.join(d, name),
+                'size': st.st_size,
+                'mtime': st.st_mtime,
+                # Same freshness rule as fresh_sidecar_size(), without extra stats.
+                'gz_size': gz.st_size if gz is not None and gz.st_mtime >= st.st_mtime else None,
+            }))
+    return found, failed
 
-def rebuild_file_index(root_dir):
-    """Scan disk and sync DB. Serves as the 'Source of Truth' logic."""
-    print("[DB-Sync] Starting full index rebuild...")
+def _file_datetime(p, mtime: float) -> datetime:
+    return get_csv_timestamp(p) or datetime.fromtimestamp(mtime, JST)
+
+def _diff_dn_dir(root: str, dn_dir: str, dn_hex: str, db_rows: dict):
+    """Scan one DN directory and classify its files against the table snapshot.
+    Runs on a worker thread, so header reads of new/changed files happen in parallel.
+    """
+    keys, inserts, updates, touches = [], [], [], []
+    found, failed = _scan_dn_dir(root, dn_dir, dn_hex)
+    for key, f in found:
+        keys.append(key)
+        row = db_rows.get(key)
+        if row is None:
+            dt = _file_datetime(f['abs'], f['mtime'])
+            inserts.append((f['mac'], dt.date(), dt.time(), dt, key[1], key[0],
+                            f['size'], f['gz_size'], f['mtime'], None, 'Rebuilt Index'))
+            continue
+        size, mtime, gz_size = row
+        if size != f['size'] or (mtime is not None and abs(mtime - f['mtime']) > 1e-3):
+            # Content changed: re-read the first timestamp as well.
+            dt = _file_datetime(f['abs'], f['mtime'])
+            updates.append((dt.date(), dt.time(), dt, f['size'], f['gz_size'], f['mtime'], key[1], key[0]))
+        elif mtime is None or gz_size != f['gz_size']:
+            # Rows from live recording / older syncs: only fill bookkeeping columns.
+            touches.append((f['gz_size'], f['mtime'], key[1], key[0]))
+    return keys, inserts, updates, touches, failed
+
+def iter_store_diff(root_dir, valid_macs, db_rows: dict, workers: int = 8):
+    """Yield _diff_dn_dir() results per DN directory as soon as each one finishes.
+    多线程并行扫描各设备目录，按完成顺序逐个产出结果，供批量写入流式消费。
+    """
+    root = os.path.abspath(str(root_dir))
+    with os.scandir(root) as it:
+        dn_dirs = [(e.path, e.name) for e in it
+                   if e.is_dir() and len(e.name) >= 4 and e.name in valid_macs]
+    if workers <= 1 or len(dn_dirs) <= 1:
+        for path, dn_hex in dn_dirs:
+            yield _diff_dn_dir(root, path, dn_hex, db_rows)
+        return
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="index-scan") as pool:
+        futures = [pool.submit(_diff_dn_dir, root, path, dn_hex, db_rows) for path, dn_hex in dn_dirs]
+        for fut in as_completed(futures):
+            yield fut.result()
+
+def sync_file_index(root_dir, page_size: int = 1000, workers: int = 8):
+    """Reconcile data_files with the disk incrementally (disk is the source of truth).
+    增量同步：对比磁盘 (path, size, mtime) 与数据表，仅对新增/变化文件读取首行时间戳。
+    各设备目录并行扫描，结果按页 execute_values 写入，全部差异（含删除）在同一事务内提交，
+    期间下载页面始终看到旧的完整列表。
+    """
+    print("[DB-Sync] Starting incremental index sync...")
+    t0 = time.time()
     conn = None
     try:
         conn = get_db_connection()
         if not conn:
             print("[DB-Sync] No DB config, skipping.")
-            return
+            return None
 
         root = pathlib.Path(root_dir)
-        if not root.exists(): return
+        if not root.exists(): return None
+        ensure_schema(conn)
 
-        # Pre-load valid MACs
-        valid_macs = set()
         with conn.cursor() as cur:
             cur.execute("SELECT mac_address FROM device_info")
-            for row in cur.fetchall():
-                if row[0]: valid_macs.add(row[0])
-
-        disk_files = []
-        # Scan Level 1: DN
-        for dn_dir in root.iterdir():
-            if not dn_dir.is_dir(): continue
-            dn_hex = dn_dir.name
-            if len(dn_hex) < 4 or dn_hex not in valid_macs: continue
-
-            # Scan Level 2+: CSVs
-            for p in dn_dir.rglob("*.csv"):
-                try:
-                    ts = get_csv_timestamp(p)
-                    if not ts:
-                        ts = datetime.fromtimestamp(p.stat().st_mtime, JST)
-                    
-                    rel_path_str = normalize_path_for_db(root, p)
-                    
-                    disk_files.append({
-                        'mac': dn_hex,
-                        'name': p.name,
-                        'path': rel_path_str,
-                        'size': p.stat().st_size,
-                        'dt': ts
-                    })
-                except Exception:
-                    pass
+            valid_macs = {row[0] for row in cur.fetchall() if row[0]}
+            # Snapshot the table BEFORE scanning: a row the live DBWriter adds after
+            # this point is never mistaken for a file that vanished from disk.
+            # 先读表再扫盘，避免误删扫描期间实时写入的新记录。
+            cur.execute("SELECT file_path, file_name, file_size, file_mtime, compressed_size FROM data_files")
+            db_rows = {(r[0], r[1]): r[2:] for r in cur.fetchall()}
+        conn.commit()
+
+        stats = {"scanned": 0, "inserted": 0, "updated": 0, "touched": 0, "deleted": 0}
+        pending = {"inserted": [], "updated": [], "touched": []}
 
-        # Full Rebuild (Truncate + Insert)
+        def flush(cur, force=False):
+            # Pages bound memory and statement size; all of them commit together below.
+            if not force and sum(len(v) for v in pending.values()) < page_size:
+                return
+            extras.execute_values(cur, """
+                INSERT INTO data_files
+                (mac_address, file_date, file_time, file_datetime, file_name, file_path, file_size,
+                 compressed_size, file_mtime, side_position, file_memo)
+                VALUES %s
+                ON CONFLICT DO NOTHING
+            """, pending["inserted"], page_size=page_size)
+            extras.execute_values(cur, """
+                UPDATE data_files AS d
+                SET file_date = v.file_date, file_time = v.file_time, file_datetime = v.file_datetime,
+                    file_size = v.file_size, compressed_size = v.gz_size, file_mtime = v.mtime
+                FROM (VALUES %s) AS v(file_date, file_time, file_datetime, file_size, gz_size, mtime, file_name, file_path)
+                WHERE d.file_name = v.file_name AND d.file_path = v.file_path
+            """, pending["updated"], page_size=page_size,
+                template="(%s::date, %s::time, %s::timestamptz, %s::bigint, %s::bigint, %s::double precision, %s, %s)")
+            extras.execute_values(cur, """
+                UPDATE data_files AS d SET compressed_size = v.gz_size, file_mtime = v.mtime
+                FROM (VALUES %s) AS v(gz_size, mtime, file_name, file_path)
+                WHERE d.file_name = v.file_name AND d.file_path = v.file_path
+            """, pending["touched"], page_size=page_size, template="(%s::bigint, %s::double precision, %s, %s)")
+            for k, rows in pending.items():
+                stats[k] += len(rows)
+                rows.clear()
+
+        disk_keys = set()
+        failed_dirs = []
         with conn:
             with conn.cursor() as cur:
-                cur.execute("TRUNCATE TABLE data_files RESTART IDENTITY CASCADE;")
-                count = 0
-                for f in disk_files:
-                    cur.execute("""
-                        INSERT INTO data_files 
-                        (mac_address, file_date, file_time, file_datetime, file_name, file_path, file_size, side_position, file_memo)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    """, (
-                        f['mac'], f['dt'].date(), f['dt'].time(), f['dt'], 
-                        f['name'], f['path'], f['size'], None, 'Rebuilt Index'
-                    ))
-                    count += 1
-        print(f"[DB-Sync] Sync complete. Inserted: {count}")
+                for keys, inserts, updates, touches, failed in iter_store_diff(root, valid_macs, db_rows, workers):
+                    disk_keys.update(keys)
+                    failed_dirs.extend(failed)
+                    pending["inserted"].extend(inserts)
+                    pending["updated"].extend(updates)
+                    pending["touched"].extend(touches)
+                    flush(cur)
+                flush(cur, force=True)
+
+                # Rows under a directory that could not be read are not evidence of deletion.
+                # 读取失败的目录下的记录不删除。
+                failed_prefixes = tuple(failed_dirs)
+                deletes = [key for key in db_rows
+                           if key not in disk_keys and not key[0].startswith(failed_prefixes)]
+                extras.execute_values(cur, """
+                    DELETE FROM data_files AS d USING (VALUES %s) AS v(file_path, file_name)
+                    WHERE d.file_path = v.file_path AND d.file_name = v.file_name
+                """, deletes, page_size=page_size)
+
+        if stats["inserted"] or stats["updated"] or deletes:
+            refresh_daily_summary(conn)
+        stats["scanned"] = len(disk_keys)
+        stats["deleted"] = len(deletes)
+        stats["unchanged"] = len(disk_keys) - stats["inserted"] - stats["updated"] - stats["touched"]
+        stats["seconds"] = round(time.time() - t0, 3)
+        print(f"[DB-Sync] Sync complete: +{stats['inserted']} ~{stats['updated']} "
+              f"={stats['touched']} -{stats['deleted']} (unchanged {stats['unchanged']}, "
+              f"scanned {stats['scanned']}) in {stats['seconds']:.2f}s"
+              + (f", {len(failed_dirs)} unreadable dirs kept" if failed_dirs else ""))
+        return stats
     except Exception as e:
         print(f"[DB-Sync] Failed: {e}")
+        return None
     finally:
         if conn: conn.close()
 
 class SchedulerThread(threading.Thread):
-    def __init__(self, root_dir, interval_hours=24):
+    def __init__(self, root_dir, interval_hours=24, workers=8):
         super().__init__(daemon=True)
         self.root_dir = root_dir
         self.interval = interval_hours * 3600
+        self.workers = workers
         self._stop_event = threading.Event()
 
     def run(self):
+        if self.interval <= 0:
+            # StoreWatcher keeps the index current; reconcile once for changes made while down.
+            print("[Scheduler] Started. Startup sync only.")
+            sync_file_index(self.root_dir, workers=self.workers)
+            return
         print(f"[Scheduler] Started. Scanning every {self.interval}s.")
-        rebuild_file_index(self.root_dir)
+        sync_file_index(self.root_dir, workers=self.workers)
         while not self._stop_event.is_set():
             if self._stop_event.wait(self.interval): break
-            rebuild_file_index(self.root_dir)
+            sync_file_index(self.root_dir, workers=self.workers)
 
     def stop(self):
         self._stop_event.set()
 
 # ========== DN & CSV 句柄 ==========
 def dn_to_hex(dn) -> str:
-    """将 dn 统一为 12 位大写 HEX（假定 6 字节设备号）。"""
+    """将 dn 统一为 12 位大写 HEX（见 device_dn；返回驻留的同一字符串对象）。"""
     if dn is None:
         return "000000000000"
-    if isinstance(dn, (bytes, bytearray, list, tuple)):
-        dn_bytes = bytes(dn)
-    elif isinstance(dn, int):
-        dn_bytes = dn.to_bytes(6, "big", signed=False)
-    elif isinstance(dn, str):
-        h = dn.replace(" ", "").replace("-", "").lower()
-        if h.upper() == "ALL": return "ALL"
-        if h.startswith("0x"): h = h[2:]
-        dn_bytes = bytes.fromhex(h[-12:].rjust(12, "0"))
-    else:
-        # 最后兜底转字符串哈希（不推荐），但避免崩溃
-        s = str(dn).encode("utf-8")
-        dn_bytes = (s + b"\x00"*6)[:6]
-    return dn_bytes.hex().upper()
+    if isinstance(dn, str) and dn.strip().upper() == "ALL":
+        return "ALL"
+    h = dn_to_canonical(dn)
+    if h is not None:
+        return h
+    # 最后兜底转字符串哈希（不推荐），但避免崩溃
+    s = str(dn).encode("utf-8")
+    return (s + b"\x00"*6)[:6].hex().upper()
 
 class CsvHandle:
     """Manage a per-session CSV file for one DN/day.
     为同一 DN/日期维护单个 CSV 句柄。
     """
-    def __init__(self, path: pathlib.Path, sn: int, dn_hex: str, db_queue: queue.Queue = None):
+    def __init__(self, path: pathlib.Path, sn: int, dn_hex: str, db_queue: queue.Queue = None,
+                 sidecar_queue: queue.Queue = None):
         self.path = path; self.sn = sn; self.dn_hex = dn_hex
         self.db_queue = db_queue
+        self.sidecar_queue = sidecar_queue
         self.f = None; self.writer = None; self.rows_since_flush = 0
         self.has_inserted_db = False
 
     def _ensure_open(self):
         new_file = not self.path.exists()
         self.path.parent.mkdir(parents=True, exist_ok=True)
+        if not new_file:
+            # Appending to an existing recording invalidates its compressed copy.
+            try: sidecar_path(self.path).unlink()
+            except FileNotFoundError: pass
         self.f = open(self.path, "a", newline="", encoding="utf-8")
         self.writer = csv.writer(self.f)
         if new_file:
             self.writer.writerow([f"// DN: {self.dn_hex}, SN: {self.sn}"])
-            header = (["Timestamp"]
-                      + [f"P{i+1}" for i in range(self.sn)]
-                      + ["Mag_x","Mag_y","Mag_z","Gyro_x","Gyro_y","Gyro_z","Acc_x","Acc_y","Acc_z"])
-            self.writer.writerow(header); self.f.flush()
+            self.writer.writerow(get_plan(self.sn).csv_header); self.f.flush()
 
     def write_row(self, ts: float, pressures, mag, gyro, acc, flush_every: int):
         if self.f is None: self._ensure_open()
@@ -407,8 +903,12 @@ class CsvHandle:
             if self.db_queue and self.has_inserted_db:
                 try:
                     final_size = self.path.stat().st_size
-                    # Action: UPDATE, Payload: (abs_path_str, size)
-                    self.db_queue.put(("UPDATE", (str(self.path.absolute()), final_size)))
+                    if self.sidecar_queue is not None:
+                        # Compressor writes <name>.csv.gz, then emits UPDATE with both sizes.
+                        self.sidecar_queue.put((str(self.path.absolute()), final_size))
+                    else:
+                        # Action: UPDATE, Payload: (abs_path_str, size)
+                        self.db_queue.put(("UPDATE", (str(self.path.absolute()), final_size)))
                 except Exception:
                     pass
             self.f=None; self.writer=None
@@ -417,11 +917,13 @@ class StoreManager:
     """Allocate CSV writers on demand and rotate based on time/session rules.
     根据时间/会话规则按需分配 CSV 写入句柄。
     """
-    def __init__(self, root_dir, flush_every_rows, inactivity_timeout_sec: int = 20, db_queue: queue.Queue = None):
-        self.root = pathlib.Path(root_dir)
+    def __init__(self, root_dir, flush_every_rows, inactivity_timeout_sec: int = 20, db_queue: queue.Queue = None,
+                 sidecar_queue: queue.Queue = None):
+        self.root = pathlib.Path(root_dir).resolve()
         self.flush_every_rows = flush_every_rows
         self.inactivity_timeout_sec = inactivity_timeout_sec
         self.db_queue = db_queue
+        self.sidecar_queue = sidecar_queue
         # 按 DN 维护当前会话：dn_hex -> {"day": "YYYYMMDD", "handle": CsvHandle, "last_seen": datetime, "sn": int}
         self.sessions: Dict[str, Dict[str, object]] = {}
         self._lock = threading.RLock()
@@ -461,7 +963,7 @@ class StoreManager:
             except Exception: pass
 
         path = self._new_handle_path(dn_hex, when)
-        h = CsvHandle(path, sn, dn_hex, db_queue=self.db_queue)
+        h = CsvHandle(path, sn, dn_hex, db_queue=self.db_queue, sidecar_queue=self.sidecar_queue)
         self.sessions[dn_hex] = {
             "day": when.strftime("%Y%m%d"),
             "handle": h,
@@ -512,6 +1014,18 @@ class StoreManager:
             sess["last_seen"] = event_time
             sess["last_ingest_time"] = ingest_time
 
+    def is_active_path(self, path) -> bool:
+        """True if the sink itself is still writing this CSV (its own INSERT/UPDATE cover it).
+        该文件是否仍由当前会话写入。
+        """
+        path = os.path.abspath(str(path))
+        with self._lock:
+            for s in self.sessions.values():
+                h = s.get("handle")
+                if h and os.path.abspath(str(h.path)) == path:
+                    return True
+        return False
+
     def close_session(self, dn_hex: str):
         with self._lock:
             s = self.sessions.get(dn_hex)
@@ -620,23 +1134,40 @@ class MqttSink:
         
         # Setup DB Queue and Threads
         self.db_queue = queue.Queue()
+        self.sidecar_queue = queue.Queue() if cfg.get("COMPRESS_SIDECAR") else None
         
         # Pass db_queue to store
         self.store = StoreManager(
             cfg["ROOT_DIR"], 
             cfg["FLUSH_EVERY_ROWS"], 
             cfg.get("INACT_TIMEOUT_SEC", 5),
-            db_queue=self.db_queue
+            db_queue=self.db_queue,
+            sidecar_queue=self.sidecar_queue
         )
         
         # Threads
-        self.db_thread = DBWriter(self.db_queue, cfg["ROOT_DIR"])
-        self.scheduler = SchedulerThread(cfg["ROOT_DIR"])
+        self.db_thread = DBWriter(self.db_queue, cfg["ROOT_DIR"], window_sec=cfg.get("DB_COALESCE_SEC", 0.5),
+                                  summary_refresh_sec=cfg.get("SUMMARY_REFRESH_SEC", 300))
+        self.sidecar_thread = (SidecarCompressor(self.sidecar_queue, self.db_queue, cfg.get("SIDECAR_LEVEL", 6))
+                               if self.sidecar_queue is not None else None)
+        rescan_hours = cfg.get("INDEX_RESCAN_HOURS", 0)
+        if rescan_hours <= 0 and not cfg.get("FS_WATCH"):
+            rescan_hours = 24  # nothing else keeps the index current
+        self.scheduler = SchedulerThread(cfg["ROOT_DIR"], rescan_hours, cfg.get("SCAN_WORKERS", 8))
+        self.watcher = (StoreWatcher(cfg["ROOT_DIR"], self.db_queue,
+                                     debounce_sec=cfg.get("FS_WATCH_DEBOUNCE_SEC", 2.0),
+                                     poll_sec=cfg.get("FS_POLL_SEC", 30.0),
+                                     is_active=self.store.is_active_path)
+                        if cfg.get("FS_WATCH") and os.getenv("DB_HOST") else None)
         
         self._running = True
         self._rx = 0
         self._last_stat = time.time()
         self._recording_dns = set()
+        # Legacy binary payloads are scanned one message at a time: the raw topic mixes
+        # devices and bridges, so a partial tail cannot be joined with the next message.
+        # 旧版二进制负载逐条解析；raw topic 混有多个设备/bridge，不做跨消息拼接。
+        self._scanner = FrameScanner(max_carry=0)
 
     def on_connect(self, client, userdata, flags, rc):
         print(f"[MQTT] connected rc={rc}")
@@ -693,13 +1224,13 @@ class MqttSink:
                 self._rx += 1
         # 2) Fall back to legacy binary frames when JSON is absent.
         # 如无 JSON，则兼容旧版二进制帧。
-        elif parse_binary_frame is not None:
-            frames = list(extract_frames(b))
-            for fr in frames:
-                try:
-                    sd = parse_binary_frame(fr)
-                except Exception:
-                    sd = None
+        elif parse_binary_frames is not None:
+            frames = self._scanner.feed(b)
+            try:
+                decoded = parse_binary_frames(frames)
+            except Exception:
+                decoded = []
+            for sd in decoded:
                 if not sd: continue
                 dn_hex = dn_to_hex(sd.dn)
                 if not is_recording(dn_hex): continue
@@ -715,7 +1246,9 @@ class MqttSink:
     def run(self):
         # Start helper threads
         self.db_thread.start()
+        if self.sidecar_thread: self.sidecar_thread.start()
         self.scheduler.start()
+        if self.watcher: self.watcher.start()
         
         self.client.connect(self.cfg["MQTT_BROKER_HOST"], self.cfg["MQTT_BROKER_PORT"], keepalive=30)
         self.client.loop_start()
@@ -729,9 +1262,20 @@ class MqttSink:
             
             # Stop DB thread gracefully
             self.scheduler.stop()
+            if self.watcher:
+                self.watcher.stop()
+                self.watcher.join(timeout=5)
+            if self.sidecar_thread:
+                # Finish pending compressions first; they still enqueue UPDATEs.
+                self.sidecar_queue.put(None)
+                self.sidecar_thread.join(timeout=30)
             self.db_queue.put(None) # Poison pill
             self.db_thread.join(timeout=2)
-            
+
+            scan = self._scanner.stats()
+            if scan["frames"] or scan["garbage_bytes"]:
+                print(f"[MAIN] binary frames={scan['frames']} resyncs={scan['resyncs']} "
+                      f"garbage_bytes={scan['garbage_bytes']} carried={scan['carried']}")
             print("[MAIN] sink stopped.")
 
     def stop(self): self._running = False
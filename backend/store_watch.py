@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+mqtt_store 目录监视：文件在库外被复制/删除时，几秒内同步到 data_files。
+- 优先使用 watchdog（Linux 下为 inotify），未安装时退回到定时 stat 轮询
+- 事件按路径去抖后放入 DBWriter 队列：("SYNC", abs_path) / ("DELETE", abs_path) / ("DELETE_DIR", abs_dir)
+
+Watch ROOT_DIR so out-of-band copies and deletions reach data_files within seconds.
+Uses watchdog (inotify on Linux) when installed, otherwise a periodic stat walk.
+Events are debounced per path before they are queued for the DBWriter.
+"""
+
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except Exception:  # 可选依赖
+    FileSystemEventHandler = object
+    Observer = None
+
+
+def _csv_path_for(path: str) -> Optional[str]:
+    # Sidecar changes refresh compressed_size of their CSV.
+    if path.endswith(".csv"):
+        return path
+    if path.endswith(".csv.gz"):
+        return path[:-3]
+    return None
+
+
+class _Handler(FileSystemEventHandler):
+    def __init__(self, watcher: "StoreWatcher"):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.watcher.touch(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.watcher.touch(event.src_path)
+
+    def on_closed(self, event):
+        self.watcher.touch(event.src_path)
+
+    def on_deleted(self, event):
+        if event.is_directory:
+            self.watcher.mark(event.src_path, "DELETE_DIR")
+        else:
+            self.watcher.touch(event.src_path)
+
+    def on_moved(self, event):
+        if event.is_directory:
+            self.watcher.mark(event.src_path, "DELETE_DIR")
+            self.watcher.rescan_dir(event.dest_path)
+        else:
+            self.watcher.touch(event.src_path)
+            self.watcher.touch(event.dest_path)
+
+
+class StoreWatcher(threading.Thread):
+    """Feed debounced create/modify/delete events under root_dir into the DBWriter queue.
+    将 root_dir 下的增删改事件去抖后送入 DBWriter 队列。
+    """
+
+    def __init__(self, root_dir, db_queue, debounce_sec: float = 2.0, poll_sec: float = 30.0,
+                 is_active: Optional[Callable[[str], bool]] = None):
+        super().__init__(daemon=True)
+        self.root = os.path.realpath(str(root_dir))  # same form as DBWriter.root
+        self.db_queue = db_queue
+        self.debounce_sec = debounce_sec
+        self.poll_sec = poll_sec
+        # Files the sink is still writing are reported by CsvHandle itself.
+        self.is_active = is_active or (lambda path: False)
+        self._pending: Dict[str, Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._observer = None
+        self.mode = "inotify" if Observer is not None else "polling"
+        self.events = 0
+
+    # ---- event intake -------------------------------------------------
+    def mark(self, path: str, kind: str):
+        with self._lock:
+            self._pending[os.path.abspath(path)] = (kind, time.monotonic())
+            self.events += 1
+
+    def touch(self, path: str):
+        csv_path = _csv_path_for(path)
+        if csv_path:
+            # Decide SYNC vs DELETE when the path has been quiet long enough.
+            self.mark(csv_path, "CHECK")
+
+    def rescan_dir(self, path: str):
+        for dirpath, _, files in os.walk(path):
+            for name in files:
+                self.touch(os.path.join(dirpath, name))
+
+    # ---- dispatch -----------------------------------------------------
+    def _flush_due(self):
+        now = time.monotonic()
+        due = []
+        with self._lock:
+            for path, (kind, ts) in list(self._pending.items()):
+                if now - ts >= self.debounce_sec:
+                    due.append((path, kind))
+                    del self._pending[path]
+        for path, kind in due:
+            if kind == "DELETE_DIR":
+                self.db_queue.put(("DELETE_DIR", path))
+            elif os.path.exists(path):
+                if not self.is_active(path):
+                    self.db_queue.put(("SYNC", path))
+            else:
+                self.db_queue.put(("DELETE", path))
+
+    # ---- polling fallback ---------------------------------------------
+    def _snapshot(self) -> Dict[str, Tuple[int, float]]:
+        snap = {}
+        for dirpath, _, files in os.walk(self.root):
+            for name in files:
+                if not (name.endswith(".csv") or name.endswith(".csv.gz")):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                snap[path] = (st.st_size, st.st_mtime)
+        return snap
+
+    def _poll_loop(self):
+        prev = self._snapshot()
+        next_poll = time.monotonic() + self.poll_sec
+        while not self._stop_event.wait(min(1.0, self.debounce_sec)):
+            if time.monotonic() >= next_poll:
+                cur = self._snapshot()
+                for path, sig in cur.items():
+                    if prev.get(path) != sig:
+                        self.touch(path)
+                for path in prev.keys() - cur.keys():
+                    self.touch(path)
+                prev = cur
+                next_poll = time.monotonic() + self.poll_sec
+            self._flush_due()
+
+    def run(self):
+        os.makedirs(self.root, exist_ok=True)
+        if Observer is not None:
+            try:
+                self._observer = Observer()
+                self._observer.schedule(_Handler(self), self.root, recursive=True)
+                self._observer.start()
+            except Exception as e:
+                # e.g. inotify watch limit reached: fall back to polling.
+                print(f"[Watch] inotify unavailable ({e}), polling every {self.poll_sec}s")
+                self._observer = None
+                self.mode = "polling"
+        print(f"[Watch] Watching {self.root} ({self.mode}, debounce {self.debounce_sec}s)")
+        if self._observer is None:
+            self._poll_loop()
+            return
+        while not self._stop_event.wait(min(0.5, self.debounce_sec)):
+            self._flush_due()
+        self._observer.stop()
+        self._observer.join(timeout=2)
+
+    def stop(self):
+        self._stop_event.set()
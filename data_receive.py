@@ -13,6 +13,7 @@ import threading
 import queue
 import time
 import json
+from collections import deque
 from datetime import datetime, timezone
 import uuid
 import re
@@ -24,6 +25,9 @@ import certifi  # Added for automatic CA loading
 # ===== Added: load the updated parsing library / 新增：引入新版解析库 =====
 # Parsing layout follows sensor2.parse_sensor_data (DN=6 bytes, SN=pressure channels, Mag/Gyro/Acc are float triples) / 解析逻辑与字段布局参考 sensor2.parse_sensor_data（DN=6字节，SN=压力通道数，Mag/Gyro/Acc为3f）
 import backend.sensor2 as sensor2  # Ensure the module name matches sensor2.py in the same directory / 确保与同目录的 sensor2.py 同名
+from backend.frame_scanner import FrameScanner  # Per-source frame reassembly / 按来源拼接分片帧
+import backend.device_dn as device_dn  # 48-bit DN keys / 48 位整数 DN 键
+from backend.raw_spool import RawSpool  # On-disk spool for broker outages / 断线期间的磁盘缓存
 
 def resource_path(relative_path):
     """ Get absolute path to resource, works for dev and for PyInstaller """
@@ -94,6 +98,14 @@ MQTT_CA_CERT     = get_conf("MQTT", "CA_CERT", "", str)
 MQTT_CLIENT_CERT = get_conf("MQTT", "CLIENT_CERT", "", str)
 MQTT_CLIENT_KEY  = get_conf("MQTT", "CLIENT_KEY", "", str)
 MQTT_TLS_INSECURE = get_conf("MQTT", "TLS_INSECURE", 0, int) == 1
+# Flow control: paho in-flight limit, our pending (not yet PUBACKed) window, stale-entry timeout
+# 发布流控：paho 在途上限、本地待确认窗口大小、待确认项超时
+MQTT_MAX_INFLIGHT  = get_conf("MQTT", "MAX_INFLIGHT", 20, int)
+MQTT_MAX_PENDING   = get_conf("MQTT", "MAX_PENDING", 200, int)
+MQTT_PUBACK_TIMEOUT = get_conf("MQTT", "PUBACK_TIMEOUT_SEC", 60.0, float)
+# Data connections (DN-hash partitioned); commands/registry use one extra control connection
+# 数据连接数（按 DN 哈希分区）；配置命令/注册表另用一条控制连接
+MQTT_PUBLISHERS    = max(1, get_conf("MQTT", "PUBLISHERS", 1, int))
 
 # QUEUE
 Q_MAXSIZE       = get_conf("QUEUE", "BRIDGE_QUEUE_SIZE", 2000, int)
@@ -103,6 +115,22 @@ BATCH_MAX_MS    = get_conf("QUEUE", "BATCH_MAX_MS", 40, int)
 BATCH_SEPARATOR = get_conf("QUEUE", "BATCH_SEPARATOR", "NONE")
 PRINT_EVERY_MS  = get_conf("QUEUE", "PRINT_EVERY_MS", 2000, int)
 
+# SPOOL: raw batches go to disk while the broker is unreachable / 断线期间原始批次写入磁盘
+SPOOL_ENABLED     = get_conf("SPOOL", "ENABLED", 0, int) == 1
+SPOOL_DIR         = get_conf("SPOOL", "DIR", "spool")
+SPOOL_SEGMENT_MB  = get_conf("SPOOL", "SEGMENT_MB", 16, int)
+SPOOL_MAX_MB      = get_conf("SPOOL", "MAX_MB", 1024, int)
+SPOOL_MAX_AGE_H   = get_conf("SPOOL", "MAX_AGE_HOURS", 168.0, float)
+SPOOL_FSYNC_SEC   = get_conf("SPOOL", "FSYNC_SEC", 1.0, float)
+SPOOL_REPLAY_RATE = get_conf("SPOOL", "REPLAY_RATE", 200, int)
+
+# STORE: embedded sink (single-host) — decoded frames go straight to CSV, gated by the record-control topic
+# STORE：内嵌存储（单机部署），解码后的帧直接写 CSV，由录制控制主题开关
+STORE_EMBEDDED      = get_conf("STORE", "EMBEDDED", 0, int) == 1
+STORE_ROOT_DIR      = get_conf("STORE", "ROOT_DIR", "")
+STORE_CONTROL_TOPIC = get_conf("STORE", "CONTROL_TOPIC", "etx/v1/control/record")
+STORE_QUEUE_SIZE    = get_conf("STORE", "QUEUE_SIZE", 2000, int)
+
 # CONFIG settings (downlink control) / CONFIG（下发相关）
 CONFIG_CMD_TOPIC        = get_conf("CONFIG", "CMD_TOPIC", "etx/v1/config/cmd")
 CONFIG_RESULT_TOPIC     = get_conf("CONFIG", "RESULT_TOPIC", "etx/v1/config/result")
@@ -134,12 +162,22 @@ pkt_pub_raw = 0
 pkt_pub_parsed = 0
 pkt_drop = 0
 pkt_parse_err = 0
+publishers: list = []  # MqttPublisher per data connection, filled by mqtt_worker
+control_client: Optional[mqtt.Client] = None
+# Set while spools of an older layout replay; live raw batches go to the spool meanwhile.
+spool_draining = threading.Event()
+local_recorder = None  # LocalRecorder when [STORE] EMBEDDED=1 (created in main())
 
 # Queue entries store (payload_bytes, addr) / 队列项：保存 (payload_bytes, addr)
 q: "queue.Queue[Tuple[bytes, Tuple[str, int]]]" = queue.Queue(maxsize=Q_MAXSIZE)
 
+# Parsed path: datagrams may hold several frames or half of one; carry-over is kept per sender addr.
+# 解析路径：一个报文可能含多帧或半帧，按发送端地址保存未完整的尾部。
+frame_scanner = FrameScanner()
+
 # Device registry maps dn_hex -> {"ip": str, "last_seen": float} / 设备注册表：dn_hex -> {"ip": str, "last_seen": float}
-device_registry: Dict[str, Dict[str, float | str]] = {}
+# Keyed by 48-bit DN integer (see backend/device_dn.py) / 以 48 位整数 DN 为键
+device_registry: Dict[int, Dict[str, float | str]] = {}
 registry_lock = threading.RLock()
 
 # MQTT command queue / MQTT 命令队列
@@ -281,6 +319,119 @@ gcu_manager = SubscriptionManager(
     send_broadcast_on_exit=GCU_SEND_BROADCAST_ON_EXIT,
 )
 
+
+class PublishWindow:
+    """Bound the data publishes paho holds in memory (sent or queued, not yet PUBACKed).
+    限制 paho 内存中待确认（已发送或排队、未收到 PUBACK）的数据消息数量。
+
+    One per MqttPublisher connection. mqtt_worker waits in wait_for_room() while
+    the window is full, so the bridge queue fills up and udp_receiver applies
+    DROP_POLICY instead of paho growing without limit on a slow link.
+    on_publish() closes entries and records the publish -> PUBACK latency.
+    窗口满时 mqtt_worker 阻塞，背压回到桥接队列，由 udp_receiver 按 DROP_POLICY 丢包。
+    """
+
+    EARLY_ACK_TTL = 2.0
+
+    def __init__(self, max_pending: int, puback_timeout: float):
+        self.max_pending = max(1, max_pending)
+        self.puback_timeout = puback_timeout
+        self._cond = threading.Condition()
+        self._pending: Dict[int, float] = {}  # mid -> publish time
+        self._early: Dict[int, float] = {}    # acks seen before track() (or for non-data publishes)
+        self.connected = False
+        self.published = 0
+        self.acked = 0
+        self.rejected = 0
+        self.expired = 0
+        self.blocked_sec = 0.0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    def _expire_locked(self, now: float) -> None:
+        for mid, t in list(self._early.items()):
+            if now - t > self.EARLY_ACK_TTL:
+                del self._early[mid]
+        # Only while connected: during an outage paho legitimately keeps QoS1 messages for resend.
+        # 仅在已连接时清理：断线期间 paho 会保留 QoS1 消息待重发。
+        if self.connected and self.puback_timeout > 0:
+            for mid, t in list(self._pending.items()):
+                if now - t > self.puback_timeout:
+                    del self._pending[mid]
+                    self.expired += 1
+
+    def wait_for_room(self, stop_when_offline: bool = False) -> bool:
+        """Block while the window is full; False if shutting down (or offline, when asked) first."""
+        with self._cond:
+            if len(self._pending) < self.max_pending:
+                return True
+            t0 = time.monotonic()
+            while running and len(self._pending) >= self.max_pending:
+                if stop_when_offline and not self.connected:
+                    break
+                self._cond.wait(0.1)
+                self._expire_locked(time.monotonic())
+            self.blocked_sec += time.monotonic() - t0
+            return len(self._pending) < self.max_pending
+
+    def track(self, info: mqtt.MQTTMessageInfo, qos: int) -> bool:
+        """Register a publish result; False when paho did not take the message."""
+        queued = info.rc == mqtt.MQTT_ERR_SUCCESS or (info.rc == mqtt.MQTT_ERR_NO_CONN and qos > 0)
+        now = time.monotonic()
+        with self._cond:
+            if not queued:
+                self.rejected += 1
+                return False
+            self.published += 1
+            if self._early.pop(info.mid, None) is not None:
+                self.acked += 1  # PUBACK beat us here; latency ~0
+            else:
+                self._pending[info.mid] = now
+        return True
+
+    def on_publish(self, client, userdata, mid) -> None:
+        # Runs in the paho network thread (under paho's message lock): never publish from here.
+        now = time.monotonic()
+        with self._cond:
+            t0 = self._pending.pop(mid, None)
+            if t0 is None:
+                self._early[mid] = now
+                return
+            latency = now - t0
+            self.acked += 1
+            self.latency_sum += latency
+            if latency > self.latency_max:
+                self.latency_max = latency
+            self._cond.notify_all()
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def set_connected(self, connected: bool) -> None:
+        with self._cond:
+            self.connected = connected
+
+    def stats(self) -> dict:
+        """Counters for [STATS]; latency_max is reset on every call (per-interval max)."""
+        with self._cond:
+            self._expire_locked(time.monotonic())
+            snap = {
+                "pending": len(self._pending),
+                "max_pending": self.max_pending,
+                "published": self.published,
+                "acked": self.acked,
+                "rejected": self.rejected,
+                "expired": self.expired,
+                "blocked_sec": self.blocked_sec,
+                "latency_sum": self.latency_sum,
+                "latency_max": self.latency_max,
+                "connected": self.connected,
+            }
+            self.latency_max = 0.0
+        return snap
+
+
 def install_signals():
     def _handler(sig, frame):
         global running
@@ -366,22 +517,11 @@ def dn_to_hex(dn):
     Normalize the DN (bytes/int/str) into uppercase HEX for topic grouping.
     将 sensor2.parse_sensor_data 返回的 dn（通常为6字节 tuple/bytes）转为大写 HEX 字符串（用于 topic 分组）。
     """
-    if isinstance(dn, (bytes, bytearray)):
-        b = bytes(dn)
-    elif isinstance(dn, (tuple, list)):
-        b = bytes(dn)
-    elif isinstance(dn, int):
-        b = dn.to_bytes(6, byteorder="little", signed=False)
-    elif isinstance(dn, str):
-        hex_str = dn.replace(" ", "").replace("-", "").replace(":", "")
-        try:
-            b = bytes.fromhex(hex_str[-12:].rjust(12, "0"))
-        except ValueError:
-            return dn.strip().upper()
-    else:
-        # Best-effort fallback / 尽量兜底
-        b = bytes(bytearray(dn))
-    return b.hex().upper()
+    # int = DN value itself (same as sink/parser/bridge) / int 即 DN 数值，与其他服务一致
+    dn_text = device_dn.to_hex(dn)
+    if dn_text is None:
+        return str(dn).strip().upper()
+    return dn_text
 
 
 def quick_dn_from_payload(payload: bytes) -> Optional[str]:
@@ -390,43 +530,43 @@ def quick_dn_from_payload(payload: bytes) -> Optional[str]:
     even when parsing is disabled.
     在禁用完整解析时，仅检查帧头即可快速提取 DN，维持设备注册表。
     """
-    if not payload or len(payload) < 8:
-        return None
-    if payload[0] != 0x5A or payload[1] != 0x5A:
-        return None
-    try:
-        value = int.from_bytes(payload[2:8], byteorder="little", signed=False)
-        return f"{value:012X}"
-    except Exception:
-        return None
+    key = device_dn.frame_dn_key(payload)
+    return device_dn.dn_hex(key) if key is not None else None
 
 
-def update_device_registry(dn_hex: str, ip: Optional[str]) -> None:
-    """Normalize and store DN->IP mapping; ignore non-hex/short values."""
-    if not dn_hex or not ip:
-        return
-    dn_clean = normalize_dn_str(dn_hex)
-    if not dn_clean or len(dn_clean) < 8:
-        return
-    if not all(ch in "0123456789ABCDEF" for ch in dn_clean):
+def update_device_registry(dn, ip: Optional[str]) -> None:
+    """Store DN->IP mapping; dn is a 48-bit key or a hex string (short/non-hex strings are ignored).
+    记录 DN->IP；dn 可为整数键或 HEX 字符串。
+    """
+    if dn is None or not ip:
         return
-    dn_norm = dn_clean[-12:] if len(dn_clean) >= 12 else dn_clean
+    if isinstance(dn, str):
+        if len(normalize_dn_str(dn)) < 8:
+            return
+        dn = device_dn.dn_key(dn)
+        if dn is None:
+            return
     now = time.time()
     with registry_lock:
-        device_registry[dn_norm] = {"ip": ip, "last_seen": now}
+        rec = device_registry.get(dn)
+        if rec is not None and rec["ip"] == ip:
+            rec["last_seen"] = now  # per-packet path: no new dict / 每包路径不新建字典
+        else:
+            device_registry[dn] = {"ip": ip, "last_seen": now}
 
 
 def resolve_device_ip(dn_hex: str) -> Optional[str]:
-    if not dn_hex:
+    key = device_dn.dn_key(dn_hex) if dn_hex else None
+    if key is None:
         return None
     now = time.time()
     with registry_lock:
-        entry = device_registry.get(dn_hex)
+        entry = device_registry.get(key)
         if not entry:
             return None
         last_seen = float(entry.get("last_seen", 0))
         if now - last_seen > REGISTRY_TTL:
-            device_registry.pop(dn_hex, None)
+            device_registry.pop(key, None)
             return None
         return entry.get("ip")
 
@@ -532,17 +672,17 @@ def resolve_ip_with_discovery(dn_hex: str, target_ip: Optional[str]) -> tuple[Op
         return target_ip, [], []
     devices, targets = discover_devices()
     chosen_ip = None
-    dn_key = normalize_dn_str(dn_hex)
-    if dn_key:
+    dn_norm = normalize_dn_str(dn_hex)
+    if dn_norm:
         for item in devices:
             mac = normalize_dn_str(item.get("dn") or item.get("mac") or item.get("device_code") or item.get("ip"))
-            if mac and mac == dn_key:
+            if mac and mac == dn_norm:
                 chosen_ip = item.get("ip") or item.get("from")
                 break
     if chosen_ip is None and len(devices) == 1:
         chosen_ip = devices[0].get("ip") or devices[0].get("from")
     if chosen_ip:
-        update_device_registry(dn_key, chosen_ip)
+        update_device_registry(dn_norm, chosen_ip)
     return chosen_ip, devices, targets
 
 
@@ -566,17 +706,14 @@ def registry_snapshot() -> dict:
     items = []
     with registry_lock:
         stale = [
-            dn for dn, rec in device_registry.items()
-            if now - float(rec.get("last_seen", 0)) > REGISTRY_TTL
-            or not dn
-            or len(str(dn)) < 10
-            or not all(ch in "0123456789ABCDEF" for ch in str(dn).upper())
+            key for key, rec in device_registry.items()
+            if now - float(rec.get("last_seen", 0)) > REGISTRY_TTL or not key
         ]
-        for dn in stale:
-            device_registry.pop(dn, None)
-        for dn, rec in device_registry.items():
+        for key in stale:
+            device_registry.pop(key, None)
+        for key, rec in device_registry.items():
             items.append({
-                "dn": dn,
+                "dn": device_dn.dn_hex(key),
                 "ip": rec.get("ip"),
                 "last_seen": datetime.fromtimestamp(float(rec.get("last_seen", now)), timezone.utc).isoformat(),
             })
@@ -694,6 +831,14 @@ def on_config_connect(client: mqtt.Client, userdata, flags, rc):
         return
     client.subscribe(CONFIG_CMD_TOPIC, qos=1)
     print(f"[CONFIG] subscribed: {CONFIG_CMD_TOPIC}")
+    if local_recorder is not None:
+        client.subscribe(STORE_CONTROL_TOPIC, qos=1)
+        print(f"[STORE] subscribed: {STORE_CONTROL_TOPIC}")
+
+
+def on_config_disconnect(client: mqtt.Client, userdata, rc):
+    if rc != 0:
+        print(f"[CONFIG] control connection lost rc={rc}; reconnecting")
 
 
 def handle_config_command(client: mqtt.Client, userdata, message: mqtt.MQTTMessage):
@@ -920,15 +1065,11 @@ def execute_command(cmd: dict, client: mqtt.Client | None = None) -> dict:
         "broadcast": broadcast_targets,
     }
 
-def mqtt_worker():
-    """Consumer: drain queue, emit optional raw batches, and publish parsed JSON (batched).
-    消费者：从队列取数据→（可选）原始聚合发布 + 解析后 JSON 批量发布。
+def make_mqtt_client(client_id: str) -> mqtt.Client:
+    """paho client with the configured auth/TLS (not connected yet).
+    按配置创建 paho 客户端（用户名密码 / TLS），尚未连接。
     """
-    global pkt_pub_raw, pkt_pub_parsed, pkt_parse_err
-
-    client = mqtt.Client(client_id=CLIENT_ID, clean_session=True)
-    client.on_message = handle_config_command
-    client.on_connect = on_config_connect
+    client = mqtt.Client(client_id=client_id, clean_session=True)
 
     if MQTT_USERNAME:
         client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD or None)
@@ -973,37 +1114,418 @@ def mqtt_worker():
             tls_version=tls_version,
         )
         client.tls_insecure_set(MQTT_TLS_INSECURE)
+    return client
+
 
-    client.connect(BROKER_HOST, BROKER_PORT, keepalive=30)
-    client.loop_start()
+def partition_of(dn_key: int) -> int:
+    """Publisher index for a DN key; the same DN always uses the same connection (keeps its order)."""
+    if MQTT_PUBLISHERS == 1:
+        return 0
+    # Fibonacci hashing spreads sequential serial numbers evenly / 乘法哈希使连续序列号均匀分布
+    return ((((dn_key * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> 32) * MQTT_PUBLISHERS) >> 32
+
+
+class MqttPublisher:
+    """One data connection: paho client + PublishWindow + optional RawSpool and its replayer.
+    一条数据连接：paho 客户端 + 发布窗口 + 可选磁盘 spool 与回放线程。
+    """
+
+    def __init__(self, index: int, client_id: str, spool: Optional[RawSpool] = None,
+                 legacy: Optional[list] = None):
+        self.index = index
+        self.client_id = client_id
+        self.spool = spool
+        self.legacy = legacy or []  # old-layout spools this connection drains first
+        self.window = PublishWindow(MQTT_MAX_PENDING, MQTT_PUBACK_TIMEOUT)
+        self.client = make_mqtt_client(client_id)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_publish = self.window.on_publish
+        self.client.max_inflight_messages_set(max(1, MQTT_MAX_INFLIGHT))
+        # Hard ceiling on paho's queue; the window normally stops us well before it.
+        # paho 队列硬上限；正常情况下窗口会先生效。
+        self.client.max_queued_messages_set(self.window.max_pending + 64)
+        self.messages = 0
+        self.bytes = 0
+        self.rejected = 0
+        self.spooled = 0
+        self.replayed = 0
+
+    def _on_connect(self, client, userdata, flags, rc):
+        self.window.set_connected(rc == 0)
+        if rc != 0:
+            print(f"[BRIDGE/MQTT] p{self.index} connect failed rc={rc}")
+
+    def _on_disconnect(self, client, userdata, rc):
+        self.window.set_connected(False)
+        if rc != 0:
+            print(f"[BRIDGE/MQTT] p{self.index} disconnected rc={rc}; {self.window.pending()} publishes awaiting PUBACK")
+
+    def start(self) -> None:
+        # connect_async + loop_start keeps retrying in the background, so a site that starts
+        # without uplink still runs (and spools) instead of the worker thread dying.
+        # 异步连接：启动时无网络也能继续运行（并写入 spool），后台自动重连。
+        self.client.connect_async(BROKER_HOST, BROKER_PORT, keepalive=30)
+        self.client.loop_start()
+        if self.spool is not None or self.legacy:
+            threading.Thread(target=self.replay_loop, daemon=True).start()
+
+    def stop(self) -> None:
+        for old in self.legacy:
+            old.close()
+        if self.spool is not None:
+            self.spool.close()
+        self.client.loop_stop()
+        self.client.disconnect()
+
+    def publish(self, topic: str, payload, spool_ok: bool = False) -> Optional[bool]:
+        """True = handed to paho, None = written to the spool, False = rejected by paho.
+
+        Waits for a free slot in the window: while we wait the bridge queue fills and
+        udp_receiver drops per DROP_POLICY, so memory stays bounded on a slow link.
+        With a spool, offline batches (and new ones while a backlog replays) go to disk.
+        等待窗口空位：等待期间桥接队列积压，由 udp_receiver 按 DROP_POLICY 丢包。
+        启用 spool 时，断线（或仍在回放积压）期间的批次写入磁盘。
+        """
+        window = self.window
+        if spool_ok and self.spool is not None:
+            if spool_draining.is_set() or self.spool.capturing(window.connected) or (
+                    not window.wait_for_room(stop_when_offline=True) and not window.connected):
+                self.spool.append(topic, payload)
+                self.spooled += 1
+                return None
+        else:
+            window.wait_for_room()
+        info = self.client.publish(topic, payload=payload, qos=MQTT_QOS)
+        if window.track(info, MQTT_QOS):
+            self.messages += 1
+            self.bytes += len(payload)
+            return True
+        self.rejected += 1
+        return False
+
+    def replay_loop(self) -> None:
+        """Drain old-layout spools (if any), then replay this connection's own spool.
+        先回放旧布局遗留的 spool，全部确认后再回放本连接的 spool。
+        """
+        for old in self.legacy:
+            self._replay(old, drain=True)
+            if not running:
+                return
+            old.discard()
+            print(f"[SPOOL] drained {old.directory} ({old.replayed} batches)")
+        if self.legacy:
+            self.legacy = []
+            spool_draining.clear()
+            print("[SPOOL] old spool layout drained; per-connection replay resumes")
+        if self.spool is not None:
+            self._replay(self.spool)
+
+    def _replay(self, spool: RawSpool, drain: bool = False) -> None:
+        """Re-publish spooled batches in order once connected, at most SPOOL_REPLAY_RATE per second.
+        With ``drain`` return once every record is acknowledged; otherwise run until shutdown.
+        重连后按顺序限速回放 spool 中的批次；收到 PUBACK 后才推进持久化的读位置。
+        """
+        window = self.window
+        interval = 1.0 / max(SPOOL_REPLAY_RATE, 1)
+        inflight = deque()  # (MQTTMessageInfo, end position), oldest first
+        next_at = time.monotonic()
+        while running:
+            while inflight and inflight[0][0].is_published():
+                spool.commit(inflight.popleft()[1])
+            if drain and not inflight and not spool.has_backlog():
+                return
+            if not window.connected or (not drain and spool_draining.is_set()):
+                time.sleep(0.2)
+                continue
+            records = spool.read(16)
+            if not records:
+                time.sleep(0.05)
+                continue
+            for topic, payload, start, end in records:
+                if not window.wait_for_room(stop_when_offline=True):
+                    spool.unread(start)
+                    break
+                info = self.client.publish(topic, payload=payload, qos=MQTT_QOS)
+                if not window.track(info, MQTT_QOS):
+                    spool.unread(start)
+                    time.sleep(0.2)
+                    break
+                spool.sent()
+                inflight.append((info, end))
+                self.replayed += 1
+                self.messages += 1
+                self.bytes += len(payload)
+                next_at = max(next_at + interval, time.monotonic() - 1.0)
+                delay = next_at - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+    def stats(self) -> dict:
+        snap = self.window.stats()
+        snap.update(messages=self.messages, bytes=self.bytes, rejected=self.rejected,
+                    spooled=self.spooled, replayed=self.replayed,
+                    spool_backlog=self.spool.stats()["backlog_bytes"] if self.spool is not None else 0)
+        return snap
+
+
+SPOOL_LAYOUT = "layout.json"
+
+
+def _spool_kwargs(max_mb: int) -> dict:
+    return dict(segment_bytes=SPOOL_SEGMENT_MB * 1024 * 1024, max_bytes=max_mb * 1024 * 1024,
+                max_age_sec=SPOOL_MAX_AGE_H * 3600.0, fsync_sec=SPOOL_FSYNC_SEC)
+
+
+def prepare_spool_layout() -> list:
+    """Collect spools written under another layout; they must replay before any live batch.
+
+    SPOOL_DIR/layout.json records the PUBLISHERS count the p<i> directories were
+    partitioned with. When the count changed (a DN may now hash to another
+    connection), every p<i> directory is renamed to drain-<time>-p<i>; all
+    drain-* directories are returned oldest first.
+    PUBLISHERS 变更前的 p<i> 目录必须先回放完，
+    否则同一 DN 的旧积压与新实时数据会走不同连接而乱序。
+    """
+    if not (SPOOL_ENABLED and PUBLISH_RAW):
+        return []
+    layout_path = os.path.join(SPOOL_DIR, SPOOL_LAYOUT)
+    try:
+        os.makedirs(SPOOL_DIR, exist_ok=True)
+        try:
+            with open(layout_path, "r", encoding="utf-8") as fh:
+                previous = int(json.load(fh)["publishers"])
+        except (OSError, ValueError, KeyError, TypeError):
+            previous = None
+        stamp = time.strftime("%Y%m%d%H%M%S")
+        for name in sorted(os.listdir(SPOOL_DIR)):
+            m = re.fullmatch(r"p(\d+)", name)
+            if m and (previous != MQTT_PUBLISHERS or int(m.group(1)) >= MQTT_PUBLISHERS):
+                os.replace(os.path.join(SPOOL_DIR, name), os.path.join(SPOOL_DIR, f"drain-{stamp}-{name}"))
+        tmp = layout_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump({"publishers": MQTT_PUBLISHERS}, fh)
+        os.replace(tmp, layout_path)
+        dirs = sorted(os.path.join(SPOOL_DIR, n) for n in os.listdir(SPOOL_DIR) if n.startswith("drain-"))
+    except OSError as exc:
+        print(f"[SPOOL] cannot check the spool layout in {SPOOL_DIR}: {exc}", file=sys.stderr)
+        return []
+
+    old = []
+    for directory in dirs:
+        try:
+            spool = RawSpool(directory, **_spool_kwargs(SPOOL_MAX_MB))
+        except OSError as exc:
+            print(f"[SPOOL] cannot open old spool {directory}: {exc}", file=sys.stderr)
+            continue
+        if spool.has_backlog():
+            st = spool.stats()
+            print(f"[SPOOL] old layout backlog {directory}: {st['backlog_bytes'] / 1048576:.1f}MB, "
+                  f"replayed before live data (was PUBLISHERS={previous or 'unknown'})")
+            old.append(spool)
+        else:
+            spool.discard()
+    return old
+
+
+def open_spool(index: int) -> Optional[RawSpool]:
+    """Spool for publisher ``index`` (SPOOL_DIR/p<index>, MAX_MB shared by all publishers)."""
+    if not (SPOOL_ENABLED and PUBLISH_RAW):
+        return None
+    directory = os.path.join(SPOOL_DIR, f"p{index}")
+    try:
+        spool = RawSpool(directory, **_spool_kwargs(SPOOL_MAX_MB // MQTT_PUBLISHERS))
+    except OSError as exc:
+        print(f"[SPOOL] p{index} disabled, cannot open {directory}: {exc}", file=sys.stderr)
+        return None
+    st = spool.stats()
+    print(f"[SPOOL] p{index} dir={spool.directory}, max={SPOOL_MAX_MB // MQTT_PUBLISHERS}MB, "
+          f"replay_rate={SPOOL_REPLAY_RATE}/s, backlog={st['backlog_bytes'] / 1048576:.1f}MB in {st['segments']} segments")
+    return spool
+
+
+class LocalRecorder:
+    """Embedded sink: decoded frames go straight into backend/sink.py's StoreManager.
+    内嵌存储：解码后的帧直接交给 StoreManager 写 CSV，省去 broker → raw_parser → sink 两跳。
+
+    Same files, DB hooks and record-control semantics as the standalone sink
+    (record=true starts a DN, record=false closes its session, retained
+    messages and "ALL" are ignored). Do not also run the standalone sink on the
+    same ROOT_DIR, or both would append to the same CSVs. Rows are written by a
+    separate thread; a full queue blocks the MQTT worker like a full publish window.
+    与独立 sink 行为一致；不要让独立 sink 同时写同一 ROOT_DIR。
+    """
+
+    def __init__(self):
+        import backend.sink as sink  # needs backend/requirements.txt (psycopg2) / 依赖 backend 的 requirements
+
+        cfg = sink.load_config()  # [store] in ./config.ini and SINK_* env, as for sink.py
+        if STORE_ROOT_DIR:
+            cfg["ROOT_DIR"] = STORE_ROOT_DIR
+        self.sink = sink
+        self.cfg = cfg
+        # DB hooks only when a database is configured (same condition as the sink's watcher).
+        self.db_queue: Optional[queue.Queue] = queue.Queue() if os.getenv("DB_HOST") else None
+        self.sidecar_queue: Optional[queue.Queue] = (
+            queue.Queue() if self.db_queue is not None and cfg.get("COMPRESS_SIDECAR") else None)
+        self.store = sink.StoreManager(cfg["ROOT_DIR"], cfg["FLUSH_EVERY_ROWS"], cfg.get("INACT_TIMEOUT_SEC", 20),
+                                       db_queue=self.db_queue, sidecar_queue=self.sidecar_queue)
+        self.db_thread = (sink.DBWriter(self.db_queue, cfg["ROOT_DIR"], window_sec=cfg.get("DB_COALESCE_SEC", 0.5),
+                                        summary_refresh_sec=cfg.get("SUMMARY_REFRESH_SEC", 300))
+                          if self.db_queue is not None else None)
+        self.sidecar_thread = (sink.SidecarCompressor(self.sidecar_queue, self.db_queue, cfg.get("SIDECAR_LEVEL", 6))
+                               if self.sidecar_queue is not None else None)
+        self.recording: set = set()
+        self._q: "queue.Queue" = queue.Queue(maxsize=max(STORE_QUEUE_SIZE, 1))
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self.rows = 0
+
+    def start(self) -> None:
+        if self.db_thread is not None:
+            self.db_thread.start()
+        if self.sidecar_thread is not None:
+            self.sidecar_thread.start()
+        self._thread.start()
+        print(f"[STORE] embedded store root={self.cfg['ROOT_DIR']}, db={'on' if self.db_queue is not None else 'off'}")
+
+    def on_control(self, client, userdata, message: mqtt.MQTTMessage) -> None:
+        if message.retain:
+            print(f"[STORE] Ignored retained message on {message.topic}")
+            return
+        try:
+            payload = json.loads(message.payload.decode("utf-8"))
+            dn_raw = payload.get("dn")
+            should_record = bool(payload.get("record"))
+        except Exception as exc:
+            print(f"[STORE] Failed to parse control message: {exc}")
+            return
+        if not dn_raw:
+            return
+        dn_hex = self.sink.dn_to_hex(dn_raw)
+        if dn_hex == "ALL":
+            print("[STORE] Ignored 'ALL' record request (deprecated).")
+        elif should_record:
+            self.recording.add(dn_hex)
+            print(f"[STORE] Recording STARTED for {dn_hex}")
+        else:
+            self.recording.discard(dn_hex)
+            # Through the queue, so rows already queued for this DN land in the closing file.
+            # 经由队列关闭，保证已排队的行写入即将关闭的文件。
+            self._q.put(("stop", dn_hex))
+            print(f"[STORE] Recording STOPPED for {dn_hex}")
+
+    def submit(self, decoded) -> None:
+        """Queue the decoded frames of recording DNs (SensorData; None entries are skipped)."""
+        recording = self.recording
+        if not recording:
+            return
+        rows = [sd for sd in decoded if sd is not None and sd.dn in recording]
+        if rows:
+            self._q.put(("rows", rows))
+
+    def _run(self) -> None:
+        store, jst = self.store, self.sink.JST
+        last_check = time.monotonic()
+        while True:
+            try:
+                item = self._q.get(timeout=1.0)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            if item:
+                kind, body = item
+                if kind == "rows":
+                    ingest_time = datetime.now(jst)
+                    for sd in body:
+                        try:
+                            store.write(sd.dn, int(sd.sn), float(sd.timestamp), sd.pressure_sensors,
+                                        sd.magnetometer, sd.gyroscope, sd.accelerometer, ingest_time=ingest_time)
+                            self.rows += 1
+                        except Exception as exc:
+                            print(f"[STORE] write failed for {sd.dn}: {exc}", file=sys.stderr)
+                else:
+                    store.close_session(body)
+            now = time.monotonic()
+            if now - last_check >= 1.0:
+                store.check_timeouts()
+                last_check = now
+
+    def stop(self) -> None:
+        self._q.put(None)
+        self._thread.join(timeout=10)
+        self.store.close_all()
+        if self.sidecar_thread is not None:
+            # Finish pending compressions first; they still enqueue UPDATEs.
+            self.sidecar_queue.put(None)
+            self.sidecar_thread.join(timeout=30)
+        if self.db_thread is not None:
+            self.db_queue.put(None)
+            self.db_thread.join(timeout=2)
+        print(f"[STORE] embedded store stopped ({self.rows} rows written).")
+
+
+def mqtt_worker():
+    """Consumer: drain queue, emit optional raw batches, and publish parsed JSON (batched).
+    消费者：从队列取数据→（可选）原始聚合发布 + 解析后 JSON 批量发布。
+
+    Data goes out over MQTT_PUBLISHERS connections, partitioned by DN hash so each
+    device's batches stay in order on one connection; config commands, results and
+    registry announcements use a separate control connection.
+    数据按 DN 哈希分配到多条发布连接（同一设备保持顺序），命令与注册表使用独立控制连接。
+    """
+    global pkt_pub_raw, pkt_pub_parsed, pkt_parse_err, control_client
+
+    control = make_mqtt_client(CLIENT_ID)
+    control.on_message = handle_config_command
+    control.on_connect = on_config_connect
+    control.on_disconnect = on_config_disconnect
+    if local_recorder is not None:
+        control.message_callback_add(STORE_CONTROL_TOPIC, local_recorder.on_control)
+    control.connect_async(BROKER_HOST, BROKER_PORT, keepalive=30)
+    control.loop_start()
+    control_client = control
+
+    # Old-layout backlogs replay on the first connection before anything else is sent.
+    # 旧布局的积压由第一条连接先回放，期间实时原始批次写入各自的 spool。
+    legacy = prepare_spool_layout()
+    if legacy:
+        spool_draining.set()
+    for i in range(MQTT_PUBLISHERS):
+        pub = MqttPublisher(i, f"{CLIENT_ID}-p{i}", open_spool(i), legacy if i == 0 else None)
+        pub.start()
+        publishers.append(pub)
 
     print(f"[BRIDGE/MQTT] broker={BROKER_HOST}:{BROKER_PORT}, qos={MQTT_QOS}, topics raw={PUBLISH_RAW}, parsed={PUBLISH_PARSED}")
+    print(f"[BRIDGE/MQTT] publishers={MQTT_PUBLISHERS} (+1 control), max_inflight={MQTT_MAX_INFLIGHT}, "
+          f"max_pending={MQTT_MAX_PENDING}/conn, puback_timeout={MQTT_PUBACK_TIMEOUT}s, drop_policy={DROP_POLICY}")
     print(f"[CONFIG] listening for commands on {CONFIG_CMD_TOPIC}")
-    threading.Thread(target=command_worker, args=(client,), daemon=True).start()
-    threading.Thread(target=registry_announcer, args=(client,), daemon=True).start()
+    threading.Thread(target=command_worker, args=(control,), daemon=True).start()
+    threading.Thread(target=registry_announcer, args=(control,), daemon=True).start()
     sep = b"\n" if BATCH_SEPARATOR == "NL" else b""
 
-    # Raw aggregation buffer / 原始聚合缓冲区
-    raw_batch = []
-    raw_t0 = None
+    # Raw aggregation buffers, one per publisher / 原始聚合缓冲区（每条发布连接一个）
+    raw_batches = [[] for _ in publishers]
+    raw_t0: list = [None] * len(publishers)
+    # Datagrams without a frame start (continuations) follow their sender's last partition.
+    # 无帧头的续包沿用该发送端上一次的分区。
+    addr_partition: Dict[Tuple[str, int], int] = {}
 
     # Parsed aggregation buffers: dn_hex -> list[body], dn_hex -> start_time
     # 解析聚合缓冲区：按 DN 分组
     parsed_batches: Dict[str, list] = {}
     parsed_t0: Dict[str, float] = {}
 
-    def flush_raw():
-        nonlocal raw_batch, raw_t0
+    def flush_raw(part: int):
         global pkt_pub_raw
-        if not PUBLISH_RAW or not raw_batch:
-            raw_batch = []
-            raw_t0 = None
+        batch = raw_batches[part]
+        raw_batches[part] = []
+        raw_t0[part] = None
+        if not PUBLISH_RAW or not batch:
             return
-        payload = sep.join(raw_batch) if (len(raw_batch) > 1 or sep) else raw_batch[0]
-        client.publish(TOPIC_RAW, payload=payload, qos=MQTT_QOS)
-        pkt_pub_raw += len(raw_batch)
-        raw_batch = []
-        raw_t0 = None
+        payload = sep.join(batch) if (len(batch) > 1 or sep) else batch[0]
+        if publishers[part].publish(TOPIC_RAW, payload, spool_ok=True):
+            pkt_pub_raw += len(batch)
 
     def flush_parsed(dn_target: str):
         nonlocal parsed_batches, parsed_t0
@@ -1016,8 +1538,9 @@ def mqtt_worker():
         try:
             payload = json.dumps(batch, ensure_ascii=False, separators=(",", ":"))
             topic = f"{TOPIC_PARSED_PR}/{dn_target}"
-            client.publish(topic, payload=payload, qos=MQTT_QOS)
-            pkt_pub_parsed += len(batch)
+            key = device_dn.dn_key(dn_target)
+            if publishers[partition_of(key) if key is not None else 0].publish(topic, payload):
+                pkt_pub_parsed += len(batch)
         except Exception:
             pass
         
@@ -1027,9 +1550,10 @@ def mqtt_worker():
     def check_timeouts():
         now = time.time()
         # Raw timeout
-        if PUBLISH_RAW and raw_batch and raw_t0 is not None:
-            if (now - raw_t0) * 1000.0 >= BATCH_MAX_MS:
-                flush_raw()
+        if PUBLISH_RAW:
+            for part, t0 in enumerate(raw_t0):
+                if t0 is not None and (now - t0) * 1000.0 >= BATCH_MAX_MS:
+                    flush_raw(part)
         # Parsed timeouts
         if PUBLISH_PARSED:
             for dn, t0 in list(parsed_t0.items()):
@@ -1045,50 +1569,59 @@ def mqtt_worker():
             continue
 
         ip_source = addr[0] if isinstance(addr, tuple) and addr else None
-        if ip_source:
-            dn_hint = quick_dn_from_payload(payload_bytes)
-            if dn_hint:
-                update_device_registry(dn_hint, ip_source)
+        dn_hint = device_dn.frame_dn_key(payload_bytes)
+        if dn_hint and ip_source:
+            update_device_registry(dn_hint, ip_source)
 
         # Path 1: Raw aggregation
         if PUBLISH_RAW:
-            if not raw_batch:
-                raw_t0 = time.time()
-            raw_batch.append(payload_bytes)
-            if len(raw_batch) >= BATCH_MAX_ITEMS:
-                flush_raw()
-
-        # Path 2: Parsed batching
-        if PUBLISH_PARSED:
-            try:
-                sd = sensor2.parse_sensor_data(payload_bytes)
-                if sd is None:
-                    # check timeouts even if packet invalid, to avoid stall
+            if dn_hint is not None:
+                part = addr_partition[addr] = partition_of(dn_hint)
+            else:
+                part = addr_partition.get(addr, 0)
+            batch = raw_batches[part]
+            if not batch:
+                raw_t0[part] = time.time()
+            batch.append(payload_bytes)
+            if len(batch) >= BATCH_MAX_ITEMS:
+                flush_raw(part)
+
+        # Path 2: Parsed batching (+ embedded store) / 解析批量发布（及内嵌存储）
+        if PUBLISH_PARSED or local_recorder is not None:
+            frames = frame_scanner.feed(payload_bytes, source=addr)
+            if not frames:
+                # check timeouts even if packet invalid or incomplete, to avoid stall
+                check_timeouts()
+                continue
+            decoded = sensor2.parse_sensor_frames(frames)
+            if local_recorder is not None:
+                local_recorder.submit(decoded)
+            if not PUBLISH_PARSED:
+                if q.qsize() == 0:
                     check_timeouts()
-                    continue
-                
-                dn_hex, body = encode_parsed(sd)
-                update_device_registry(dn_hex, ip_source)
-                
-                if dn_hex not in parsed_batches:
-                    parsed_batches[dn_hex] = []
-                    parsed_t0[dn_hex] = time.time()
-                
-                parsed_batches[dn_hex].append(body)
-                
-                if len(parsed_batches[dn_hex]) >= BATCH_MAX_ITEMS:
-                    flush_parsed(dn_hex)
-                else:
-                    # Optional: check timeouts periodically even during busy burst?
-                    # For very high throughput, we rely on batch size trigger.
-                    # But if we have mix of slow and fast devices, we should check timeouts.
-                    # Doing it every packet might be too expensive if queue is full.
-                    # Let's do it every 10 packets or simple modulo check if needed.
-                    # For now, rely on queue.get timeout or batch size.
-                    pass
+                continue
+            for sd in decoded:
+                try:
+                    if sd is None:
+                        pkt_parse_err += 1
+                        continue
 
-            except Exception:
-                pkt_parse_err += 1
+                    dn_hex, body = encode_parsed(sd)
+                    update_device_registry(dn_hex, ip_source)
+
+                    if dn_hex not in parsed_batches:
+                        parsed_batches[dn_hex] = []
+                        parsed_t0[dn_hex] = time.time()
+
+                    parsed_batches[dn_hex].append(body)
+
+                    # For very high throughput, we rely on the batch size trigger;
+                    # slower devices are flushed by check_timeouts().
+                    if len(parsed_batches[dn_hex]) >= BATCH_MAX_ITEMS:
+                        flush_parsed(dn_hex)
+
+                except Exception:
+                    pkt_parse_err += 1
         
         # Periodic timeout check (in case we are receiving data but not filling batches fast enough)
         # However, checking time.time() every loop is cheap enough.
@@ -1098,14 +1631,17 @@ def mqtt_worker():
 
     # Flush all before exit
     try:
-        flush_raw()
+        for part in range(len(publishers)):
+            flush_raw(part)
         for dn in list(parsed_batches.keys()):
             flush_parsed(dn)
     except Exception:
         pass
 
-    client.loop_stop()
-    client.disconnect()
+    for pub in publishers:
+        pub.stop()
+    control.loop_stop()
+    control.disconnect()
     print("[BRIDGE/MQTT] worker stopped.")
 
 def stats_printer():
@@ -1114,6 +1650,7 @@ def stats_printer():
     """
     last = time.time()
     last_in, last_raw, last_parsed, last_drop, last_err = 0, 0, 0, 0, 0
+    prev: Dict[int, dict] = {}
     while running:
         time.sleep(PRINT_EVERY_MS / 1000.0)
         now = time.time()
@@ -1126,16 +1663,59 @@ def stats_printer():
         qsize = q.qsize()
         with registry_lock:
             dev_count = len(device_registry)
+        scan = frame_scanner.stats()
+
+        # Per-connection deltas, then totals / 每条连接的增量，再汇总
+        conns = []
+        total = {"pending": 0, "max_pending": 0, "acked": 0, "lat_sum": 0.0, "lat_max": 0.0, "blocked": 0.0,
+                 "rejected": 0, "expired": 0, "spooled": 0, "replayed": 0, "backlog": 0}
+        for pub in list(publishers):
+            st = pub.stats()
+            old = prev.get(pub.index) or {k: 0 for k in ("acked", "latency_sum", "blocked_sec", "messages", "bytes")}
+            prev[pub.index] = st
+            acked = st["acked"] - old["acked"]
+            lat_sum = st["latency_sum"] - old["latency_sum"]
+            blocked = st["blocked_sec"] - old["blocked_sec"]
+            total["pending"] += st["pending"]
+            total["max_pending"] += st["max_pending"]
+            total["acked"] += acked
+            total["lat_sum"] += lat_sum
+            total["lat_max"] = max(total["lat_max"], st["latency_max"])
+            total["blocked"] = max(total["blocked"], blocked)
+            for k, src in (("rejected", "rejected"), ("expired", "expired"), ("spooled", "spooled"),
+                           ("replayed", "replayed"), ("backlog", "spool_backlog")):
+                total[k] += st[src]
+            conns.append(
+                f"p{pub.index}={'up' if st['connected'] else 'DOWN'} "
+                f"{(st['messages'] - old['messages']) / dt:.1f}msg/s "
+                f"{(st['bytes'] - old['bytes']) / dt / 1024:.1f}KB/s "
+                f"inflight={st['pending']}/{st['max_pending']} "
+                f"lat={lat_sum / acked * 1000.0 if acked else 0.0:.1f}ms"
+                + (f" spool={st['spool_backlog'] / 1048576:.1f}MB" if pub.spool is not None else "")
+            )
+        lat_avg_ms = total["lat_sum"] / total["acked"] * 1000.0 if total["acked"] else 0.0
+        blocked_pct = total["blocked"] / dt * 100.0
         print(
             f"[STATS] in={pkt_in} ({in_rate:.1f}/s)  "
             f"raw_pub={pkt_pub_raw} ({raw_rate:.1f}/s)  "
             f"parsed_pub={pkt_pub_parsed} ({parsed_rate:.1f}/s)  "
             f"drop={pkt_drop} ({drop_rate:.1f}/s)  "
-            f"parse_err={pkt_parse_err} ({err_rate:.2f}/s)  q={qsize}  devices={dev_count}"
+            f"parse_err={pkt_parse_err} ({err_rate:.2f}/s)  q={qsize}  devices={dev_count}  "
+            f"resyncs={scan['resyncs']} garbage={scan['garbage_bytes']}B carried={scan['carried']}  "
+            f"inflight={total['pending']}/{total['max_pending']} puback={total['acked']} "
+            f"lat_avg={lat_avg_ms:.1f}ms lat_max={total['lat_max'] * 1000.0:.1f}ms "
+            f"blocked={blocked_pct:.0f}% rejected={total['rejected']} expired={total['expired']}"
+            + (f"  spooled={total['spooled']} replayed={total['replayed']} spool_backlog={total['backlog'] / 1048576:.1f}MB"
+               if SPOOL_ENABLED and PUBLISH_RAW else "")
+            + (f"  store_rows={local_recorder.rows} recording={len(local_recorder.recording)}"
+               if local_recorder is not None else "")
         )
+        ctl = control_client
+        print(f"[STATS/MQTT] ctl={'up' if ctl is not None and ctl.is_connected() else 'DOWN'}  " + "  ".join(conns))
         last, last_in, last_raw, last_parsed, last_drop, last_err = now, pkt_in, pkt_pub_raw, pkt_pub_parsed, pkt_drop, pkt_parse_err
 
 def main():
+    global local_recorder
     install_signals()
     if BROKER_PORT == 8883 and not MQTT_TLS_ENABLED:
         print(
@@ -1159,6 +1739,13 @@ def main():
                 "certificate verification may fail unless the CA is already trusted.",
                 file=sys.stderr,
             )
+    if STORE_EMBEDDED:
+        try:
+            local_recorder = LocalRecorder()
+            local_recorder.start()
+        except ImportError as exc:
+            print(f"[STORE] embedded store unavailable ({exc}); install backend/requirements.txt", file=sys.stderr)
+            local_recorder = None
     gcu_manager.start()
     # Spin up UDP/MQTT/stats threads and keep looping until interrupted.
     # Start UDP, MQTT, and stats threads until interrupted / 启动 UDP、MQTT、统计线程并持续运行直到被中断。
@@ -1177,6 +1764,8 @@ def main():
         pass
 
     time.sleep(0.3)
+    if local_recorder is not None:
+        local_recorder.stop()
     gcu_manager.stop()
     print("[MAIN] exiting.")
 
@@ -0,0 +1,77 @@
+"""Offline throughput check for server/bridge.py (no broker needed).
+
+Feeds synthetic parsed batches for many DNs straight into
+BridgeService._on_message and times /api/latest style snapshots.
+
+Usage: python debug_bridge_perf.py [--dns 500] [--batch 10] [--messages 20000]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault("BRIDGE_CONFIG", "")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "server"))
+
+import bridge  # noqa: E402
+
+
+class FakeMessage:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+def build_messages(dn_count, batch, sn=35):
+    msgs = []
+    for i in range(dn_count):
+        dn = f"{0xE00A00000000 + i:012X}"
+        items = [
+            {
+                "ts": 1_700_000_000 + k * 0.01,
+                "dn": dn,
+                "sn": sn,
+                "p": [float(300 + j) for j in range(sn)],
+                "mag": [1.0, 2.0, 3.0],
+                "gyro": [0.1, 0.2, 0.3],
+                "acc": [0.0, 0.0, 1.0],
+            }
+            for k in range(batch)
+        ]
+        payload = json.dumps(items, separators=(",", ":")).encode("utf-8")
+        msgs.append(FakeMessage(f"etx/v1/parsed/{dn}", payload))
+    return msgs
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--dns", type=int, default=500)
+    ap.add_argument("--batch", type=int, default=10)
+    ap.add_argument("--messages", type=int, default=20000)
+    ap.add_argument("--snapshots", type=int, default=200)
+    args = ap.parse_args()
+
+    svc = bridge.bridge_service
+    msgs = build_messages(args.dns, args.batch)
+
+    start = time.perf_counter()
+    for i in range(args.messages):
+        svc._on_message(None, None, msgs[i % len(msgs)])
+    dt = time.perf_counter() - start
+    print(
+        f"_on_message: {args.messages} msgs x {args.batch} items over {args.dns} DNs "
+        f"in {dt:.3f}s -> {args.messages / dt:.0f} msg/s, {args.messages * args.batch / dt:.0f} items/s"
+    )
+
+    start = time.perf_counter()
+    for i in range(args.snapshots):
+        # Touch a single DN between snapshots, like a live feed would.
+        svc._on_message(None, None, msgs[i % len(msgs)])
+        list(svc.snapshot())
+    dt = time.perf_counter() - start
+    print(f"snapshot(): {args.snapshots} calls with {args.dns} DNs in {dt:.3f}s -> {dt / args.snapshots * 1000:.2f} ms/call")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Latency check for /download permission lookups, with and without the cache.
+
+Drives web/app.py through Flask's test client as a non-admin user. By default
+the Postgres permission join is replaced with a sleep of --db-ms to mimic a
+busy database; pass --real-db to hit the DB_* database instead.
+
+Usage: python debug_download_perf.py [--requests 2000] [--db-ms 3] [--user alice]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+os.environ.setdefault("CONFIG_CONSOLE_ENABLED", "0")
+os.environ.setdefault("LICENSE_ENABLED", "0")
+os.environ.setdefault("FLASK_SECRET_KEY", "debug-download-perf")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "web"))
+
+import app as web_app  # noqa: E402
+import db_manager  # noqa: E402
+
+
+def fake_query(delay, macs):
+    def _query(username):
+        time.sleep(delay)
+        return [{"device_id": f"dev-{i}", "mac_address": mac} for i, mac in enumerate(macs)]
+    return _query
+
+
+def run(client, paths, count):
+    samples = []
+    for i in range(count):
+        start = time.perf_counter()
+        resp = client.get(paths[i % len(paths)])
+        samples.append((time.perf_counter() - start) * 1000)
+        resp.close()
+    samples.sort()
+    return {
+        "mean": statistics.fmean(samples),
+        "p50": samples[len(samples) // 2],
+        "p99": samples[int(len(samples) * 0.99) - 1],
+        "rps": count / (sum(samples) / 1000),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=2000)
+    ap.add_argument("--db-ms", type=float, default=3.0)
+    ap.add_argument("--devices", type=int, default=200)
+    ap.add_argument("--user", default="alice")
+    ap.add_argument("--real-db", action="store_true")
+    args = ap.parse_args()
+
+    macs = [f"{0xE00A00000000 + i:012X}" for i in range(args.devices)]
+    if not args.real_db:
+        db_manager._query_user_allowed_devices = fake_query(args.db_ms / 1000.0, macs)
+    # Files need not exist: the permission check runs before send_from_directory.
+    paths = [f"/download/{mac}/20250101/120000.csv" for mac in macs]
+
+    client = web_app.app.test_client()
+    with client.session_transaction() as sess:
+        sess["user_id"] = 1
+        sess["sso_id"] = args.user
+
+    cache = db_manager._perm_cache
+    ttl = cache.ttl
+    for label, cache_ttl in (("no cache", 0), ("cache", ttl or 60)):
+        cache.ttl = cache_ttl
+        db_manager.invalidate_permission_cache()
+        res = run(client, paths, args.requests)
+        print(
+            f"{label:>8}: {args.requests} x /download -> mean {res['mean']:.2f} ms, "
+            f"p50 {res['p50']:.2f} ms, p99 {res['p99']:.2f} ms, {res['rps']:.0f} req/s"
+        )
+    print(f"cache stats: {db_manager.permission_cache_stats()}")
+
+
+if __name__ == "__main__":
+    main()
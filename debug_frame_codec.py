@@ -0,0 +1,115 @@
+"""Parity check + benchmark for backend/frame_codec.py (C extension vs pure Python).
+
+Build the extension first:  cd backend && python frame_codec_build.py
+Then:                       python debug_frame_codec.py [--rounds 2000] [--seed 1]
+
+Fuzzes payloads (mixed SN frames, random garbage, A5A5/5A5A inside float data,
+truncated and corrupted frames, random SN filters) and checks that c_scan
+returns exactly what py_scan returns (frame_codec runs a short version of this
+on import). Also checks FrameScanner gives the same frames when the payload is
+fed in random chunks. Exits with status 1 on the first mismatch.
+"""
+import argparse
+import os
+import random
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+import frame_codec as fc  # noqa: E402
+from frame_scanner import FrameScanner  # noqa: E402
+
+SNS = (10, 16, 35, 64)
+
+
+def make_frame(rng, sn=None):
+    sn = rng.choice(SNS) if sn is None else sn
+    head = b"\x5a\x5a" + rng.getrandbits(48).to_bytes(6, "little") + bytes([sn])
+    head += struct.pack("<IH", rng.getrandbits(32), rng.randrange(1000))
+    body = bytearray(rng.getrandbits(8) for _ in range((sn + 9) * 4))
+    if rng.random() < 0.3:
+        # Marker bytes inside the float data.
+        pos = rng.randrange(0, len(body) - 1)
+        body[pos:pos + 2] = rng.choice((b"\xa5\xa5", b"\x5a\x5a"))
+    return head + bytes(body) + b"\xa5\xa5"
+
+
+def make_payload(rng):
+    parts = []
+    for _ in range(rng.randrange(0, 12)):
+        roll = rng.random()
+        if roll < 0.1:
+            parts.append(bytes(rng.getrandbits(8) for _ in range(rng.randrange(1, 40))))
+        elif roll < 0.2:
+            f = make_frame(rng)
+            parts.append(f[:rng.randrange(1, len(f))])  # truncated
+        elif roll < 0.3:
+            f = bytearray(make_frame(rng))
+            f[rng.randrange(len(f))] ^= 0xFF  # corrupted
+            parts.append(bytes(f))
+        else:
+            parts.append(make_frame(rng, rng.choice(SNS + (0, 1, 200)) if roll > 0.95 else None))
+    if rng.random() < 0.2:
+        parts.append(b"\x5a")
+    return b"".join(parts)
+
+
+def parity(rounds, rng):
+    checked_frames = 0
+    for r in range(rounds):
+        payload = make_payload(rng)
+        valid = fc.valid_sn_table(rng.sample(SNS, rng.randrange(1, 4))) if rng.random() < 0.2 else None
+        py = fc.py_scan(payload, valid)
+        c = fc.c_scan(payload, valid)
+        if py != c:
+            print(f"scan mismatch in round {r}: payload={payload.hex()}\n  py={py[1:]} c={c[1:]}")
+            return False
+        # Chunked feeding must yield the same frames as one-shot scanning.
+        scanner = FrameScanner()
+        got, pos = [], 0
+        while pos < len(payload):
+            step = rng.randrange(1, 300)
+            got += scanner.feed(payload[pos:pos + step], source="fuzz")
+            pos += step
+        if got != fc.py_scan(payload)[0]:
+            print(f"chunked scan mismatch in round {r}: payload={payload.hex()}")
+            return False
+        checked_frames += len(py[0])
+    print(f"parity ok: {rounds} payloads, {checked_frames} frames")
+    return True
+
+
+def bench(rng):
+    payload = b"".join(make_frame(rng, 35) for _ in range(50))
+    frames = fc.py_scan(payload)[0]
+    for label, fn, arg, n in (
+        ("py_scan x50", fc.py_scan, payload, 3000),
+        ("c_scan x50", fc.c_scan, payload, 3000),
+        ("py_decode_many x50", fc.py_decode_many, frames, 3000),
+    ):
+        t0 = time.perf_counter()
+        for _ in range(n):
+            fn(arg)
+        dt = time.perf_counter() - t0
+        print(f"{label:>20}: {n * 50 / dt:12,.0f} frames/s")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rounds", type=int, default=2000)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    if fc.BACKEND != "c":
+        print("C extension not built (cd backend && python frame_codec_build.py); nothing to compare")
+        return 1
+    rng = random.Random(args.seed)
+    if not parity(args.rounds, rng):
+        return 1
+    bench(rng)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""Benchmark the mqtt_store index scan: legacy rglob walk vs. parallel scandir scanner.
+
+Builds a synthetic store (default 100k CSV files across --dns devices) under --dir,
+then times:
+  * legacy   - Path.rglob + two stat() calls + readline header parse per file
+  * scandir  - backend/sink.py iter_store_diff() with 1 and --workers threads,
+               once as a full rebuild (empty table) and once with nothing changed
+Pass --db to also run sync_file_index() against the DB_* database (DN folders
+must exist in device_info to be indexed).
+
+Usage: python debug_index_scan.py [--files 100000] [--dns 50] [--workers 8] [--db]
+"""
+import argparse
+import os
+import pathlib
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+import sink  # noqa: E402
+
+
+def make_tree(root, files, dns, days=20):
+    per_dir = max(1, files // (dns * days))
+    macs = [f"{0xE00A00000000 + i:012X}" for i in range(dns)]
+    header = "Timestamp," + ",".join(f"P{i + 1}" for i in range(35)) + ",Mag_x,Mag_y,Mag_z,Gyro_x,Gyro_y,Gyro_z,Acc_x,Acc_y,Acc_z\n"
+    row = ",".join(["0"] * 44) + "\n"
+    made = 0
+    for mac in macs:
+        for d in range(days):
+            day_dir = os.path.join(root, mac, f"202501{d + 1:02d}")
+            if os.path.isdir(day_dir) and len(os.listdir(day_dir)) >= per_dir:
+                made += per_dir
+                continue
+            os.makedirs(day_dir, exist_ok=True)
+            for i in range(per_dir):
+                ts = 1735657200 + d * 86400 + i * 60
+                with open(os.path.join(day_dir, f"{i:06d}.csv"), "w") as fh:
+                    fh.write(f"// DN: {mac}, SN: 35\n{header}{ts}.0,{row}" + row * 20)
+                made += 1
+    return set(macs), made
+
+
+def legacy_scan(root, valid_macs):
+    # What the original rebuild did: rglob, stat for size, stat again inside
+    # the sidecar check, then open + readline x3 for the header timestamp.
+    root = pathlib.Path(root)
+    out = []
+    for dn_dir in root.iterdir():
+        if not dn_dir.is_dir() or dn_dir.name not in valid_macs:
+            continue
+        for p in dn_dir.rglob("*.csv"):
+            st = p.stat()
+            sink.fresh_sidecar_size(p)
+            with open(p, "r", encoding="utf-8", errors="replace") as f:
+                lines = [f.readline() for _ in range(3)]
+            headers = [h.strip() for h in lines[1].split(",")]
+            ts = float(lines[2].split(",")[headers.index("Timestamp")])
+            out.append((sink.normalize_path_for_db(root, p), p.name, st.st_size, datetime.fromtimestamp(ts, sink.JST)))
+    return out
+
+
+def new_scan(root, valid_macs, db_rows, workers):
+    n_keys = n_ins = 0
+    for keys, inserts, _updates, _touches, _failed in sink.iter_store_diff(root, valid_macs, db_rows, workers):
+        n_keys += len(keys)
+        n_ins += len(inserts)
+    return n_keys, n_ins
+
+
+def timed(label, fn):
+    t0 = time.perf_counter()
+    result = fn()
+    dt = time.perf_counter() - t0
+    print(f"{label:>28}: {dt:7.2f}s")
+    return result, dt
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--dir", default=os.path.join(tempfile.gettempdir(), "index_scan_data"))
+    ap.add_argument("--files", type=int, default=100000)
+    ap.add_argument("--dns", type=int, default=50)
+    ap.add_argument("--workers", type=int, default=8)
+    ap.add_argument("--db", action="store_true", help="also run sync_file_index against DB_*")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    macs, made = make_tree(args.dir, args.files, args.dns)
+    print(f"tree: {made} files in {args.dir} ({time.perf_counter() - t0:.1f}s to prepare)")
+
+    legacy, _ = timed("legacy rglob", lambda: legacy_scan(args.dir, macs))
+    (keys, ins), _ = timed("scandir x1 (rebuild)", lambda: new_scan(args.dir, macs, {}, 1))
+    timed(f"scandir x{args.workers} (rebuild)", lambda: new_scan(args.dir, macs, {}, args.workers))
+    assert keys == ins == len(legacy), (keys, ins, len(legacy))
+
+    # Unchanged store: every file matches its row, so no header is read at all.
+    unchanged = {(p, n): (size, None, None) for p, n, size, _ in legacy}
+    timed(f"scandir x{args.workers} (unchanged)", lambda: new_scan(args.dir, macs, unchanged, args.workers))
+
+    if args.db:
+        stats, _ = timed("sync_file_index", lambda: sink.sync_file_index(args.dir, workers=args.workers))
+        print(f"sync stats: {stats}")
+
+
+if __name__ == "__main__":
+    main()
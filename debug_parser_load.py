@@ -0,0 +1,170 @@
+"""Load generator for server/raw_parser_service.py.
+
+Three modes:
+  capture  record raw payloads from a broker into a file
+           python debug_parser_load.py capture out.bin --host 127.0.0.1 --seconds 30
+  replay   publish a capture (or synthetic payloads) to a broker as fast as
+           possible or at --rate msgs/s, e.g. against the localdev mosquitto
+           python debug_parser_load.py replay out.bin --host 127.0.0.1 --loops 10
+  bench    offline, no broker: feed payloads straight into RawParserService with
+           a stub publisher and report frames/s for each worker count
+           python debug_parser_load.py bench [out.bin] --workers 0,1,2,4
+
+Capture file format: repeated [u16 topic length][topic][u32 payload length][payload].
+Without a capture file, synthetic payloads of --frames frames from --dns devices are used.
+"""
+import argparse
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "server"))
+
+import paho.mqtt.client as mqtt  # noqa: E402
+
+import raw_parser_service as rps  # noqa: E402
+
+
+def make_frame(dn_value, sn=35, ts=1735700000, ms=0):
+    head = b"\x5a\x5a" + dn_value.to_bytes(6, "little") + bytes([sn]) + struct.pack("<IH", ts, ms)
+    body = struct.pack(f"<{sn}f", *range(sn)) + struct.pack("<9f", *([0.5] * 9))
+    return head + body + b"\xa5\xa5"
+
+
+def synthetic_payloads(count, frames, dns):
+    # One device per payload (like data_receive's raw batches), rotating across DNs.
+    out = []
+    for i in range(count):
+        dn = 0xE00A00000000 + (i % dns)
+        out.append(("etx/v1/raw/synthetic", b"".join(
+            make_frame(dn, ts=1735700000 + i, ms=j) for j in range(frames))))
+    return out
+
+
+def read_capture(path):
+    out = []
+    with open(path, "rb") as fh:
+        while True:
+            head = fh.read(2)
+            if len(head) < 2:
+                break
+            topic = fh.read(struct.unpack(">H", head)[0]).decode()
+            size = struct.unpack(">I", fh.read(4))[0]
+            out.append((topic, fh.read(size)))
+    return out
+
+
+def capture(args):
+    records = 0
+    with open(args.file, "wb") as fh:
+        def on_message(_c, _u, msg):
+            nonlocal records
+            topic = msg.topic.encode()
+            fh.write(struct.pack(">H", len(topic)) + topic + struct.pack(">I", len(msg.payload)) + msg.payload)
+            records += 1
+
+        client = mqtt.Client(client_id=f"parser-load-capture-{os.getpid()}")
+        client.on_connect = lambda c, _u, _f, _rc: c.subscribe(args.topic, qos=0)
+        client.on_message = on_message
+        client.connect(args.host, args.port, keepalive=30)
+        client.loop_start()
+        time.sleep(args.seconds)
+        client.loop_stop()
+        client.disconnect()
+    print(f"captured {records} payloads from {args.topic} into {args.file}")
+
+
+def replay(args):
+    payloads = read_capture(args.file) if args.file else synthetic_payloads(args.payloads, args.frames, args.dns)
+    client = mqtt.Client(client_id=f"parser-load-replay-{os.getpid()}")
+    client.max_queued_messages_set(0)
+    client.connect(args.host, args.port, keepalive=30)
+    client.loop_start()
+    interval = 1.0 / args.rate if args.rate else 0.0
+    sent = frames = 0
+    start = time.perf_counter()
+    for _ in range(args.loops):
+        for topic, payload in payloads:
+            info = client.publish(topic if args.file else args.topic_out, payload, qos=args.qos)
+            if args.qos:
+                info.wait_for_publish()
+            sent += 1
+            frames += sum(1 for _ in rps.iter_frames(payload))
+            if interval:
+                time.sleep(interval)
+    dt = time.perf_counter() - start
+    client.loop_stop()
+    client.disconnect()
+    print(f"replayed {sent} payloads / {frames} frames in {dt:.2f}s "
+          f"({sent / dt:.0f} msgs/s, {frames / dt:.0f} frames/s)")
+
+
+class StubPublisher:
+    def __init__(self):
+        self.messages = 0
+
+    def publish(self, topic, payload=None, qos=0):
+        self.messages += 1
+        return mqtt.MQTTMessageInfo(0)
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+
+class FakeMessage:
+    def __init__(self, payload, topic="etx/v1/raw/bench"):
+        self.payload = payload
+        self.topic = topic
+
+
+def bench(args):
+    payloads = read_capture(args.file) if args.file else synthetic_payloads(args.payloads, args.frames, args.dns)
+    total_frames = sum(1 for _, p in payloads for _ in rps.iter_frames(p))
+    print(f"{len(payloads)} payloads, {total_frames} frames, {os.cpu_count()} CPUs")
+    for workers in [int(w) for w in args.workers.split(",")]:
+        cfg = rps.ParserConfig()
+        cfg.parser_workers = workers
+        svc = rps.RawParserService(cfg)
+        svc._pub_client = StubPublisher()
+        svc._pub_connected.set()
+        if svc._reorder_thread is not None:
+            svc._reorder_thread.start()
+            # Warm the worker processes so fork cost is not measured.
+            list(svc._pool.map(rps.decode_frames, [list(rps.iter_frames(payloads[0][1]))] * workers))
+        start = time.perf_counter()
+        for topic, payload in payloads:
+            svc._on_sub_message(None, None, FakeMessage(payload, topic))
+        svc.stop()  # drains the pool / reorder buffer and flushes open batches
+        dt = time.perf_counter() - start
+        print(f"workers={workers}: {svc._frames_ok} frames in {dt:.2f}s -> {svc._frames_ok / dt:,.0f} frames/s, "
+              f"{svc._pub_client.messages} parsed messages")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("mode", choices=("capture", "replay", "bench"))
+    ap.add_argument("file", nargs="?", help="capture file (written by capture, read by replay/bench)")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=1883)
+    ap.add_argument("--topic", default="etx/v1/raw/#", help="capture subscription")
+    ap.add_argument("--topic-out", default="etx/v1/raw/loadgen", help="replay topic for synthetic payloads")
+    ap.add_argument("--seconds", type=float, default=30)
+    ap.add_argument("--rate", type=float, default=0, help="replay msgs/s (0 = as fast as possible)")
+    ap.add_argument("--loops", type=int, default=1)
+    ap.add_argument("--qos", type=int, default=0)
+    ap.add_argument("--payloads", type=int, default=2000)
+    ap.add_argument("--frames", type=int, default=50, help="frames per synthetic payload")
+    ap.add_argument("--dns", type=int, default=20)
+    ap.add_argument("--workers", default="0,1,2,4")
+    args = ap.parse_args()
+    if args.mode == "capture" and not args.file:
+        ap.error("capture needs an output file")
+    {"capture": capture, "replay": replay, "bench": bench}[args.mode](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Benchmark batch ZIP export: temp-file zipfile vs. streaming web/zip_stream.py.
+
+Generates a synthetic day of CSV recordings (default 5 GiB) under --dir, then
+measures time-to-first-byte, throughput and peak RSS of the streaming writer,
+optionally against the old "deflate to a temp file, then send" approach.
+
+Usage: python debug_zip_perf.py [--total-mb 5120] [--file-mb 16] [--store] [--compare]
+                                [--workers 4] [--executor thread|process]
+"""
+import argparse
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "web"))
+
+from zip_stream import stream_zip  # noqa: E402
+
+
+def make_dataset(root, total_mb, file_mb):
+    os.makedirs(root, exist_ok=True)
+    # Random sensor-like rows inside a 1 MiB block; deflate's 32 KiB window
+    # cannot see across block repeats, so ratios resemble real recordings.
+    rng = random.Random(0)
+    rows = []
+    size = 0
+    while size < 1024 * 1024:
+        row = ",".join(f"{rng.uniform(0, 4096):.2f}" for _ in range(44)).encode() + b"\n"
+        rows.append(row)
+        size += len(row)
+    block = b"".join(rows)
+    entries = []
+    for i in range(max(1, total_mb // file_mb)):
+        path = os.path.join(root, f"{i:06d}.csv")
+        arc = f"E00AD6773866/20250101/{i:06d}.csv"
+        if not os.path.exists(path) or os.path.getsize(path) < file_mb * 1024 * 1024:
+            with open(path, "wb") as fh:
+                for _ in range(file_mb):
+                    fh.write(block[: 1024 * 1024])
+        entries.append((path, arc))
+    return entries
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bench_stream(entries, store, executor=None, window=8):
+    start = time.perf_counter()
+    ttfb = None
+    total = 0
+    for chunk in stream_zip(entries, store=store, executor=executor, window=window):
+        if ttfb is None:
+            ttfb = time.perf_counter() - start
+        total += len(chunk)  # a real response would write to the socket here
+    return ttfb, total, time.perf_counter() - start
+
+
+def bench_tempfile(entries, store):
+    start = time.perf_counter()
+    fd, temp_path = tempfile.mkstemp(suffix=".zip")
+    os.close(fd)
+    try:
+        method = zipfile.ZIP_STORED if store else zipfile.ZIP_DEFLATED
+        with zipfile.ZipFile(temp_path, "w", method) as zf:
+            for abs_p, arc_n in entries:
+                zf.write(abs_p, arc_n)
+        ttfb = time.perf_counter() - start  # nothing can be sent before this point
+        total = 0
+        with open(temp_path, "rb") as fh:
+            while True:
+                chunk = fh.read(256 * 1024)
+                if not chunk:
+                    break
+                total += len(chunk)
+        return ttfb, total, time.perf_counter() - start
+    finally:
+        os.remove(temp_path)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--dir", default=os.path.join(tempfile.gettempdir(), "zip_perf_data"))
+    ap.add_argument("--total-mb", type=int, default=5120)
+    ap.add_argument("--file-mb", type=int, default=16)
+    ap.add_argument("--store", action="store_true", help="store-only (no deflate)")
+    ap.add_argument("--compare", action="store_true", help="also run the temp-file approach")
+    ap.add_argument("--workers", type=int, default=0, help="parallel deflate workers (0 = serial)")
+    ap.add_argument("--executor", choices=("thread", "process"), default="thread")
+    args = ap.parse_args()
+
+    entries = make_dataset(args.dir, args.total_mb, args.file_mb)
+    in_mb = sum(os.path.getsize(p) for p, _ in entries) / 1024 / 1024
+    print(f"dataset: {len(entries)} files, {in_mb:.0f} MiB in {args.dir}")
+
+    executor = None
+    if args.workers > 0:
+        pool_cls = ThreadPoolExecutor if args.executor == "thread" else ProcessPoolExecutor
+        executor = pool_cls(max_workers=args.workers)
+
+    runs = [("stream", bench_stream)]
+    if executor is not None:
+        runs.insert(0, (f"stream x{args.workers}", lambda e, s: bench_stream(e, s, executor, args.workers * 2)))
+    if args.compare:
+        runs.append(("tempfile", bench_tempfile))
+    for label, fn in runs:
+        ttfb, total, dt = fn(entries, args.store)
+        print(
+            f"{label:>8}: ttfb {ttfb * 1000:.1f} ms, {total / 1024 / 1024:.0f} MiB out in {dt:.1f}s "
+            f"({in_mb / dt:.0f} MiB/s in), peak RSS {peak_rss_mb():.0f} MiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -14,20 +14,35 @@ from gevent import monkey
 monkey.patch_all()
 
 import base64
+import bisect
 import json
 import os
 import queue  # Patched by gevent
 import signal
+import socket
 import threading
+import time
+import sys
+from collections import OrderedDict
 from datetime import datetime, timezone
+from pathlib import Path
 from typing import Any, Dict, Iterable, Optional, Tuple
 
 import configparser
+import numpy as np
 import paho.mqtt.client as mqtt
-from flask import Flask, Response, jsonify, stream_with_context
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_socketio import SocketIO, emit
 from gevent.pywsgi import WSGIServer  # Production WSGI server
 
+# Shared SN layouts live in backend/ (same path trick as raw_parser_service).
+BACKEND_DIR = Path(__file__).resolve().parents[1] / "backend"
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+from device_dn import to_hex as dn_to_hex  # type: ignore  # noqa: E402
+from frame_layout import get_plan, plan_stats  # type: ignore  # noqa: E402
+
 APP = Flask(__name__)
 # Switch to gevent async mode for high concurrency
 SOCKETIO = SocketIO(APP, cors_allowed_origins="*", async_mode="gevent")
@@ -46,7 +61,36 @@ class BridgeConfig:
         self.mqtt_password: Optional[str] = None
         self.client_id = "mqtt-bridge"
         self.dn_field = "dn"
+        self.ts_field = "ts"
+        self.sn_field = "sn"
+        self.pressure_field = "p"
+        self.mag_field = "mag"
+        self.gyro_field = "gyro"
+        self.acc_field = "acc"
         self.http_port = 5001
+        # Per-DN history ring: seconds kept x expected max frame rate = fixed capacity.
+        # 每个 DN 的历史环形缓冲：保留秒数 x 预期最大帧率 = 固定容量。
+        # Memory per DN is allocated up front: (sn + 9) x 4 B values + 8 B timestamp
+        # per row, i.e. ~((sn + 9) x 4 + 8) x history_sec x history_rate_hz bytes
+        # (SN=35 at 10 s x 100 Hz: ~180 KB per DN).
+        self.history_sec = 10.0
+        self.history_rate_hz = 100
+        # SSE listener queues: "queue" drops the oldest item when full,
+        # "coalesce" keeps only the newest pending entry per DN.
+        self.listener_mode = "queue"
+        self.listener_queue_size = 200
+        # Optional multi-replica backplane. Every replica already receives the
+        # parsed topic from the broker; "mqtt" additionally shares the latest
+        # state per DN through retained messages so a fresh replica starts warm.
+        # 可选多副本背板：各副本本就订阅同一 parsed 主题，"mqtt" 模式再通过
+        # retained 消息共享每个 DN 的最新状态，新副本启动即可拿到快照。
+        self.backplane = "none"
+        self.replica_id = socket.gethostname()
+        self.state_topic = "etx/v1/bridge/state"
+        self.state_publish_sec = 1.0
+        # DNs silent for this long are dropped and their retained state cleared (0 = keep).
+        # 超过该时长无数据的 DN 从缓存移除，并清除其 retained 状态（0 = 不清除）。
+        self.state_ttl_sec = 86400.0
         self.config_path = os.getenv("BRIDGE_CONFIG", "/backend/config.ini")
         self._load_from_file()
         self._override_from_env()
@@ -69,7 +113,25 @@ class BridgeConfig:
             if section.get("password"):
                 self.mqtt_password = section.get("password")
         if cp.has_section("json"):
-            self.dn_field = cp["json"].get("f_dn", self.dn_field)
+            section = cp["json"]
+            self.dn_field = section.get("f_dn", self.dn_field)
+            self.ts_field = section.get("f_ts", self.ts_field)
+            self.sn_field = section.get("f_sn", self.sn_field)
+            self.pressure_field = section.get("f_press", self.pressure_field)
+            self.mag_field = section.get("f_mag", self.mag_field)
+            self.gyro_field = section.get("f_gyro", self.gyro_field)
+            self.acc_field = section.get("f_acc", self.acc_field)
+        if cp.has_section("bridge"):
+            section = cp["bridge"]
+            self.history_sec = section.getfloat("history_sec", self.history_sec)
+            self.history_rate_hz = section.getint("history_rate_hz", self.history_rate_hz)
+            self.listener_mode = section.get("listener_mode", self.listener_mode)
+            self.listener_queue_size = section.getint("listener_queue_size", self.listener_queue_size)
+            self.backplane = section.get("backplane", self.backplane)
+            self.replica_id = section.get("replica_id", self.replica_id)
+            self.state_topic = section.get("state_topic", self.state_topic)
+            self.state_publish_sec = section.getfloat("state_publish_sec", self.state_publish_sec)
+            self.state_ttl_sec = section.getfloat("state_ttl_sec", self.state_ttl_sec)
 
     def _override_from_env(self) -> None:
         env = os.getenv
@@ -82,6 +144,222 @@ class BridgeConfig:
         self.dn_field = env("BRIDGE_DN_FIELD", self.dn_field)
         self.mqtt_username = env("BROKER_USERNAME", self.mqtt_username or "") or None
         self.mqtt_password = env("BROKER_PASSWORD", self.mqtt_password or "") or None
+        self.history_sec = float(env("BRIDGE_HISTORY_SEC", self.history_sec))
+        self.history_rate_hz = int(env("BRIDGE_HISTORY_RATE_HZ", self.history_rate_hz))
+        self.listener_mode = env("BRIDGE_LISTENER_MODE", self.listener_mode).strip().lower()
+        self.listener_queue_size = int(env("BRIDGE_LISTENER_QUEUE_SIZE", self.listener_queue_size))
+        self.backplane = env("BRIDGE_BACKPLANE", self.backplane).strip().lower()
+        self.replica_id = env("BRIDGE_REPLICA_ID", self.replica_id)
+        self.state_topic = env("BRIDGE_STATE_TOPIC", self.state_topic).rstrip("/")
+        self.state_publish_sec = float(env("BRIDGE_STATE_PUBLISH_SEC", self.state_publish_sec))
+        self.state_ttl_sec = float(env("BRIDGE_STATE_TTL_SEC", self.state_ttl_sec))
+
+    @property
+    def backplane_enabled(self) -> bool:
+        return self.backplane == "mqtt"
+
+    @property
+    def mqtt_client_id(self) -> str:
+        # Replicas sharing one client id would keep kicking each other off the broker.
+        # 多副本共用同一 client id 会被 broker 互相踢下线，因此追加副本标识。
+        if self.backplane_enabled:
+            return f"{self.client_id}-{self.replica_id}"[:64]
+        return self.client_id
+
+    @property
+    def history_capacity(self) -> int:
+        return max(int(self.history_sec * self.history_rate_hz), 0)
+
+
+class HistoryRing:
+    """Fixed-size sample history for one DN backed by preallocated arrays.
+    单个 DN 的定长历史缓冲，使用预分配数组（时间戳 float64，数值 float32）。
+
+    Each row stores ``sn`` pressures followed by mag/gyro/acc triples (the
+    frame_layout value row); the oldest row is overwritten once ``capacity``
+    is reached.
+    """
+
+    def __init__(self, capacity: int, sn: int) -> None:
+        self.capacity = capacity
+        self.sn = sn
+        self.plan = get_plan(sn)
+        self._ts = np.zeros(capacity, dtype=np.float64)
+        self._values = np.zeros((capacity, self.plan.width), dtype=np.float32)
+        self._head = 0  # next write slot
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, ts: float, pressures: list, mag: Any, gyro: Any, acc: Any) -> None:
+        i = self._head
+        sn = self.sn
+        row = list(pressures[:sn])
+        if len(row) < sn:
+            row.extend([0.0] * (sn - len(row)))
+        row.extend(_vec3(mag))
+        row.extend(_vec3(gyro))
+        row.extend(_vec3(acc))
+        # Single conversion into the preallocated float32 row.
+        self._values[i] = row
+        self._ts[i] = ts
+        self._head = (i + 1) % self.capacity
+        if self._size < self.capacity:
+            self._size += 1
+
+    def latest_ts(self) -> Optional[float]:
+        if not self._size:
+            return None
+        return float(self._ts[(self._head - 1) % self.capacity])
+
+    def since(self, ts_min: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (ts, values) copies in arrival order, optionally only rows newer than ts_min."""
+        order = np.arange(self._head - self._size, self._head) % self.capacity
+        ts = self._ts[order]
+        values = self._values[order]
+        if ts_min is not None:
+            mask = ts > ts_min
+            ts, values = ts[mask], values[mask]
+        return ts, values
+
+    def to_dict(self, dn: str, ts_min: Optional[float] = None) -> Dict[str, Any]:
+        ts, values = self.since(ts_min)
+        out: Dict[str, Any] = {"dn": dn, "sn": self.sn, "ts": ts.tolist()}
+        for key, cols in self.plan.slices.items():
+            out[key] = values[:, cols].tolist()
+        return out
+
+
+def _format_entry(entry: Dict[str, Any]) -> Dict[str, Any]:
+    # Add the ISO received_at expected by /api/latest consumers without touching the broadcast dict.
+    formatted = dict(entry)
+    formatted["received_at"] = datetime.fromtimestamp(entry["received_ts"], timezone.utc).isoformat()
+    return formatted
+
+
+def _vec3(value: Any) -> Tuple[float, float, float]:
+    if isinstance(value, (list, tuple)) and len(value) >= 3:
+        try:
+            return float(value[0]), float(value[1]), float(value[2])
+        except (TypeError, ValueError):
+            pass
+    return 0.0, 0.0, 0.0
+
+
+class Listener:
+    """One SSE consumer with its own bounded queue and lag/drop accounting.
+    单个 SSE 消费者：独立有界队列，并统计延迟与丢弃情况。
+
+    In ``queue`` mode payloads are delivered in order and the oldest one is
+    dropped when the queue is full. In ``coalesce`` mode only the newest
+    pending entry per DN is kept, so a slow client skips intermediate frames
+    instead of losing arbitrary ones.
+    """
+    MODES = ("queue", "coalesce")
+
+    def __init__(self, listener_id: int, filter_dn: Optional[str], mode: str, maxsize: int,
+                 client: Optional[str] = None) -> None:
+        self.id = listener_id
+        self.filter_dn = filter_dn
+        self.mode = mode if mode in self.MODES else "queue"
+        self.maxsize = maxsize
+        self.client = client
+        self.created_at = time.time()
+        self.delivered = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.closed = False
+        self._queue: queue.Queue = queue.Queue(maxsize=maxsize)
+        # coalesce mode: dn -> (enqueued_at, entry), insertion ordered
+        self._pending: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._pending_lock = threading.Lock()
+        self._pending_ready = threading.Event()
+
+    def depth(self) -> int:
+        if self.mode == "coalesce":
+            return len(self._pending)
+        return self._queue.qsize()
+
+    def put(self, payload: Dict[str, Any] | list[Dict[str, Any]]) -> bool:
+        """Enqueue without blocking. Returns False if the payload could not be queued."""
+        now = time.monotonic()
+        if self.mode == "coalesce":
+            items = payload if isinstance(payload, list) else [payload]
+            with self._pending_lock:
+                for item in items:
+                    dn = item.get("dn", "UNKNOWN")
+                    if dn in self._pending:
+                        # Keep the original enqueue time so lag reflects how stale the slot is.
+                        enqueued_at = self._pending.pop(dn)[0]
+                        self.coalesced += 1
+                    else:
+                        enqueued_at = now
+                    self._pending[dn] = (enqueued_at, item)
+                depth = len(self._pending)
+            self._pending_ready.set()
+        else:
+            try:
+                self._queue.put_nowait((now, payload))
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+                try:
+                    self._queue.put_nowait((now, payload))
+                except queue.Full:
+                    # Should not happen if we just made space, unless extreme contention
+                    self.dropped += 1
+                    return False
+            depth = self._queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+        return True
+
+    def get(self, timeout: Optional[float] = None) -> Dict[str, Any] | list[Dict[str, Any]]:
+        """Block until data is available; raises queue.Empty on timeout."""
+        if self.mode == "coalesce":
+            if not self._pending_ready.wait(timeout):
+                raise queue.Empty
+            with self._pending_lock:
+                pending = list(self._pending.values())
+                self._pending.clear()
+                self._pending_ready.clear()
+            if not pending:
+                raise queue.Empty
+            oldest = min(enqueued_at for enqueued_at, _ in pending)
+            items = [entry for _, entry in pending]
+            payload: Dict[str, Any] | list[Dict[str, Any]] = items[0] if len(items) == 1 else items
+        else:
+            oldest, payload = self._queue.get(timeout=timeout)
+        lag = time.monotonic() - oldest
+        self.last_lag = lag
+        if lag > self.max_lag:
+            self.max_lag = lag
+        self.delivered += 1
+        return payload
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "client": self.client,
+            "filter_dn": self.filter_dn,
+            "mode": self.mode,
+            "depth": self.depth(),
+            "maxsize": self.maxsize,
+            "max_depth": self.max_depth,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "lag_ms": round(self.last_lag * 1000.0, 1),
+            "max_lag_ms": round(self.max_lag * 1000.0, 1),
+            "age_sec": round(time.time() - self.created_at, 1),
+        }
 
 
 class BridgeService:
@@ -91,12 +369,25 @@ class BridgeService:
     def __init__(self, cfg: BridgeConfig) -> None:
         self.cfg = cfg
         self._latest_by_dn: Dict[str, Dict[str, Any]] = {}
+        self._history_by_dn: Dict[str, HistoryRing] = {}
+        # Sorted DN index + per-DN formatted entries for snapshot(); an update
+        # only invalidates its own DN instead of re-sorting everything per request.
+        # 有序 DN 索引与按 DN 缓存的格式化条目，更新时仅失效对应 DN。
+        self._sorted_dns: list[str] = []
+        self._snapshot_cache: Dict[str, Dict[str, Any]] = {}
         self._cache_lock = threading.Lock()
         
-        # Listeners is now a list of tuples: (queue, dn_filter)
-        # dn_filter can be None (all) or a specific DN string
-        self._listeners: list[Tuple[queue.Queue, Optional[str]]] = []
+        # Each listener carries its own dn_filter: None (all) or a specific DN string
+        self._listeners: list[Listener] = []
         self._listeners_lock = threading.Lock()
+        self._listener_seq = 0
+        self._listeners_evicted = 0
+        self._listeners_dropped_total = 0
+
+        # Backplane bookkeeping: dn -> received_ts last published by us / seen from any replica
+        self._state_published: Dict[str, float] = {}
+        self._state_seen: Dict[str, float] = {}
+        self._state_prefix = self.cfg.state_topic + "/"
         
         self._running = threading.Event()
         self._running.set()
@@ -107,7 +398,7 @@ class BridgeService:
     def _create_mqtt_client(self) -> mqtt.Client:
         # Configure the bare minimum MQTT callbacks for bridge semantics.
         # 仅配置桥接所需的最小回调，保持实现精简。
-        client = mqtt.Client(client_id=self.cfg.client_id, protocol=mqtt.MQTTv311)
+        client = mqtt.Client(client_id=self.cfg.mqtt_client_id, protocol=mqtt.MQTTv311)
         if self.cfg.mqtt_username:
             client.username_pw_set(self.cfg.mqtt_username, self.cfg.mqtt_password)
         client.on_connect = self._on_connect
@@ -119,6 +410,8 @@ class BridgeService:
             self._mqtt_client = self._create_mqtt_client()
         self._mqtt_client.connect(self.cfg.mqtt_host, self.cfg.mqtt_port, keepalive=30)
         self._mqtt_client.loop_start()
+        if self.cfg.backplane_enabled:
+            threading.Thread(target=self._state_publish_loop, name="bridge-state", daemon=True).start()
 
     def stop(self) -> None:
         self._running.clear()
@@ -136,30 +429,53 @@ class BridgeService:
             print(f"[bridge] connected to {self.cfg.mqtt_host}:{self.cfg.mqtt_port}")
             client.subscribe(self.cfg.mqtt_topic, qos=self.cfg.mqtt_qos)
             print(f"[bridge] subscribed to {self.cfg.mqtt_topic}")
+            if self.cfg.backplane_enabled:
+                client.subscribe(self._state_prefix + "#", qos=1)
+                print(f"[bridge] backplane replica={self.cfg.replica_id} state={self._state_prefix}#")
         else:
             print(f"[bridge] connection failed with rc={rc}")
 
     def _on_message(self, client: mqtt.Client, userdata: Any, msg: mqtt.MQTTMessage) -> None:
+        if self.cfg.backplane_enabled and msg.topic.startswith(self._state_prefix):
+            self._on_state_message(msg)
+            return
         payload = self._decode_payload(msg.payload)
         
         # Support batched updates (list of objects) or single object
         items = payload if isinstance(payload, list) else [payload]
         entries = []
+        topic = msg.topic
+        # One epoch receive time per MQTT message; ISO formatting is deferred
+        # to the snapshot/latest APIs (see _format_entry).
+        # 每条 MQTT 消息只取一次接收时间，ISO 字符串延迟到快照接口再格式化。
+        received_ts = time.time()
+        # Batches usually carry a single DN, so normalize each raw value once.
+        dn_memo: Dict[Any, str] = {}
+        latest = self._latest_by_dn
+        snapshot_cache = self._snapshot_cache
 
         with self._cache_lock:
             for item in items:
                 # Extract DN for each item (if payload is a dict) or fallback to topic
-                dn = self._extract_dn(msg.topic, item)
-                
-                # Create a normalized entry
+                raw_dn = item.get(self.cfg.dn_field) if isinstance(item, dict) else None
+                dn = dn_memo.get(raw_dn) if raw_dn is not None else None
+                if dn is None:
+                    dn = self._extract_dn(topic, item)
+                    if raw_dn is not None:
+                        dn_memo[raw_dn] = dn
+
                 entry = {
                     "dn": dn,
-                    "topic": msg.topic,
+                    "topic": topic,
                     "payload": item,
-                    "received_at": datetime.now(timezone.utc).isoformat(),
+                    "received_ts": received_ts,
                 }
                 # Update cache with latest
-                self._latest_by_dn[dn] = entry
+                if dn not in latest:
+                    bisect.insort(self._sorted_dns, dn)
+                latest[dn] = entry
+                snapshot_cache.pop(dn, None)
+                self._record_history(dn, item, received_ts)
                 entries.append(entry)
         
         if entries:
@@ -170,6 +486,112 @@ class BridgeService:
             else:
                 self._broadcast(entries)
 
+    # ------------------------------------------------------------------
+    # Backplane (shared latest state across replicas)
+    def _on_state_message(self, msg: mqtt.MQTTMessage) -> None:
+        # Seed the cache from retained state, including what this replica published before
+        # a restart (same replica_id); the received_ts check below makes self-echoes no-ops.
+        # Live data still arrives through the parsed topic, so nothing is broadcast here.
+        # 用 retained 状态预热缓存（包括本副本重启前发布的）；实时数据仍来自 parsed 主题，这里不广播。
+        body = self._decode_payload(msg.payload)
+        if not isinstance(body, dict):
+            return  # empty payload = state cleared
+        entry = body.get("entry")
+        if not isinstance(entry, dict):
+            return
+        dn = entry.get("dn")
+        try:
+            received_ts = float(entry.get("received_ts") or 0.0)
+        except (TypeError, ValueError):
+            return
+        if not dn or received_ts <= 0:
+            return
+        ttl = self.cfg.state_ttl_sec
+        if ttl > 0 and received_ts < time.time() - ttl:
+            if msg.retain:
+                self._clear_state(dn)  # left behind by a DN no replica tracks any more
+            return
+        with self._cache_lock:
+            # Only other replicas' publishes suppress ours (see _state_publish_loop).
+            if body.get("replica") != self.cfg.replica_id and received_ts > self._state_seen.get(dn, 0.0):
+                self._state_seen[dn] = received_ts
+            current = self._latest_by_dn.get(dn)
+            if current is not None and current.get("received_ts", 0.0) >= received_ts:
+                return
+            if current is None:
+                bisect.insort(self._sorted_dns, dn)
+            self._latest_by_dn[dn] = {
+                "dn": dn,
+                "topic": entry.get("topic"),
+                "payload": entry.get("payload"),
+                "received_ts": received_ts,
+            }
+            self._snapshot_cache.pop(dn, None)
+
+    def _clear_state(self, dn: str) -> None:
+        client = self._mqtt_client
+        if client is None:
+            return
+        try:
+            # An empty retained message deletes the broker's retained state for this DN.
+            client.publish(self._state_prefix + dn, payload=b"", qos=1, retain=True)
+        except Exception as exc:  # pragma: no cover - network errors
+            print(f"[bridge] state clear failed: {exc}")
+
+    def _evict_stale(self, now: float) -> None:
+        """Drop DNs silent for longer than state_ttl_sec and clear their retained state.
+        移除长时间无数据的 DN，并清除其 retained 状态。
+        """
+        cutoff = now - self.cfg.state_ttl_sec
+        with self._cache_lock:
+            stale = [dn for dn, entry in self._latest_by_dn.items() if entry["received_ts"] < cutoff]
+            for dn in stale:
+                del self._latest_by_dn[dn]
+                i = bisect.bisect_left(self._sorted_dns, dn)
+                if i < len(self._sorted_dns) and self._sorted_dns[i] == dn:
+                    del self._sorted_dns[i]
+                self._snapshot_cache.pop(dn, None)
+                self._history_by_dn.pop(dn, None)
+                self._state_published.pop(dn, None)
+                self._state_seen.pop(dn, None)
+        for dn in stale:
+            self._clear_state(dn)
+        if stale:
+            print(f"[bridge] evicted {len(stale)} DN(s) idle for more than {self.cfg.state_ttl_sec:.0f}s")
+
+    def _state_publish_loop(self) -> None:
+        interval = max(self.cfg.state_publish_sec, 0.1)
+        next_evict = time.monotonic()
+        while self._running.is_set():
+            time.sleep(interval)
+            client = self._mqtt_client
+            if client is None:
+                continue
+            if self.cfg.state_ttl_sec > 0 and time.monotonic() >= next_evict:
+                self._evict_stale(time.time())
+                next_evict = time.monotonic() + min(60.0, self.cfg.state_ttl_sec)
+            with self._cache_lock:
+                # Skip DNs another replica already published within this interval.
+                pending = [
+                    entry for dn, entry in self._latest_by_dn.items()
+                    if entry["received_ts"] > self._state_published.get(dn, 0.0)
+                    and entry["received_ts"] - self._state_seen.get(dn, 0.0) >= interval
+                ]
+                for entry in pending:
+                    self._state_published[entry["dn"]] = entry["received_ts"]
+            for entry in pending:
+                body = {"replica": self.cfg.replica_id, "entry": entry}
+                try:
+                    client.publish(
+                        self._state_prefix + entry["dn"],
+                        payload=json.dumps(body, ensure_ascii=False, separators=(",", ":")),
+                        qos=1,
+                        retain=True,
+                    )
+                except Exception as exc:  # pragma: no cover - network errors
+                    print(f"[bridge] state publish failed: {exc}")
+                    break
+
     def _decode_payload(self, payload: bytes | None) -> Any:
         if not payload:
             return None
@@ -202,28 +624,88 @@ class BridgeService:
     def _normalize_dn(value: Any) -> str:
         if value is None:
             return "UNKNOWN"
-        if isinstance(value, (bytes, bytearray, memoryview)):
-            return bytes(value).hex().upper()
-        if isinstance(value, int):
-            return f"{value:012X}"
-        text = str(value).strip()
-        clean = text.replace(":", "").replace("-", "")
-        if len(clean) >= 12 and all(c in "0123456789ABCDEFabcdef" for c in clean):
-            return clean[-12:].upper()
-        return text or "UNKNOWN"
+        if isinstance(value, str) and len(value.strip().replace(":", "").replace("-", "")) < 12:
+            return value.strip() or "UNKNOWN"  # not a full DN; keep the text as sent
+        # Same canonical form as the parser/sink (cached, interned).
+        return dn_to_hex(value) or str(value).strip() or "UNKNOWN"
+
+    def _record_history(self, dn: str, item: Any, received_ts: float) -> None:
+        # Must be called within _cache_lock. Non-sample payloads are skipped.
+        # 需在 _cache_lock 内调用；非采样数据直接忽略。
+        capacity = self.cfg.history_capacity
+        if capacity <= 0 or not isinstance(item, dict):
+            return
+        cfg = self.cfg
+        pressures = item.get(cfg.pressure_field)
+        if not isinstance(pressures, list):
+            return
+        try:
+            sn = int(item.get(cfg.sn_field) or len(pressures))
+            ts = float(item.get(cfg.ts_field) or 0.0)
+        except (TypeError, ValueError):
+            return
+        if sn <= 0 or sn > 255:  # SN is one byte on the wire
+            return
+        if ts <= 0:
+            ts = received_ts
+        ring = self._history_by_dn.get(dn)
+        if ring is None or ring.sn != sn or ring.capacity != capacity:
+            # Column layout depends on SN, so a changed SN starts a fresh ring.
+            # 列布局取决于 SN，SN 变化时重建缓冲。
+            ring = HistoryRing(capacity, sn)
+            self._history_by_dn[dn] = ring
+        try:
+            ring.append(ts, pressures, item.get(cfg.mag_field), item.get(cfg.gyro_field), item.get(cfg.acc_field))
+        except (TypeError, ValueError):
+            pass
 
     # ------------------------------------------------------------------
     # Cache & broadcast helpers
+    def _formatted(self, dn: str) -> Optional[Dict[str, Any]]:
+        # Must be called within _cache_lock.
+        cached = self._snapshot_cache.get(dn)
+        if cached is None:
+            entry = self._latest_by_dn.get(dn)
+            if entry is None:
+                return None
+            cached = _format_entry(entry)
+            self._snapshot_cache[dn] = cached
+        return cached
+
     def snapshot(self, filter_dn: Optional[str] = None) -> Iterable[Dict[str, Any]]:
         with self._cache_lock:
             if filter_dn:
-                entry = self._latest_by_dn.get(filter_dn)
+                entry = self._formatted(filter_dn)
                 return [entry] if entry else []
-            return [self._latest_by_dn[k] for k in sorted(self._latest_by_dn.keys())]
+            return [self._formatted(dn) for dn in self._sorted_dns]
 
     def get_dn(self, dn: str) -> Optional[Dict[str, Any]]:
         with self._cache_lock:
-            return self._latest_by_dn.get(dn)
+            return self._formatted(dn)
+
+    def history(self, dn: str, since: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        with self._cache_lock:
+            ring = self._history_by_dn.get(dn)
+            if ring is None:
+                return None
+            return ring.to_dict(dn, since)
+
+    def history_backfill(self, filter_dn: Optional[str], seconds: float) -> list[Dict[str, Any]]:
+        """Return the last ``seconds`` of history for one DN (or all DNs).
+        返回单个（或全部）DN 最近 ``seconds`` 秒的历史数据。
+        """
+        with self._cache_lock:
+            if filter_dn:
+                rings = [(filter_dn, self._history_by_dn.get(filter_dn))]
+            else:
+                rings = sorted(self._history_by_dn.items())
+            out = []
+            for dn, ring in rings:
+                if ring is None or not len(ring):
+                    continue
+                latest = ring.latest_ts()
+                out.append(ring.to_dict(dn, latest - seconds if latest is not None else None))
+            return out
 
     def _broadcast(self, entry: Dict[str, Any] | list[Dict[str, Any]]) -> None:
         # Emit to realtime sockets and queue-based SSE listeners simultaneously.
@@ -232,12 +714,13 @@ class BridgeService:
         self._push_to_listeners(entry)
 
     def _push_to_listeners(self, data: Dict[str, Any] | list[Dict[str, Any]]) -> None:
-        # Non-blocking push with drop-oldest fallback.
+        # Non-blocking push; each listener applies its own drop/coalesce policy.
         # Implements filtering based on DN.
         items = data if isinstance(data, list) else [data]
         
         with self._listeners_lock:
-            for q, filter_dn in list(self._listeners):
+            for listener in list(self._listeners):
+                filter_dn = listener.filter_dn
                 # Filter logic:
                 # If filter_dn is set, only push items that match that DN.
                 # If no items match, push nothing to this queue.
@@ -245,40 +728,53 @@ class BridgeService:
                     matched_items = [item for item in items if item.get("dn") == filter_dn]
                     if not matched_items:
                         continue
-                    # Push either a single item or list depending on original format? 
-                    # To be safe and consistent with client expectation, if we filtered down to 1 item 
-                    # from a list, we can send it as a single item if the original was single, 
-                    # but here 'data' type tells us.
-                    # Simpler: If the original data was a list, send a list. If single, send single.
+                    # If the original data was a list, send a list. If single, send single.
                     payload_to_send = matched_items if isinstance(data, list) else matched_items[0]
                 else:
                     payload_to_send = data
 
-                try:
-                    q.put_nowait(payload_to_send)
-                except queue.Full:
-                    try:
-                        q.get_nowait()
-                    except queue.Empty:
-                        pass
-                    try:
-                        q.put_nowait(payload_to_send)
-                    except queue.Full:
-                        # Should not happen if we just made space, unless extreme contention
-                        self._listeners.remove((q, filter_dn))
-
-    def register_listener(self, filter_dn: Optional[str] = None) -> queue.Queue:
-        q: queue.Queue = queue.Queue(maxsize=200)
+                if not listener.put(payload_to_send):
+                    # Close the stream so the browser reconnects with a fresh snapshot.
+                    listener.closed = True
+                    self._listeners.remove(listener)
+                    self._listeners_evicted += 1
+                    self._listeners_dropped_total += listener.dropped
+                    print(
+                        f"[bridge] evicted slow listener #{listener.id} ({listener.client}) "
+                        f"dropped={listener.dropped}"
+                    )
+
+    def register_listener(self, filter_dn: Optional[str] = None, mode: Optional[str] = None,
+                          client: Optional[str] = None) -> Listener:
+        with self._listeners_lock:
+            self._listener_seq += 1
+            listener = Listener(
+                self._listener_seq,
+                filter_dn,
+                (mode or self.cfg.listener_mode),
+                self.cfg.listener_queue_size,
+                client=client,
+            )
+            self._listeners.append(listener)
+        return listener
+
+    def unregister_listener(self, listener: Listener) -> None:
         with self._listeners_lock:
-            self._listeners.append((q, filter_dn))
-        return q
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+                self._listeners_dropped_total += listener.dropped
 
-    def unregister_listener(self, q: queue.Queue) -> None:
+    def listener_metrics(self) -> Dict[str, Any]:
         with self._listeners_lock:
-            # We have to find the tuple that contains this queue
-            to_remove = [item for item in self._listeners if item[0] == q]
-            for item in to_remove:
-                self._listeners.remove(item)
+            listeners = [listener.stats() for listener in self._listeners]
+            dropped_total = self._listeners_dropped_total + sum(item["dropped"] for item in listeners)
+            evicted = self._listeners_evicted
+        return {
+            "listener_count": len(listeners),
+            "evicted_total": evicted,
+            "dropped_total": dropped_total,
+            "listeners": listeners,
+        }
 
 
 bridge_config = BridgeConfig()
@@ -287,7 +783,22 @@ bridge_service = BridgeService(bridge_config)
 
 @APP.get("/healthz")
 def healthcheck() -> Any:
-    return {"status": "ok", "topics": bridge_config.mqtt_topic}
+    return {
+        "status": "ok",
+        "topics": bridge_config.mqtt_topic,
+        "replica": bridge_config.replica_id,
+        "backplane": bridge_config.backplane,
+    }
+
+
+@APP.get("/metrics")
+def metrics() -> Any:
+    # Per-listener queue depth / lag / drop counters for diagnosing slow dashboards.
+    # 每个监听者的队列深度、延迟与丢弃计数，用于排查远程看板卡顿。
+    metrics = bridge_service.listener_metrics()
+    metrics["replica"] = bridge_config.replica_id
+    metrics["layouts"] = plan_stats()
+    return metrics
 
 
 @APP.get("/api/latest")
@@ -303,6 +814,21 @@ def latest_by_dn(dn: str) -> Any:
     return entry
 
 
+@APP.get("/api/history/<dn>")
+def history_by_dn(dn: str) -> Any:
+    since_raw = request.args.get("since")
+    since: Optional[float] = None
+    if since_raw:
+        try:
+            since = float(since_raw)
+        except ValueError:
+            return jsonify({"error": "invalid-since"}), 400
+    data = bridge_service.history(BridgeService._normalize_dn(dn), since)
+    if data is None:
+        return jsonify({"error": "not-found"}), 404
+    return data
+
+
 def _format_sse(event: str, data: Any) -> str:
     payload = json.dumps(data, ensure_ascii=False)
     lines = payload.splitlines() or [""]
@@ -310,26 +836,49 @@ def _format_sse(event: str, data: Any) -> str:
     return "\n".join(msg_lines) + "\n\n"
 
 
+def _backfill_seconds(default: float) -> float:
+    # ?backfill=<seconds> overrides the default; invalid values disable backfill.
+    raw = request.args.get("backfill")
+    if raw is None:
+        return default
+    try:
+        return max(float(raw), 0.0)
+    except ValueError:
+        return 0.0
+
+
 @APP.get("/stream")
 def stream_all() -> Response:
-    return _stream_common(filter_dn=None)
+    # Backfilling every DN can be large, so the fan-out stream only does it on request.
+    # 全量流默认不回填历史（数据量大），需显式传 ?backfill=。
+    return _stream_common(filter_dn=None, backfill_sec=_backfill_seconds(0.0), mode=request.args.get("mode"))
 
 @APP.get("/stream/<dn>")
 def stream_by_dn(dn: str) -> Response:
     # Normalize DN (optional, but good practice if frontend sends lowercase)
     dn_clean = BridgeService._normalize_dn(dn)
-    return _stream_common(filter_dn=dn_clean)
+    return _stream_common(
+        filter_dn=dn_clean,
+        backfill_sec=_backfill_seconds(bridge_config.history_sec),
+        mode=request.args.get("mode"),
+    )
+
+def _stream_common(filter_dn: Optional[str], backfill_sec: float = 0.0, mode: Optional[str] = None) -> Response:
+    client = request.headers.get("X-Forwarded-For") or request.remote_addr
 
-def _stream_common(filter_dn: Optional[str]) -> Response:
     def generate():
         # Send a snapshot first so browsers have immediate state.
         yield _format_sse("snapshot", {"data": list(bridge_service.snapshot(filter_dn))})
+        # Then the buffered history so charts can render instantly.
+        # 随后推送缓存的历史数据，图表无需等待即可绘制。
+        if backfill_sec > 0:
+            yield _format_sse("history", {"data": bridge_service.history_backfill(filter_dn, backfill_sec)})
         
-        listener = bridge_service.register_listener(filter_dn)
+        listener = bridge_service.register_listener(filter_dn, mode=mode, client=client)
         try:
-            while bridge_service._running.is_set():
+            while bridge_service._running.is_set() and not listener.closed:
                 try:
-                    # Queue get is now gevent-patched (yielding)
+                    # Queue/Event waits are gevent-patched (yielding)
                     item = listener.get(timeout=1.0)
                 except queue.Empty:
                     continue
@@ -5,6 +5,19 @@ Listens to binary payload topics on the broker's TCP port (1883 by default),
 parses each frame using the existing sensor2 routine, and republishes JSON
 frames through the broker's WebSocket port (9001 by default). This lets
 resource-constrained Android/edge devices publish raw frames only.
+
+Parsed frames are grouped per DN and published as one JSON array per DN
+(the same batch format data_receive uses) once BATCH_MAX_ITEMS frames are
+collected or the oldest frame is BATCH_MAX_MS old.
+
+With PARSER_WORKERS > 0, raw payloads are decoded in a process pool; each
+payload carries a sequence number and results are released strictly in
+arrival order, so every DN's frames are published in the order received.
+
+Frames are cut by backend/frame_scanner.py in the subscriber thread. Each
+payload is scanned on its own: the raw topic mixes all devices and bridges, so
+a partial frame at the end of a payload cannot be joined with the next one and
+is dropped (carry_dropped_bytes).
 """
 
 from __future__ import annotations
@@ -12,13 +25,14 @@ from __future__ import annotations
 import configparser
 import json
 import os
+import queue
 import signal
 import sys
 import threading
 import time
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterator
 
 import paho.mqtt.client as mqtt
 
@@ -29,12 +43,9 @@ if str(APP_DIR) not in sys.path:
     sys.path.insert(0, str(APP_DIR))
 
 import sensor2  # type: ignore  # noqa: E402
-
-
-START_MARKER = 0x5A
-END_MARKER = 0xA5
-MIN_HEADER_SIZE = 2 + 6 + 1 + 4 + 2  # markers + DN + SN + timestamp + ms
-IMU_TAIL_BYTES = 36 + 2  # Magnetometer + gyro + acc + end markers
+from device_dn import to_hex as dn_to_hex  # type: ignore  # noqa: E402
+from frame_layout import plan_stats  # type: ignore  # noqa: E402
+from frame_scanner import FrameScanner, iter_frames  # type: ignore  # noqa: E402,F401
 
 
 @dataclass
@@ -52,6 +63,13 @@ class ParserConfig:
     parsed_topic_prefix: str = "etx/v1/parsed"
     parsed_qos: int = 1
     parsed_client_id: str = "raw-parser-pub"
+    # Per-DN batching of parsed frames (same JSON-array format as data_receive).
+    batch_max_items: int = 50
+    batch_max_ms: int = 40
+    # 0 = decode inside the MQTT callback thread; N = N decoder processes.
+    parser_workers: int = 0
+    # Raw payloads allowed in flight per worker before the subscriber waits.
+    worker_inflight: int = 8
 
     def __post_init__(self) -> None:
         self._load_from_file()
@@ -76,6 +94,10 @@ class ParserConfig:
             self.parsed_topic_prefix = section.get("PARSED_TOPIC_PREFIX", self.parsed_topic_prefix)
             self.parsed_qos = section.getint("PARSED_QOS", self.parsed_qos)
             self.parsed_client_id = section.get("PARSED_CLIENT_ID", self.parsed_client_id)
+            self.batch_max_items = section.getint("BATCH_MAX_ITEMS", self.batch_max_items)
+            self.batch_max_ms = section.getint("BATCH_MAX_MS", self.batch_max_ms)
+            self.parser_workers = section.getint("PARSER_WORKERS", self.parser_workers)
+            self.worker_inflight = section.getint("WORKER_INFLIGHT", self.worker_inflight)
 
     def _override_from_env(self) -> None:
         env = os.getenv
@@ -91,6 +113,10 @@ class ParserConfig:
         self.parsed_topic_prefix = env("PARSED_TOPIC_PREFIX", self.parsed_topic_prefix)
         self.parsed_qos = int(env("PARSED_QOS", self.parsed_qos))
         self.parsed_client_id = env("PARSED_CLIENT_ID", self.parsed_client_id)
+        self.batch_max_items = max(1, int(env("PARSED_BATCH_MAX_ITEMS", self.batch_max_items)))
+        self.batch_max_ms = max(0, int(env("PARSED_BATCH_MAX_MS", self.batch_max_ms)))
+        self.parser_workers = max(0, int(env("PARSER_WORKERS", self.parser_workers)))
+        self.worker_inflight = max(1, int(env("PARSER_WORKER_INFLIGHT", self.worker_inflight)))
 
 
 class RawParserService:
@@ -105,6 +131,22 @@ class RawParserService:
         self._pkt_in = 0
         self._frames_ok = 0
         self._frames_err = 0
+        self._msgs_out = 0
+        # No carry-over: one raw topic interleaves many senders (see frame_scanner).
+        self._scanner = FrameScanner(max_carry=0)
+        # dn_hex -> (first_frame_monotonic, [body, ...]); guarded by _batch_lock
+        self._batches: dict[str, tuple[float, list]] = {}
+        self._batch_lock = threading.Lock()
+        self._last_drop_log = 0.0
+        # Worker-pool mode: payload sequence numbers, completed results, in-flight bound.
+        self._pool: ProcessPoolExecutor | None = None
+        self._reorder_thread: threading.Thread | None = None
+        if cfg.parser_workers > 0:
+            self._pool = ProcessPoolExecutor(max_workers=cfg.parser_workers, initializer=_worker_init)
+            self._inflight = threading.BoundedSemaphore(cfg.parser_workers * cfg.worker_inflight)
+            self._results: queue.Queue = queue.Queue()
+            self._next_seq = 0
+            self._reorder_thread = threading.Thread(target=self._reorder_loop, daemon=True)
 
     # ------------------------------------------------------------------ MQTT Clients
     def _build_sub_client(self) -> mqtt.Client:
@@ -134,6 +176,10 @@ class RawParserService:
         self._sub_client.connect(self.cfg.raw_broker_host, self.cfg.raw_broker_port, keepalive=30)
         self._sub_client.loop_start()
         threading.Thread(target=self._stats_loop, daemon=True).start()
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+        if self._reorder_thread is not None:
+            self._reorder_thread.start()
+            print(f"[RAW] decoding with {self.cfg.parser_workers} worker processes")
         try:
             while self._running.is_set():
                 time.sleep(0.2)
@@ -152,6 +198,13 @@ class RawParserService:
             self._sub_client.disconnect()
         except Exception:
             pass
+        if self._pool is not None:
+            # Let queued payloads finish, then drain the reorder buffer.
+            self._pool.shutdown(wait=True)
+            self._results.put(None)
+            if self._reorder_thread.is_alive():
+                self._reorder_thread.join(timeout=5)
+        self._flush_due(force=True)
         try:
             self._pub_client.loop_stop()
         except Exception:
@@ -193,61 +246,158 @@ class RawParserService:
             print(f"[PARSED] unexpected disconnect rc={rc}")
 
     def _on_sub_message(self, _client: mqtt.Client, _userdata, message: mqtt.MQTTMessage) -> None:
-        payload = message.payload
         with self._lock:
             self._pkt_in += 1
-        for frame in iter_frames(payload):
-            self._handle_frame(frame)
+        # Scanning stays here (it keeps the counters); workers only decode.
+        frames = self._scanner.feed(message.payload)
+        if not frames:
+            return
+        if self._pool is None:
+            items, bad = decode_frames(frames)
+            self._add_parsed(items, bad)
+            return
+        # Blocks the subscriber (and so the broker socket) once every worker is busy.
+        self._inflight.acquire()
+        seq = self._next_seq  # paho delivers messages on a single thread
+        self._next_seq += 1
+        try:
+            future = self._pool.submit(decode_frames, frames)
+        except RuntimeError:  # pool already shut down
+            self._inflight.release()
+            return
+        future.add_done_callback(lambda f, seq=seq: self._results.put((seq, f)))
+
+    # ------------------------------------------------------------------ Worker pool
+    def _reorder_loop(self) -> None:
+        # Results complete out of order; release them by sequence number.
+        pending: dict = {}
+        next_seq = 0
+        while True:
+            item = self._results.get()
+            if item is None:
+                break
+            seq, future = item
+            pending[seq] = future
+            while next_seq in pending:
+                future = pending.pop(next_seq)
+                next_seq += 1
+                self._inflight.release()
+                try:
+                    items, bad = future.result()
+                except Exception as exc:
+                    print(f"[RAW] decode worker failed: {exc}")
+                    items, bad = [], 1
+                self._add_parsed(items, bad)
+
+    # ------------------------------------------------------------------ Batch publishing
+    def _add_parsed(self, items: list, bad: int) -> None:
+        now = time.monotonic()
+        # publish() only queues inside paho, so it stays under the lock: that keeps
+        # a DN's batches in order between this thread and the flush thread.
+        with self._batch_lock:
+            for dn_hex, body in items:
+                entry = self._batches.get(dn_hex)
+                if entry is None:
+                    entry = self._batches[dn_hex] = (now, [])
+                entry[1].append(body)
+                if len(entry[1]) >= self.cfg.batch_max_items:
+                    self._publish_batch(dn_hex, self._batches.pop(dn_hex)[1])
+        if bad:
+            with self._lock:
+                self._frames_err += bad
+
+    def _flush_due(self, force: bool = False) -> None:
+        # Publish batches whose first frame is older than batch_max_ms.
+        cutoff = time.monotonic() - self.cfg.batch_max_ms / 1000.0
+        with self._batch_lock:
+            due = [dn for dn, (t0, _) in self._batches.items() if force or t0 <= cutoff]
+            for dn_hex in due:
+                self._publish_batch(dn_hex, self._batches.pop(dn_hex)[1])
+
+    def _flush_loop(self) -> None:
+        interval = max(self.cfg.batch_max_ms / 2000.0, 0.005)
+        while self._running.is_set():
+            time.sleep(interval)
+            self._flush_due()
 
-    # ------------------------------------------------------------------ Frame handling
-    def _handle_frame(self, frame: bytes) -> None:
-        sd = sensor2.parse_sensor_data(frame)
-        if sd is None:
+    def _publish_batch(self, dn_hex: str, bodies: list) -> None:
+        # Never block the paho callback thread: while the publisher is down the
+        # batch is dropped (and counted) instead of waiting for a reconnect.
+        if not self._pub_connected.is_set():
             with self._lock:
-                self._frames_err += 1
+                self._frames_err += len(bodies)
+            now = time.monotonic()
+            if now - self._last_drop_log >= 5:
+                self._last_drop_log = now
+                print("[PARSED] publish client not connected, dropping batches")
             return
-        dn_hex, body = encode_parsed(sd)
         topic = f"{self.cfg.parsed_topic_prefix.rstrip('/')}/{dn_hex}"
-        payload = json.dumps(body, ensure_ascii=False, separators=(",", ":"))
-        if not self._pub_connected.wait(timeout=5):
-            print("[PARSED] publish client not connected, dropping frame")
-            with self._lock:
-                self._frames_err += 1
-            return
+        # Frames arrive pre-serialized from decode_frames(); only the array is built here.
+        payload = "[" + ",".join(bodies) + "]"
         result = self._pub_client.publish(topic, payload=payload, qos=self.cfg.parsed_qos)
         if result.rc == mqtt.MQTT_ERR_SUCCESS:
             with self._lock:
-                self._frames_ok += 1
+                self._frames_ok += len(bodies)
+                self._msgs_out += 1
         else:
             print(f"[PARSED] publish failed rc={result.rc}")
             with self._lock:
-                self._frames_err += 1
+                self._frames_err += len(bodies)
 
     # ------------------------------------------------------------------ Stats
     def _stats_loop(self) -> None:
         last = time.time()
-        last_pkt = last_ok = last_err = 0
+        last_pkt = last_ok = last_err = last_out = 0
         while self._running.is_set():
             time.sleep(5)
             with self._lock:
                 pkt = self._pkt_in
                 ok = self._frames_ok
                 err = self._frames_err
+                out = self._msgs_out
             now = time.time()
             dt = max(now - last, 1e-6)
             pkt_rate = (pkt - last_pkt) / dt
             ok_rate = (ok - last_ok) / dt
             err_rate = (err - last_err) / dt
+            out_rate = (out - last_out) / dt
+            scan = self._scanner.stats()
             print(
                 f"[STATS] raw_packets={pkt} ({pkt_rate:.1f}/s)  parsed_frames={ok} ({ok_rate:.1f}/s)"
-                f"  errors={err} ({err_rate:.2f}/s)"
+                f"  parsed_msgs={out} ({out_rate:.1f}/s)  errors={err} ({err_rate:.2f}/s)"
+                f"  resyncs={scan['resyncs']} garbage_bytes={scan['garbage_bytes']}"
+                f" carried={scan['carried']}"
+                f"  sn_layouts={','.join(str(p['sn']) for p in plan_stats()) or '-'}"
             )
-            last, last_pkt, last_ok, last_err = now, pkt, ok, err
+            last, last_pkt, last_ok, last_err, last_out = now, pkt, ok, err, out
 
 
 # ---------------------------------------------------------------------- Helpers
+def decode_frames(frames: list) -> tuple[list, int]:
+    """Parse scanned frames and JSON-encode each one.
+    Returns ([(dn_hex, body_json), ...], invalid_frame_count). Also runs in worker
+    processes, where returning strings keeps pickling back to the parent cheap.
+    """
+    items = []
+    bad = 0
+    for sd in sensor2.parse_sensor_frames(frames):
+        if sd is None:
+            bad += 1
+            continue
+        dn_hex, body = encode_parsed(sd)
+        items.append((dn_hex, json.dumps(body, ensure_ascii=False, separators=(",", ":"))))
+    return items, bad
+
+
+def _worker_init() -> None:
+    # Ctrl+C / SIGTERM are handled by the parent, which drains the pool itself.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if hasattr(signal, "SIGTERM"):
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
 def encode_parsed(sd: sensor2.SensorData) -> tuple[str, dict]:
-    dn_hex = _dn_to_hex(sd.dn)
+    dn_hex = dn_to_hex(sd.dn, "UNKNOWN")
     body = {
         "ts": float(sd.timestamp),
         "dn": dn_hex,
@@ -260,47 +410,6 @@ def encode_parsed(sd: sensor2.SensorData) -> tuple[str, dict]:
     return dn_hex, body
 
 
-def _dn_to_hex(dn: object) -> str:
-    if isinstance(dn, (bytes, bytearray)):
-        b = bytes(dn)
-    elif isinstance(dn, (tuple, list)):
-        b = bytes(dn)
-    elif isinstance(dn, int):
-        b = dn.to_bytes(6, byteorder="big", signed=False)
-    elif isinstance(dn, str):
-        hex_str = dn.replace(" ", "").replace("-", "")
-        b = bytes.fromhex(hex_str[-12:].rjust(12, "0"))
-    else:
-        b = bytes(bytearray(dn))  # type: ignore[arg-type]
-    return b.hex().upper()
-
-
-def iter_frames(blob: bytes) -> Iterator[bytes]:
-    """Yield well-formed frames from a possibly concatenated payload."""
-    data = memoryview(blob)
-    idx = 0
-    length = len(data)
-    while idx + MIN_HEADER_SIZE + 2 <= length:
-        if data[idx] != START_MARKER or data[idx + 1] != START_MARKER:
-            idx += 1
-            continue
-        if idx + MIN_HEADER_SIZE > length:
-            break
-        sn = data[idx + 8]
-        frame_len = 2 + 6 + 1 + 4 + 2 + sn * 4 + IMU_TAIL_BYTES
-        if frame_len <= 0:
-            idx += 2
-            continue
-        end_idx = idx + frame_len
-        if end_idx > length:
-            break  # wait for the rest in the next packet
-        if data[end_idx - 2] != END_MARKER or data[end_idx - 1] != END_MARKER:
-            idx += 2
-            continue
-        yield bytes(data[idx:end_idx])
-        idx = end_idx
-
-
 def main() -> None:
     cfg = ParserConfig()
     service = RawParserService(cfg)
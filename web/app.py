@@ -1,5 +1,6 @@
 import json
 import os
+import queue
 import sys
 import threading
 import uuid
@@ -14,6 +15,7 @@ from typing import Iterator
 # This makes requests.get() and time.sleep() non-blocking greenlets
 from gevent import monkey
 monkey.patch_all()
+from gevent.threadpool import ThreadPoolExecutor
 
 import requests
 from flask import (
@@ -29,12 +31,9 @@ from flask import (
     redirect,
     url_for,
     flash,
-    send_file,
-    after_this_request
 )
-import zipfile
-import tempfile
 from gevent.pywsgi import WSGIServer
+from werkzeug.security import safe_join
 
 import db_manager
 from config_backend import ConfigValidationError, build_config_service_from_env
@@ -46,6 +45,8 @@ from discovery_backend import (
     send_device_payload,
 )
 from license_backend import LicenseConfig, LicenseError, LicenseService
+from stream_backend import StreamBroadcaster
+from zip_stream import fresh_sidecar, gzip_layout, stream_zip
 
 """
 Tiny Flask app that proxies data from the MQTT bridge to the browser UI.
@@ -62,6 +63,27 @@ if BRIDGE_TIMEOUT_READ is not None:
     except ValueError:
         BRIDGE_TIMEOUT_READ = None  # 非法值视为 None（不设读超时）
 
+# Share one upstream bridge connection per stream path across all browser tabs.
+# 同一路径的所有浏览器标签共享一条上游桥接连接。
+STREAM_PROXY_MULTIPLEX = os.getenv("STREAM_PROXY_MULTIPLEX", "1") != "0"
+STREAM_PROXY_LINGER_SEC = float(os.getenv("STREAM_PROXY_LINGER_SEC", "30"))
+STREAM_PROXY_QUEUE_SIZE = int(os.getenv("STREAM_PROXY_QUEUE_SIZE", "256"))
+STREAM_PROXY_KEEPALIVE_SEC = float(os.getenv("STREAM_PROXY_KEEPALIVE_SEC", "15"))
+
+# zlib level for /download/batch (1 = fastest, 9 = smallest).
+ZIP_STREAM_LEVEL = int(os.getenv("ZIP_STREAM_LEVEL", "6"))
+# Native threads that deflate export blocks (0 = compress inline in the greenlet, the default:
+# debug_zip_perf.py measured the threaded path slower than serial on typical hosts).
+# 压缩线程数，默认 0（串行）；仅当单个文件不小于 ZIP_PARALLEL_MIN_MB 时才使用线程池。
+ZIP_WORKERS = int(os.getenv("ZIP_WORKERS", "0"))
+ZIP_WINDOW = int(os.getenv("ZIP_WINDOW", str(max(2, ZIP_WORKERS * 2))))
+ZIP_PARALLEL_MIN_BYTES = int(float(os.getenv("ZIP_PARALLEL_MIN_MB", "64")) * 1024 * 1024)
+ZIP_USER_CONCURRENCY = int(os.getenv("ZIP_USER_CONCURRENCY", "2"))
+
+# /api/files page size (rows per request from the downloads page) and its upper bound.
+FILES_PAGE_DEFAULT = int(os.getenv("FILES_PAGE_DEFAULT", "100"))
+FILES_PAGE_MAX = int(os.getenv("FILES_PAGE_MAX", "500"))
+
 CONFIG_CONSOLE_PORT = int(os.getenv("CONFIG_CONSOLE_PORT", "5002"))
 CONFIG_CONSOLE_ENABLED = os.getenv("CONFIG_CONSOLE_ENABLED", "1") != "0"
 
@@ -140,6 +162,8 @@ def login():
         password = request.form.get("password")
         user = db_manager.authenticate_user(username, password)
         if user:
+            # A fresh login always re-reads group membership.
+            db_manager.invalidate_permission_cache(user['sso_id'])
             session.permanent = True
             session['user_id'] = user['id']
             session['sso_id'] = user['sso_id']
@@ -152,6 +176,9 @@ def login():
 
 @app.route("/logout")
 def logout():
+    user = session.get('sso_id')
+    if user:
+        db_manager.invalidate_permission_cache(user)
     session.clear()
     return redirect(url_for("login"))
 
@@ -183,24 +210,118 @@ def downloads():
     
     # Check permission for MAC
     if mac and user != 'admin':
-        allowed = db_manager.get_user_allowed_devices(user)
-        allowed_macs = [d['mac_address'] for d in allowed]
-        if mac not in allowed_macs:
+        if mac not in db_manager.get_user_allowed_macs(user):
             abort(403)
 
     if mac and date_str:
-        # Step 3: Files
-        files = db_manager.get_device_files(mac, date_str)
-        return render_template("downloads.html", step="files", mac=mac, date=date_str, files=files)
+        # Step 3: Files (rows are paged in by the browser from /api/files)
+        return render_template("downloads.html", step="files", mac=mac, date=date_str,
+                               page_size=FILES_PAGE_DEFAULT)
     elif mac:
-        # Step 2: Dates
-        dates = db_manager.get_device_dates(mac)
+        # Step 2: Dates (with per-day count/size from the summary view)
+        dates = db_manager.get_device_date_summary(mac)
         return render_template("downloads.html", step="dates", mac=mac, dates=dates)
     else:
         # Step 1: Devices
         devices = db_manager.get_user_allowed_devices(user)
         return render_template("downloads.html", step="devices", devices=devices)
 
+
+def _parse_date_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def _parse_int_arg(name):
+    value = request.args.get(name)
+    return int(value) if value not in (None, "") else None
+
+
+def _file_item(row):
+    return {
+        "id": row["id"],
+        "mac": row["mac_address"],
+        "name": row["file_name"],
+        "path": (row["file_path"] or "") + row["file_name"],
+        "size": row["file_size"],
+        "compressed_size": row.get("compressed_size"),
+        "date": row["file_date"].isoformat() if row["file_date"] else None,
+        "time": row["file_time"].isoformat() if row["file_time"] else None,
+        "datetime": row["file_datetime"].isoformat() if row["file_datetime"] else None,
+        "url": url_for("download_file", filepath=(row["file_path"] or "") + row["file_name"]),
+    }
+
+
+@app.route("/api/files")
+@login_required
+def api_files():
+    """Keyset-paginated file listing.
+    Query: mac, start/end (YYYY-MM-DD), min_size/max_size (bytes), cursor, limit.
+    按 (file_datetime, id) 翻页，next_cursor 为空表示没有下一页。
+    """
+    user = session['sso_id']
+    mac = request.args.get("mac")
+    try:
+        start_date = _parse_date_arg("start")
+        end_date = _parse_date_arg("end")
+        min_size = _parse_int_arg("min_size")
+        max_size = _parse_int_arg("max_size")
+        limit = _parse_int_arg("limit") or FILES_PAGE_DEFAULT
+    except ValueError as exc:
+        return jsonify({"error": "invalid_filter", "detail": str(exc)}), 400
+    limit = max(1, min(limit, FILES_PAGE_MAX))
+
+    if user == 'admin':
+        macs = [mac] if mac else None
+    else:
+        allowed = db_manager.get_user_allowed_macs(user)
+        if mac and mac not in allowed:
+            abort(403)
+        macs = [mac] if mac else sorted(allowed)
+
+    try:
+        rows, next_cursor = db_manager.list_files(
+            macs, start_date, end_date, min_size, max_size,
+            cursor=request.args.get("cursor"), limit=limit,
+        )
+    except ValueError as exc:
+        return jsonify({"error": "invalid_cursor", "detail": str(exc)}), 400
+    if rows is None:
+        return jsonify({"error": "query_failed"}), 500
+    return jsonify({"items": [_file_item(r) for r in rows], "next_cursor": next_cursor})
+
+
+@app.route("/api/files/dates")
+@login_required
+def api_file_dates():
+    """Per-date file count and total size for one device (from data_files_daily)."""
+    user = session['sso_id']
+    mac = request.args.get("mac")
+    if not mac:
+        return jsonify({"error": "mac_required"}), 400
+    if user != 'admin' and mac not in db_manager.get_user_allowed_macs(user):
+        abort(403)
+    items = [
+        {"date": r["file_date"].isoformat(), "count": r["file_count"], "total_size": int(r["total_size"] or 0)}
+        for r in db_manager.get_device_date_summary(mac)
+    ]
+    return jsonify({"items": items})
+
+def _sidecar_matches(abs_path: str) -> bool:
+    # Same test as ZipStream: mtime alone misses a CSV reopened and appended within
+    # the timestamp resolution, so the gzip ISIZE must also equal the CSV size.
+    gz_path = fresh_sidecar(abs_path)
+    if gz_path is None:
+        return False
+    try:
+        isize = gzip_layout(gz_path)[3]
+        return isize == os.path.getsize(abs_path) & 0xFFFFFFFF
+    except (OSError, ValueError):
+        return False
+
+
 @app.route("/download/<path:filepath>")
 @login_required
 def download_file(filepath):
@@ -220,12 +341,28 @@ def download_file(filepath):
     # Verify permission
     user = session['sso_id']
     if user != 'admin':
-        allowed = db_manager.get_user_allowed_devices(user)
-        allowed_macs = [d['mac_address'] for d in allowed]
-        if target_mac not in allowed_macs:
+        if target_mac not in db_manager.get_user_allowed_macs(user):
             abort(403)
 
-    return send_from_directory('/mqtt_store', filepath, as_attachment=True)
+    # Serve the sink's precompressed .csv.gz when the client accepts gzip;
+    # the browser decodes it and saves the plain CSV.
+    # 客户端支持 gzip 时直接发送预压缩文件，无需每次重新压缩。
+    abs_path = safe_join('/mqtt_store', filepath)
+    if abs_path and request.accept_encodings["gzip"] > 0 and _sidecar_matches(abs_path):
+        response = send_from_directory(
+            '/mqtt_store',
+            filepath + '.gz',
+            as_attachment=True,
+            download_name=os.path.basename(filepath),
+            mimetype='text/csv',
+        )
+        response.headers['Content-Encoding'] = 'gzip'
+        response.vary.add('Accept-Encoding')
+        return response
+
+    response = send_from_directory('/mqtt_store', filepath, as_attachment=True)
+    response.vary.add('Accept-Encoding')
+    return response
 
 @app.route("/download/batch", methods=["POST", "GET"])
 @login_required
@@ -250,8 +387,7 @@ def download_batch():
     # Permission Check
     user = session['sso_id']
     if user != 'admin':
-        allowed = db_manager.get_user_allowed_devices(user)
-        allowed_macs = set(d['mac_address'] for d in allowed)
+        allowed_macs = db_manager.get_user_allowed_macs(user)
     
     clean_targets = []
     for rp in rel_paths:
@@ -271,28 +407,36 @@ def download_batch():
     if not clean_targets:
         return "No accessible files found", 404
 
-    # Create Zip
-    try:
-        fd, temp_path = tempfile.mkstemp(suffix='.zip')
-        os.close(fd)
-        
-        with zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_DEFLATED) as zf:
-            for abs_p, arc_n in clean_targets:
-                zf.write(abs_p, arc_n)
-        
-        @after_this_request
-        def remove_temp(response):
-            try:
-                os.remove(temp_path)
-            except Exception:
-                pass
-            return response
-            
-        filename = f"batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
-        return send_file(temp_path, as_attachment=True, download_name=filename)
-        
-    except Exception as e:
-        return f"Zip error: {e}", 500
+    # Stream the archive: headers and deflated chunks go out as each CSV is read,
+    # so the first byte is immediate and no temp file is written.
+    # 流式输出 ZIP，首字节即时返回，不再写临时文件。
+    store = (request.values.get("store") or "").lower() in ("1", "true", "yes")
+
+    # Each export holds compression workers for its whole duration; cap them per user.
+    if not _acquire_export_slot(user):
+        return "Too many concurrent exports, please wait for the running download to finish", 429
+
+    def generate() -> Iterator[bytes]:
+        try:
+            yield from stream_zip(
+                clean_targets,
+                store=store,
+                level=ZIP_STREAM_LEVEL,
+                executor=zip_executor,
+                window=ZIP_WINDOW,
+                parallel_min_bytes=ZIP_PARALLEL_MIN_BYTES,
+            )
+        except (OSError, ValueError) as exc:
+            # Headers are already sent; the truncated archive fails the client's CRC check.
+            print(f"[download] batch zip aborted for {user}: {exc}", file=sys.stderr)
+
+    filename = f"batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+    response = Response(stream_with_context(generate()), mimetype="application/zip")
+    response.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    response.headers["X-Accel-Buffering"] = "no"
+    # call_on_close also fires when the client disconnects before the first chunk.
+    response.call_on_close(lambda: _release_export_slot(user))
+    return response
 
 if LICENSE_ENABLED:
     try:
@@ -313,6 +457,35 @@ else:
 
 _direct_results = deque(maxlen=200)
 
+zip_executor = ThreadPoolExecutor(max_workers=ZIP_WORKERS) if ZIP_WORKERS > 0 else None
+_active_exports: dict[str, int] = {}
+_active_exports_lock = threading.Lock()
+
+
+def _acquire_export_slot(user: str) -> bool:
+    with _active_exports_lock:
+        count = _active_exports.get(user, 0)
+        if ZIP_USER_CONCURRENCY > 0 and count >= ZIP_USER_CONCURRENCY:
+            return False
+        _active_exports[user] = count + 1
+        return True
+
+
+def _release_export_slot(user: str) -> None:
+    with _active_exports_lock:
+        count = _active_exports.get(user, 0) - 1
+        if count > 0:
+            _active_exports[user] = count
+        else:
+            _active_exports.pop(user, None)
+
+stream_broadcaster = StreamBroadcaster(
+    BRIDGE_API_BASE_URL,
+    connect_timeout=BRIDGE_TIMEOUT_CONNECT,
+    linger_sec=STREAM_PROXY_LINGER_SEC,
+    subscriber_queue_size=STREAM_PROXY_QUEUE_SIZE,
+)
+
 
 def _bridge_url(path: str) -> str:
     # Build absolute path lazily so deployments can override the base URL.
@@ -513,11 +686,74 @@ def proxy_latest() -> Response:
     return jsonify(resp.json())
 
 
+def _sse_headers(response: Response) -> Response:
+    response.headers["Content-Type"] = "text/event-stream; charset=utf-8"
+    response.headers["Cache-Control"] = "no-cache, no-transform"
+    response.headers["X-Accel-Buffering"] = "no"
+    response.headers["Connection"] = "keep-alive"
+    return response
+
+
+def _sse_event(event: str, data) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+def _initial_events(remote_path: str) -> Iterator[bytes]:
+    """Fetch a fresh snapshot (and per-DN history) for a tab joining a shared upstream.
+    加入共享上游的新标签页无法收到上游首帧快照，这里单独拉取一次。
+    """
+    timeout = (BRIDGE_TIMEOUT_CONNECT, BRIDGE_TIMEOUT_READ or 10)
+    dn = remote_path[len("/stream/"):] if remote_path.startswith("/stream/") else None
+    try:
+        if dn:
+            resp = requests.get(_bridge_url(f"/api/latest/{dn}"), timeout=timeout)
+            entries = [resp.json()] if resp.status_code == 200 else []
+            yield _sse_event("snapshot", {"data": entries})
+            resp = requests.get(_bridge_url(f"/api/history/{dn}"), timeout=timeout)
+            if resp.status_code == 200:
+                yield _sse_event("history", {"data": [resp.json()]})
+        else:
+            resp = requests.get(_bridge_url("/api/latest"), timeout=timeout)
+            resp.raise_for_status()
+            yield _sse_event("snapshot", resp.json())
+    except (requests.RequestException, ValueError) as exc:
+        # The live stream still works; the browser falls back to /api/latest polling.
+        print(f"[stream-proxy] snapshot fetch failed for {remote_path}: {exc}", file=sys.stderr)
+
+
 def _stream_proxy_common(remote_path: str) -> Response:
-    """Helper to stream from a specific bridge path.
-    Performance Note: We use iter_content (raw bytes) instead of iter_lines + json parsing
-    to avoid CPU bottlenecks in Python. Filtering is delegated to the client side.
+    """Stream a bridge SSE path to the browser.
+    Performance Note: bytes are relayed without JSON parsing; filtering is delegated
+    to the client side. In multiplex mode all tabs share one upstream per path.
     """
+    if not STREAM_PROXY_MULTIPLEX:
+        return _stream_proxy_direct(remote_path)
+
+    def generate() -> Iterator[bytes]:
+        # Subscribe before fetching the snapshot so no update falls in between.
+        # History is fetched per tab below, so the shared upstream skips its backfill.
+        upstream, sub = stream_broadcaster.subscribe(f"{remote_path}?backfill=0")
+        try:
+            yield b": proxy connected\n\n"
+            yield from _initial_events(remote_path)
+            while True:
+                try:
+                    chunk = sub.queue.get(timeout=STREAM_PROXY_KEEPALIVE_SEC)
+                except queue.Empty:
+                    # Periodic write so dead clients are detected and proxies keep the link open.
+                    yield b": keepalive\n\n"
+                    continue
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            upstream.unsubscribe(sub)
+
+    return _sse_headers(Response(stream_with_context(generate()), mimetype="text/event-stream"))
+
+
+def _stream_proxy_direct(remote_path: str) -> Response:
+    """Legacy path: one upstream requests connection per browser tab (STREAM_PROXY_MULTIPLEX=0)."""
     def generate() -> Iterator[bytes]:
         headers = {
             "Accept": "text/event-stream",
@@ -545,15 +781,7 @@ def _stream_proxy_common(remote_path: str) -> Response:
             payload = json.dumps({"error": "bridge_unavailable", "detail": str(exc)})
             yield f"event: error\ndata: {payload}\n\n".encode("utf-8")
 
-    response = Response(
-        stream_with_context(generate()),
-        mimetype="text/event-stream",
-    )
-    response.headers["Content-Type"] = "text/event-stream; charset=utf-8"
-    response.headers["Cache-Control"] = "no-cache, no-transform"
-    response.headers["X-Accel-Buffering"] = "no"
-    response.headers["Connection"] = "keep-alive"
-    return response
+    return _sse_headers(Response(stream_with_context(generate()), mimetype="text/event-stream"))
 
 
 @app.route("/stream")
@@ -600,9 +828,36 @@ def healthz() -> Response:
         "status": "ok",
         "bridge": BRIDGE_API_BASE_URL,
         "config_console": "ready" if config_service else "disabled",
+        "stream_upstreams": stream_broadcaster.stats() if STREAM_PROXY_MULTIPLEX else None,
+        "permission_cache": db_manager.permission_cache_stats(),
+        "db_pool": db_manager.db_metrics()["pool"],
     })
 
 
+@app.route("/api/admin/db/metrics")
+@login_required
+def admin_db_metrics() -> Response:
+    # Pool usage plus per-query-function latency; ?reset=1 starts a new window.
+    # 连接池状态与各查询函数耗时，用于定位登录/下载卡顿。
+    if session.get('sso_id') != 'admin':
+        abort(403)
+    reset = request.args.get("reset") in ("1", "true", "yes")
+    return jsonify(db_manager.db_metrics(reset=reset))
+
+
+@app.route("/api/admin/permissions/invalidate", methods=["POST"])
+@login_required
+def admin_invalidate_permissions() -> Response:
+    # Hook for whoever edits user groups / device ownership in the database.
+    # 修改用户组或设备归属后调用，立即生效而无需等待 TTL。
+    if session.get('sso_id') != 'admin':
+        abort(403)
+    data = request.get_json(silent=True) or {}
+    username = data.get("username") or None
+    db_manager.invalidate_permission_cache(username)
+    return jsonify({"status": "ok", "username": username})
+
+
 @app.route("/console")
 @login_required
 def config_index() -> str:
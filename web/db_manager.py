@@ -1,6 +1,13 @@
+import base64
 import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from functools import wraps
+
 import psycopg2
-from psycopg2 import pool, extras
+from psycopg2 import extensions, extras
 
 # 从环境变量加载配置
 DB_HOST = os.getenv("DB_HOST")
@@ -9,35 +16,286 @@ DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASS = os.getenv("DB_PASS")
 
+# 权限缓存：TTL 秒数（0 表示关闭）与最多缓存的用户数
+PERM_CACHE_TTL = float(os.getenv("PERM_CACHE_TTL", "60"))
+PERM_CACHE_SIZE = int(os.getenv("PERM_CACHE_SIZE", "1024"))
+
+# 连接池：大小、取连接超时、空闲多久后做健康检查、单条语句超时
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+DB_HEALTHCHECK_IDLE_SEC = float(os.getenv("DB_HEALTHCHECK_IDLE_SEC", "30"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "15000"))
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "5"))
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "500"))
+
+
+def _gevent_wait_callback(conn, timeout=None):
+    # Same as psycogreen.gevent: yield to the hub while libpq waits on the socket,
+    # otherwise every query blocks all greenlets of the worker.
+    from gevent.socket import wait_read, wait_write
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError(f"Bad result from poll: {state!r}")
+
+
+def _install_gevent_wait_callback():
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    if not monkey.is_module_patched("socket"):
+        return False
+    extensions.set_wait_callback(_gevent_wait_callback)
+    return True
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    """No connection became free within DB_POOL_TIMEOUT seconds."""
+
+
+class ConnectionPool:
+    """
+    有界连接池：线程/greenlet 安全（gevent 下 threading 已被 patch），
+    取连接带超时，空闲过久的连接在取出时先做健康检查，归还时回滚未结束的事务。
+    Bounded, blocking pool. ``getconn`` waits up to ``timeout`` seconds for a free
+    slot, health-checks connections idle for more than ``healthcheck_idle`` seconds,
+    and ``putconn`` rolls back any open transaction so no session idles in one.
+    """
+
+    def __init__(self, minconn, maxconn, timeout, healthcheck_idle, **connect_kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.healthcheck_idle = healthcheck_idle
+        self.connect_kwargs = connect_kwargs
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._idle = []  # [(conn, returned_at)], LIFO so warm connections are reused
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self.waiting = 0
+        self.created = 0
+        self.discarded = 0
+        self.timeouts = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+        self.checkouts = 0
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        conn = psycopg2.connect(**self.connect_kwargs)
+        self.created += 1
+        return conn
+
+    def _discard(self, conn):
+        self.discarded += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _healthy(self, conn, idle_for):
+        if conn.closed:
+            return False
+        if idle_for < self.healthcheck_idle:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def getconn(self):
+        start = time.perf_counter()
+        with self._lock:
+            self.waiting += 1
+        try:
+            acquired = self._slots.acquire(timeout=self.timeout)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        waited = (time.perf_counter() - start) * 1000
+        if not acquired:
+            with self._lock:
+                self.timeouts += 1
+            raise PoolTimeout(f"no DB connection available within {self.timeout}s "
+                              f"({self.maxconn} in use)")
+        try:
+            while True:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    conn = self._connect()
+                    break
+                conn, returned_at = item
+                if self._healthy(conn, time.monotonic() - returned_at):
+                    break
+                self._discard(conn)
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._in_use += 1
+            self.checkouts += 1
+            self.wait_ms_total += waited
+            self.wait_ms_max = max(self.wait_ms_max, waited)
+        return conn
+
+    def putconn(self, conn):
+        keep = not conn.closed
+        if keep and conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except Exception:
+                keep = False
+        with self._lock:
+            self._in_use -= 1
+            if keep:
+                self._idle.append((conn, time.monotonic()))
+        if not keep:
+            self._discard(conn)
+        self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max": self.maxconn,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiting": self.waiting,
+                "created": self.created,
+                "discarded": self.discarded,
+                "timeouts": self.timeouts,
+                "checkouts": self.checkouts,
+                "wait_ms_avg": round(self.wait_ms_total / self.checkouts, 3) if self.checkouts else None,
+                "wait_ms_max": round(self.wait_ms_max, 3),
+            }
+
+
 # 全局连接池
 _pg_pool = None
+_pool_lock = threading.Lock()
 
 def init_db_pool():
     global _pg_pool
-    if _pg_pool is None:
+    with _pool_lock:
+        if _pg_pool is not None:
+            return
+        green = _install_gevent_wait_callback()
         try:
-            _pg_pool = psycopg2.pool.SimpleConnectionPool(
-                minconn=1,
-                maxconn=10,
+            _pg_pool = ConnectionPool(
+                DB_POOL_MIN,
+                DB_POOL_MAX,
+                DB_POOL_TIMEOUT,
+                DB_HEALTHCHECK_IDLE_SEC,
                 host=DB_HOST,
                 port=DB_PORT,
                 database=DB_NAME,
                 user=DB_USER,
-                password=DB_PASS
+                password=DB_PASS,
+                connect_timeout=DB_CONNECT_TIMEOUT,
+                options=f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}",
+                application_name="mqtt-web",
             )
-            print(f"[DB] Connection pool initialized for {DB_HOST}")
+            print(f"[DB] Connection pool initialized for {DB_HOST} "
+                  f"(max {DB_POOL_MAX}, timeout {DB_POOL_TIMEOUT}s, gevent={'on' if green else 'off'})")
         except Exception as e:
             print(f"[DB] Failed to initialize pool: {e}")
 
 def get_db_connection():
     if _pg_pool is None:
         init_db_pool()
+    if _pg_pool is None:
+        raise psycopg2.OperationalError("DB connection pool is not available")
     return _pg_pool.getconn()
 
 def release_db_connection(conn):
     if _pg_pool and conn:
         _pg_pool.putconn(conn)
 
+
+class QueryMetrics:
+    """
+    按查询函数统计调用次数、失败次数与耗时（含等待连接的时间）。
+    Per query-function call counts, failures and latency, exported via /api/admin/db/metrics.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._local = threading.local()  # greenlet-local under gevent
+
+    def timed(self, fn):
+        name = fn.__name__
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            self._local.failed = False
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                self._local.failed = True
+                raise
+            finally:
+                self.record(name, (time.perf_counter() - start) * 1000, self._local.failed)
+        return wrapper
+
+    def failed(self):
+        # Called from the except blocks of query functions that swallow their errors.
+        self._local.failed = True
+
+    def record(self, name, ms, failed):
+        with self._lock:
+            st = self._stats.get(name)
+            if st is None:
+                st = self._stats[name] = {"calls": 0, "errors": 0, "slow": 0, "total_ms": 0.0, "max_ms": 0.0}
+            st["calls"] += 1
+            st["errors"] += int(failed)
+            st["total_ms"] += ms
+            st["max_ms"] = max(st["max_ms"], ms)
+            if ms >= DB_SLOW_QUERY_MS:
+                st["slow"] += 1
+        if ms >= DB_SLOW_QUERY_MS:
+            print(f"[DB] Slow call {name}: {ms:.0f} ms")
+
+    def stats(self):
+        with self._lock:
+            return {
+                name: {**st, "total_ms": round(st["total_ms"], 3), "max_ms": round(st["max_ms"], 3),
+                       "avg_ms": round(st["total_ms"] / st["calls"], 3)}
+                for name, st in self._stats.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+_metrics = QueryMetrics()
+
+
+def db_metrics(reset=False):
+    stats = {
+        "pool": _pg_pool.stats() if _pg_pool else None,
+        "queries": _metrics.stats(),
+    }
+    if reset:
+        _metrics.reset()
+    return stats
+
+
+@_metrics.timed
 def authenticate_user(username, password):
     """
     验证用户登录。
@@ -57,15 +315,86 @@ def authenticate_user(username, password):
                     return {'id': user['id'], 'sso_id': user['sso_id']}
     except Exception as e:
         print(f"[DB] Auth error: {e}")
+        _metrics.failed()
     finally:
         release_db_connection(conn)
     return None
 
-def get_user_allowed_devices(username):
+class PermissionCache:
     """
-    获取用户有权访问的设备列表。
-    Admin 账号拥有所有权限。
-    Returns: List of dicts [{'device_id': str, 'mac_address': str}, ...]
+    进程内的用户→设备权限缓存（TTL + LRU）。
+    Per-process cache of allowed devices keyed by sso_id; entries expire after
+    ``ttl`` seconds and the least recently used user is evicted beyond ``maxsize``.
+    """
+
+    def __init__(self, ttl, maxsize):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # sso_id -> (expires_at, devices, macs)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.maxsize > 0
+
+    def get(self, username):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[username]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(username)
+            self.hits += 1
+            return entry
+
+    def put(self, username, devices):
+        macs = frozenset(d['mac_address'] for d in devices if d.get('mac_address'))
+        entry = (time.monotonic() + self.ttl, tuple(devices), macs)
+        with self._lock:
+            self._entries[username] = entry
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def invalidate(self, username=None):
+        with self._lock:
+            if username is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(username, None)
+
+    def stats(self):
+        with self._lock:
+            size = len(self._entries)
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "ttl": self.ttl,
+            "size": size,
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / total, 4) if total else None,
+        }
+
+
+_perm_cache = PermissionCache(PERM_CACHE_TTL, PERM_CACHE_SIZE)
+
+
+@_metrics.timed
+def _query_user_allowed_devices(username):
+    """
+    查询数据库中用户有权访问的设备。
+    Returns: list of dicts, or None if the query failed (failures are not cached).
     """
     conn = None
     devices = []
@@ -95,71 +424,210 @@ def get_user_allowed_devices(username):
                 })
     except Exception as e:
         print(f"[DB] Permission query error: {e}")
+        _metrics.failed()
+        return None
     finally:
         release_db_connection(conn)
     return devices
 
-def get_user_files(username):
+
+def _allowed_entry(username):
+    if _perm_cache.enabled:
+        entry = _perm_cache.get(username)
+        if entry is not None:
+            return entry
+    devices = _query_user_allowed_devices(username)
+    if devices is None:
+        return None, (), frozenset()
+    if _perm_cache.enabled:
+        return _perm_cache.put(username, devices)
+    return None, tuple(devices), frozenset(d['mac_address'] for d in devices if d.get('mac_address'))
+
+
+def get_user_allowed_devices(username):
+    """
+    获取用户有权访问的设备列表（经权限缓存）。
+    Admin 账号拥有所有权限。
+    Returns: List of dicts [{'device_id': str, 'mac_address': str}, ...]
+    """
+    _, devices, _ = _allowed_entry(username)
+    return [dict(d) for d in devices]
+
+
+def get_user_allowed_macs(username):
     """
-    获取用户有权下载的文件列表。
+    获取用户有权访问的 MAC 集合，用于 O(1) 权限判断。
+    Returns: frozenset of mac_address strings (as stored in device_info)
     """
+    return _allowed_entry(username)[2]
+
+
+def invalidate_permission_cache(username=None):
+    """
+    使权限缓存失效；username 为 None 时清空全部。
+    Call after group membership or device ownership changes.
+    """
+    _perm_cache.invalidate(username)
+
+
+def permission_cache_stats():
+    return _perm_cache.stats()
+
+def encode_file_cursor(file_datetime, file_id):
+    """Opaque keyset cursor for list_files(): the (file_datetime, id) of the last row sent."""
+    raw = f"{file_datetime.isoformat() if file_datetime else ''}|{file_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_file_cursor(cursor):
+    """Inverse of encode_file_cursor(); raises ValueError on a malformed cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        ts, file_id = raw.rsplit("|", 1)
+        return (datetime.fromisoformat(ts) if ts else None), int(file_id)
+    except Exception as e:
+        raise ValueError(f"invalid cursor: {cursor!r}") from e
+
+
+@_metrics.timed
+def list_files(macs=None, start_date=None, end_date=None, min_size=None, max_size=None,
+               cursor=None, limit=100):
+    """
+    按 (file_datetime, id) 倒序做 keyset 分页的文件列表，支持日期范围与大小过滤。
+    macs: iterable of mac_address to restrict to; None means all devices (admin).
+    cursor: value returned as next_cursor by the previous page.
+    Returns: (list of dicts, next_cursor or None), or (None, None) if the query failed.
+    """
+    where, params = [], []
+    if macs is not None:
+        macs = list(macs)
+        if not macs:
+            return [], None
+        if len(macs) == 1:
+            # Plain equality lets the planner walk idx_data_files_mac_dt_id in order (no sort).
+            where.append("mac_address = %s")
+            params.append(macs[0])
+        else:
+            where.append("mac_address = ANY(%s)")
+            params.append(macs)
+    if start_date:
+        where.append("file_date >= %s")
+        params.append(start_date)
+    if end_date:
+        where.append("file_date <= %s")
+        params.append(end_date)
+    if min_size is not None:
+        where.append("file_size >= %s")
+        params.append(min_size)
+    if max_size is not None:
+        where.append("file_size <= %s")
+        params.append(max_size)
+    if cursor:
+        last_dt, last_id = decode_file_cursor(cursor)
+        if last_dt is None:
+            # Rows without file_datetime sort last (NULLS LAST); continue among them by id.
+            where.append("file_datetime IS NULL AND id < %s")
+            params.append(last_id)
+        else:
+            where.append("(file_datetime < %s OR file_datetime IS NULL OR (file_datetime = %s AND id < %s))")
+            params.extend([last_dt, last_dt, last_id])
+
+    sql = f"""
+        SELECT id, mac_address, file_name, file_path, file_size, compressed_size,
+               file_date, file_time, file_datetime
+        FROM data_files
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY file_datetime DESC NULLS LAST, id DESC
+        LIMIT %s
+    """
+    # Fetch one extra row to know whether another page exists.
+    params.append(limit + 1)
+
     conn = None
-    files = []
     try:
         conn = get_db_connection()
-        with conn.cursor(cursor_factory=extras.DictCursor) as cur:
-            if username == 'admin':
-                cur.execute("""
-                    SELECT f.file_name, f.file_path, f.mac_address, f.file_size, f.file_date 
-                    FROM data_files f 
-                    ORDER BY f.file_datetime DESC LIMIT 100
-                """)
-            else:
-                # 仅查询用户所属组下的设备产生的文件
-                sql = """
-                    SELECT f.file_name, f.file_path, f.mac_address, f.file_size, f.file_date
-                    FROM data_files f
-                    JOIN device_info d ON f.mac_address = d.mac_address
-                    JOIN user_group ug ON d.group_id = ug.group_id
-                    JOIN app_user_user_group map ON ug.id = map.user_group_id
-                    JOIN app_user u ON map.user_id = u.id
-                    WHERE u.sso_id = %s
-                    ORDER BY f.file_datetime DESC LIMIT 100
-                """
-                cur.execute(sql, (username,))
-            
+        with conn.cursor(cursor_factory=extras.RealDictCursor) as cur:
+            cur.execute(sql, params)
             rows = cur.fetchall()
-            for row in rows:
-                files.append(dict(row))
+        conn.commit()
     except Exception as e:
-        print(f"[DB] File query error: {e}")
+        print(f"[DB] File list query error: {e}")
+        _metrics.failed()
+        return None, None
     finally:
         release_db_connection(conn)
-    return files
 
-def get_device_dates(mac):
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_file_cursor(rows[-1]["file_datetime"], rows[-1]["id"])
+    return [dict(r) for r in rows], next_cursor
+
+
+def get_user_files(username, limit=100):
     """
-    Get distinct dates for a device.
+    获取用户有权下载的最新文件（list_files 的第一页）。
+    """
+    macs = None if username == 'admin' else get_user_allowed_macs(username)
+    files, _ = list_files(macs, limit=limit)
+    return files or []
+
+
+@_metrics.timed
+def get_device_date_summary(mac):
+    """
+    每个日期的文件数与总大小，读取物化视图 data_files_daily（由 sink 定期刷新）。
+    Days since the last refresh are taken from data_files directly so fresh recordings
+    show up immediately; falls back to a plain GROUP BY if the view does not exist.
+    Returns: list of {'file_date', 'file_count', 'total_size'} newest first.
     """
     conn = None
-    dates = []
     try:
         conn = get_db_connection()
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT DISTINCT file_date 
-                FROM data_files 
-                WHERE mac_address = %s
-                ORDER BY file_date DESC
-            """, (mac,))
-            rows = cur.fetchall()
-            dates = [row[0] for row in rows]
+        with conn.cursor(cursor_factory=extras.RealDictCursor) as cur:
+            try:
+                cur.execute("""
+                    WITH s AS (
+                        SELECT file_date, file_count, total_size, refreshed_at
+                        FROM data_files_daily WHERE mac_address = %s
+                    ), cutoff AS (
+                        SELECT COALESCE((SELECT max(refreshed_at) FROM data_files_daily), '-infinity')::date
+                               - 1 AS day
+                    )
+                    SELECT file_date, file_count, total_size FROM s
+                    WHERE file_date < (SELECT day FROM cutoff)
+                    UNION ALL
+                    SELECT file_date, count(*), COALESCE(sum(file_size), 0)
+                    FROM data_files
+                    WHERE mac_address = %s AND file_date >= (SELECT day FROM cutoff)
+                    GROUP BY file_date
+                    ORDER BY file_date DESC
+                """, (mac, mac))
+            except psycopg2.Error:
+                conn.rollback()
+                cur.execute("""
+                    SELECT file_date, count(*) AS file_count, COALESCE(sum(file_size), 0) AS total_size
+                    FROM data_files WHERE mac_address = %s
+                    GROUP BY file_date ORDER BY file_date DESC
+                """, (mac,))
+            rows = [dict(r) for r in cur.fetchall()]
+        conn.commit()
+        return rows
     except Exception as e:
-        print(f"[DB] Date query error: {e}")
+        print(f"[DB] Date summary query error: {e}")
+        _metrics.failed()
+        return []
     finally:
         release_db_connection(conn)
-    return dates
 
+
+def get_device_dates(mac):
+    """
+    Get distinct dates for a device.
+    """
+    return [row['file_date'] for row in get_device_date_summary(mac)]
+
+@_metrics.timed
 def get_device_files(mac, date_str):
     """
     Get files for a specific device and date.
@@ -180,6 +648,7 @@ def get_device_files(mac, date_str):
                 files.append(dict(row))
     except Exception as e:
         print(f"[DB] File list query error: {e}")
+        _metrics.failed()
     finally:
         release_db_connection(conn)
     return files
@@ -0,0 +1,308 @@
+import queue
+import socket
+import ssl
+import threading
+import time
+from typing import Dict, Iterator, Optional
+from urllib.parse import urlsplit
+
+import gevent
+
+
+class StreamSubscriber:
+    """Downstream side of a shared upstream SSE connection (one per browser tab)."""
+
+    def __init__(self, maxsize: int) -> None:
+        self.queue: "queue.Queue[Optional[bytes]]" = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def push(self, chunk: bytes) -> None:
+        try:
+            self.queue.put_nowait(chunk)
+        except queue.Full:
+            # Slow tab: drop the oldest complete event(s) rather than blocking the fan-out.
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+            except queue.Empty:
+                pass
+            try:
+                self.queue.put_nowait(chunk)
+            except queue.Full:
+                self.dropped += 1
+
+    def close(self) -> None:
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+
+
+class UpstreamStream:
+    """One gevent-native HTTP connection to a bridge SSE path, fanned out to all subscribers.
+
+    Upstream bytes are only split on SSE event boundaries (blank line) so every
+    subscriber receives whole events; payloads are never JSON-decoded here.
+    The connection is re-established with backoff until the last subscriber
+    leaves and the linger period expires.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        path: str,
+        *,
+        connect_timeout: float,
+        linger_sec: float,
+        subscriber_queue_size: int,
+        on_idle=None,
+    ) -> None:
+        parts = urlsplit(base_url)
+        self.path = path
+        self._scheme = parts.scheme or "http"
+        self._host = parts.hostname or "localhost"
+        self._port = parts.port or (443 if self._scheme == "https" else 80)
+        self._base_path = parts.path.rstrip("/")
+        self._connect_timeout = connect_timeout
+        self._linger_sec = linger_sec
+        self._subscriber_queue_size = subscriber_queue_size
+        self._on_idle = on_idle
+        self._subscribers: list[StreamSubscriber] = []
+        self._lock = threading.Lock()
+        self._idle_since: Optional[float] = None
+        self._closing = False
+        self._greenlet: Optional[gevent.Greenlet] = None
+        self._sock: Optional[socket.socket] = None
+        self.connected = False
+        self.connects = 0
+        self.bytes_in = 0
+        self.events_in = 0
+
+    # ------------------------------------------------------------------ subscribers
+    def subscribe(self) -> Optional[StreamSubscriber]:
+        """Attach a subscriber; returns None if this upstream is already shutting down."""
+        sub = StreamSubscriber(self._subscriber_queue_size)
+        with self._lock:
+            if self._closing:
+                return None
+            self._subscribers.append(sub)
+            self._idle_since = None
+            if self._greenlet is None or self._greenlet.dead:
+                self._greenlet = gevent.spawn(self._run)
+        return sub
+
+    def unsubscribe(self, sub: StreamSubscriber) -> None:
+        with self._lock:
+            if sub in self._subscribers:
+                self._subscribers.remove(sub)
+            if not self._subscribers and self._idle_since is None:
+                self._idle_since = time.monotonic()
+                gevent.spawn_later(self._linger_sec + 0.1, self._reap)
+
+    def _reap(self) -> None:
+        # A quiet upstream blocks in recv(); closing the socket lets _run notice it is idle.
+        if self._should_stop():
+            self._close_sock()
+
+    def _fan_out(self, chunk: bytes) -> None:
+        with self._lock:
+            subs = list(self._subscribers)
+        for sub in subs:
+            sub.push(chunk)
+
+    def _should_stop(self) -> bool:
+        with self._lock:
+            if self._subscribers:
+                return False
+            if self._idle_since is not None and time.monotonic() - self._idle_since >= self._linger_sec:
+                # Decided under the lock so no subscriber can slip in after this point.
+                self._closing = True
+            return self._closing
+
+    # ------------------------------------------------------------------ upstream
+    def _run(self) -> None:
+        backoff = 1.0
+        try:
+            while not self._should_stop():
+                try:
+                    for chunk in self._read_events():
+                        backoff = 1.0
+                        self._fan_out(chunk)
+                        if self._should_stop():
+                            return
+                except (OSError, ValueError) as exc:
+                    print(f"[stream-proxy] upstream {self.path} failed: {exc}")
+                finally:
+                    self._close_sock()
+                if self._should_stop():
+                    return
+                # Keep subscribers attached; the new upstream sends a fresh snapshot.
+                self._fan_out(b": upstream reconnecting\n\n")
+                gevent.sleep(backoff)
+                backoff = min(backoff * 2, 15.0)
+        finally:
+            self._close_sock()
+            with self._lock:
+                subs = list(self._subscribers)
+                self._subscribers.clear()
+            for sub in subs:
+                sub.close()
+            if self._on_idle:
+                self._on_idle(self)
+
+    def _close_sock(self) -> None:
+        self.connected = False
+        sock, self._sock = self._sock, None
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def _open(self) -> socket.socket:
+        sock = socket.create_connection((self._host, self._port), timeout=self._connect_timeout)
+        if self._scheme == "https":
+            ctx = ssl.create_default_context()
+            sock = ctx.wrap_socket(sock, server_hostname=self._host)
+        # Idle SSE links may stay quiet for a long time; no read timeout.
+        sock.settimeout(None)
+        return sock
+
+    def _read_events(self) -> Iterator[bytes]:
+        sock = self._sock = self._open()
+        request = (
+            f"GET {self._base_path}{self.path} HTTP/1.1\r\n"
+            f"Host: {self._host}:{self._port}\r\n"
+            "Accept: text/event-stream\r\n"
+            "Cache-Control: no-cache\r\n"
+            "Connection: close\r\n\r\n"
+        )
+        sock.sendall(request.encode("ascii"))
+
+        buf = b""
+        while b"\r\n\r\n" not in buf:
+            data = sock.recv(65536)
+            if not data:
+                raise ValueError("upstream closed before headers")
+            buf += data
+        head, buf = buf.split(b"\r\n\r\n", 1)
+        lines = head.decode("latin-1").split("\r\n")
+        status = lines[0].split(" ", 2)
+        if len(status) < 2 or status[1] != "200":
+            raise ValueError(f"upstream status {lines[0]!r}")
+        headers = {}
+        for line in lines[1:]:
+            key, _, value = line.partition(":")
+            headers[key.strip().lower()] = value.strip().lower()
+        chunked = "chunked" in headers.get("transfer-encoding", "")
+
+        self.connected = True
+        self.connects += 1
+        pending = b""
+        for data in self._body(sock, buf, chunked):
+            self.bytes_in += len(data)
+            pending += data
+            # Forward everything up to the last complete event in one chunk.
+            cut = pending.rfind(b"\n\n")
+            if cut < 0:
+                continue
+            cut += 2
+            out, pending = pending[:cut], pending[cut:]
+            self.events_in += out.count(b"\n\n")
+            yield out
+
+    @staticmethod
+    def _body(sock: socket.socket, buf: bytes, chunked: bool) -> Iterator[bytes]:
+        if not chunked:
+            if buf:
+                yield buf
+            while True:
+                data = sock.recv(65536)
+                if not data:
+                    return
+                yield data
+
+        # Minimal Transfer-Encoding: chunked decoder.
+        while True:
+            while b"\r\n" not in buf:
+                data = sock.recv(65536)
+                if not data:
+                    return
+                buf += data
+            size_line, buf = buf.split(b"\r\n", 1)
+            size = int(size_line.split(b";", 1)[0].strip() or b"0", 16)
+            if size == 0:
+                return
+            while len(buf) < size + 2:
+                data = sock.recv(65536)
+                if not data:
+                    return
+                buf += data
+            yield buf[:size]
+            buf = buf[size + 2:]
+
+    def stats(self) -> dict:
+        with self._lock:
+            subs = list(self._subscribers)
+        return {
+            "path": self.path,
+            "connected": self.connected,
+            "connects": self.connects,
+            "subscribers": len(subs),
+            "dropped": sum(sub.dropped for sub in subs),
+            "bytes_in": self.bytes_in,
+            "events_in": self.events_in,
+        }
+
+
+class StreamBroadcaster:
+    """Keeps at most one upstream connection per bridge path inside this web worker."""
+
+    def __init__(
+        self,
+        base_url: str,
+        *,
+        connect_timeout: float = 5.0,
+        linger_sec: float = 30.0,
+        subscriber_queue_size: int = 256,
+    ) -> None:
+        self._base_url = base_url
+        self._connect_timeout = connect_timeout
+        self._linger_sec = linger_sec
+        self._subscriber_queue_size = subscriber_queue_size
+        self._upstreams: Dict[str, UpstreamStream] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, path: str) -> tuple[UpstreamStream, StreamSubscriber]:
+        with self._lock:
+            upstream = self._upstreams.get(path)
+            sub = upstream.subscribe() if upstream is not None else None
+            if sub is None:
+                upstream = UpstreamStream(
+                    self._base_url,
+                    path,
+                    connect_timeout=self._connect_timeout,
+                    linger_sec=self._linger_sec,
+                    subscriber_queue_size=self._subscriber_queue_size,
+                    on_idle=self._drop_upstream,
+                )
+                self._upstreams[path] = upstream
+                sub = upstream.subscribe()
+        return upstream, sub
+
+    def _drop_upstream(self, upstream: UpstreamStream) -> None:
+        with self._lock:
+            if self._upstreams.get(upstream.path) is upstream:
+                del self._upstreams[upstream.path]
+
+    def stats(self) -> list[dict]:
+        with self._lock:
+            upstreams = list(self._upstreams.values())
+        return [item.stats() for item in upstreams]
+
+
+__all__ = [
+    "StreamBroadcaster",
+    "StreamSubscriber",
+    "UpstreamStream",
+]